@@ -10,28 +10,28 @@ warnings.filterwarnings('ignore', message='urllib3 v2 only supports OpenSSL')
 import gradio as gr
 from PIL import Image
 import numpy as np
-import sqlite3
 import pandas as pd
-import os
 from datetime import datetime
-from tensorflow.keras.datasets import mnist
-from models import create_mlp, create_small_cnn, create_deeper_cnn, load_model, save_model
-from utils import preprocess_image
-import plotly.graph_objects as go
-import time
+from lazy import lazy_import, startup_report
+from init_db import create_database
+from db import get_connection, query_runs, cached_until_change, HISTORY_PAGE_SIZE
+from jobs import scheduler
+from profiles import PERFORMANCE_PROFILES, DEFAULT_PROFILE
+from sweep import grid_space, random_space, run_sweep, SWEEP_ETA
+from inference import engine, prediction_cache, live_models
+from bulk import predict_bulk, OUTPUT_FORMATS
+import serve_http
+import dataset
+from utils import preprocess, preprocess_image
+from instrumentation import registry, timed, count
 
-# ============================================================================
-# DATA LOADING
-# ============================================================================
-# Load MNIST once at startup so we don't reload every time
-print("Loading MNIST dataset...")
-(x_train, y_train), (x_test, y_test) = mnist.load_data()
+# Plotly is only needed for the History charts, so it's imported on the
+# first refresh (see lazy.py). pandas stays a normal import because
+# gradio's Dataframe component loads it at startup anyway.
+go = lazy_import('plotly.graph_objects')
 
-# Normalise pixel values to 0-1
-x_train = x_train.astype('float32') / 255.0
-x_test = x_test.astype('float32') / 255.0
-
-print(f"Dataset loaded: {x_train.shape[0]} training images, {x_test.shape[0]} test images")
+# Make sure the database has all the latest tables/columns (safe to run every time)
+create_database(verbose=False)
 
 
 # ============================================================================
@@ -57,196 +57,157 @@ custom_theme = gr.themes.Soft(
 # DATABASE FUNCTIONS
 # ============================================================================
 
-def save_training_run(architecture, epochs, batch_size, val_accuracy, duration=None):
-    """Save training run to database with unique filename."""
-    conn = sqlite3.connect('artifacts/training_history.db')
-    cursor = conn.cursor()
-    
-    # Get or create model_id for this architecture
-    cursor.execute('SELECT model_id FROM models WHERE architecture = ?', (architecture,))
-    result = cursor.fetchone()
-    
-    if result:
-        model_id = result[0]  # Architecture already exists
-    else:
-        # First time training this architecture - create new model entry
-        cursor.execute('INSERT INTO models (architecture) VALUES (?)', (architecture,))
-        model_id = cursor.lastrowid  # Get the auto-generated model_id
-    
-    # Get next run_id for unique filename
-    cursor.execute('SELECT MAX(run_id) FROM training_runs')
-    max_run = cursor.fetchone()[0]
-    next_run_id = 1 if max_run is None else max_run + 1
-    
-    # Create unique filename
-    arch_clean = architecture.lower().replace(' ', '_')
-    model_filename = f'model_{arch_clean}_run{next_run_id}.keras'
-    
-    # Insert training run record
-    cursor.execute('''
-        INSERT INTO training_runs 
-        (model_id, epochs, batch_size, val_accuracy, model_filename, duration)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (model_id, epochs, batch_size, val_accuracy, model_filename, duration))
-    
-    conn.commit()
-    conn.close()
-    
-    return model_filename
+# Columns of the History table
+HISTORY_COLUMNS = ['Run ID', 'Architecture', 'Epochs', 'Batch Size', 'Accuracy (%)', 'Filename', 'Timestamp']
 
+# "Sort By" choices in the History tab -> db.query_runs sort keys
+HISTORY_SORT_CHOICES = {
+    'Run ID': 'run_id',
+    'Architecture': 'architecture',
+    'Accuracy': 'val_accuracy',
+    'Training Time': 'duration',
+    'Timestamp': 'created_at',
+}
 
-def get_training_history():
-    """Get all training runs for display in History tab."""
-    conn = sqlite3.connect('artifacts/training_history.db')
-    cursor = conn.cursor()
-    
-    # Get all runs, newest first
-    cursor.execute('''
-        SELECT run_id, model_id, epochs, batch_size, val_accuracy, model_filename, created_at
-        FROM training_runs
-        ORDER BY run_id DESC
-    ''')
-    
-    runs = cursor.fetchall()
-    
-    # Handle empty case (no training runs yet)
+
+def _parse_date(text):
+    """'' -> None, 'YYYY-MM-DD' -> itself; anything else raises ValueError."""
+    text = (text or '').strip()
+    if text:
+        datetime.strptime(text, '%Y-%m-%d')
+    return text or None
+
+
+def get_training_history(page=1, page_size=HISTORY_PAGE_SIZE, sort_by='Run ID', descending=True,
+                         architecture='All', since='', until='', min_accuracy=0):
+    """
+    Get one page of training runs for the History tab.
+
+    Filtering, sorting and paging all happen in one SQL query (see
+    db.query_runs), so this stays quick however many runs there are.
+
+    Returns:
+        (DataFrame, page info text, page number) - the page number is
+        pulled back to the last page if it's past the end.
+    """
+    try:
+        filters = dict(
+            architecture=None if architecture in (None, 'All') else architecture,
+            since=_parse_date(since),
+            until=_parse_date(until),
+            min_accuracy=min_accuracy / 100 if min_accuracy else None,  # 98.12% → 0.9812
+        )
+    except ValueError:
+        return pd.DataFrame(columns=HISTORY_COLUMNS), "Dates must be in YYYY-MM-DD format.", page
+
+    page_size = int(page_size)
+    page = max(1, int(page or 1))
+    sort_key = HISTORY_SORT_CHOICES[sort_by]
+    runs, total = query_runs(page, page_size, sort_key, descending, **filters)
+
+    # Past the end (e.g. after tightening a filter) - show the last page instead
+    pages = max(1, -(-total // page_size))
+    if page > pages:
+        page = pages
+        runs, total = query_runs(page, page_size, sort_key, descending, **filters)
+
+    # Handle empty case (no training runs yet, or none match)
     if not runs:
-        conn.close()
         # Return empty DataFrame with the right column headers for display
-        return pd.DataFrame(columns=['Run ID', 'Architecture', 'Epochs', 'Batch Size', 'Accuracy (%)', 'Filename', 'Timestamp'])
-    
-    # Build list with architecture names (separate query for each - no JOIN)
-    data = []
-    for run_id, model_id, epochs, batch_size, val_accuracy, model_filename, created_at in runs:
-        # Look up architecture name for this model_id
-        cursor.execute('SELECT architecture FROM models WHERE model_id = ?', (model_id,))
-        result = cursor.fetchone()
-        arch = result[0] if result else 'Unknown'
-        
-        # Build dictionary for this row (easier than list of lists)
-        data.append({
-            'Run ID': run_id,
-            'Architecture': arch,
-            'Epochs': epochs,
-            'Batch Size': batch_size,
-            'Accuracy (%)': round(val_accuracy * 100, 2),  # Convert 0.9812 → 98.12%
-            'Filename': model_filename,
-            'Timestamp': created_at
-        })
-    
-    conn.close()
-    
-    # Convert to DataFrame for Gradio display
-    df = pd.DataFrame(data)
-    return df
+        return pd.DataFrame(columns=HISTORY_COLUMNS), "No training runs found.", page
 
+    data = [{
+        'Run ID': run['run_id'],
+        'Architecture': run['architecture'],
+        'Epochs': run['epochs'],
+        'Batch Size': run['batch_size'],
+        'Accuracy (%)': round(run['val_accuracy'] * 100, 2) if run['val_accuracy'] is not None else None,
+        'Filename': run['model_filename'],
+        'Timestamp': run['created_at']
+    } for run in runs]
 
-def get_latest_run_id():
-    """Get the run_id of the most recently created training run."""
-    conn = sqlite3.connect('artifacts/training_history.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT run_id FROM training_runs ORDER BY run_id DESC LIMIT 1')
-    result = cursor.fetchone()
-    
-    conn.close()
-    return result[0] if result else None
+    first = (page - 1) * page_size + 1
+    info = f"Runs {first}-{first + len(runs) - 1} of {total} (page {page} of {pages})"
+    return pd.DataFrame(data, columns=HISTORY_COLUMNS), info, page
 
 
-def save_epoch_metrics(run_id, epoch, train_accuracy, val_accuracy):
-    """Save epoch-by-epoch training metrics to database."""
-    conn = sqlite3.connect('artifacts/training_history.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        INSERT INTO metrics (run_id, epoch, train_accuracy, val_accuracy)
-        VALUES (?, ?, ?, ?)
-    ''', (run_id, epoch, train_accuracy, val_accuracy))
-    
-    conn.commit()
-    conn.close()
+def previous_history_page(page):
+    return max(1, int(page or 1) - 1)
+
+
+def next_history_page(page):
+    # get_training_history pulls this back if it's past the last page
+    return int(page or 1) + 1
+
+
+def _message_figure(text, color="#666666", size=16):
+    """Blank chart with a message in the middle (empty and error states)."""
+    fig = go.Figure()
+    fig.add_annotation(
+        text=text,
+        xref="paper", yref="paper",
+        x=0.5, y=0.5,
+        showarrow=False,
+        font=dict(size=size, color=color),
+        align="center"
+    )
+    fig.update_layout(
+        xaxis=dict(visible=False),
+        yaxis=dict(visible=False),
+        height=400
+    )
+    return fig
+
 
+# The charts are built once and reused by every refresh until the database
+# changes (see db.cached_until_change). Errors are shown but not cached
 
 def create_accuracy_chart():
     """Create accuracy timeline for latest training run."""
     try:
-        conn = sqlite3.connect('artifacts/training_history.db')
-        cursor = conn.cursor()
-        
-        # Get latest run
-        cursor.execute('SELECT run_id FROM training_runs ORDER BY run_id DESC LIMIT 1')
-        result = cursor.fetchone()
-        
-        if not result:
-            conn.close()
-            # Show empty state message
-            fig = go.Figure()
-            fig.add_annotation(
-                text="No training history yet<br><br>Train a model in the Train tab to see accuracy charts!",
-                xref="paper", yref="paper",
-                x=0.5, y=0.5,
-                showarrow=False,
-                font=dict(size=16, color="#666666"),
-                align="center"
-            )
-            fig.update_layout(
-                xaxis=dict(visible=False),
-                yaxis=dict(visible=False),
-                height=400
-            )
-            return fig
-        
-        run_id = result[0]
-        
-        # Get metrics for this run
-        cursor.execute('''
-            SELECT epoch, train_accuracy, val_accuracy
-            FROM metrics
-            WHERE run_id = ?
-            ORDER BY epoch
-        ''', (run_id,))
-        
-        data = cursor.fetchall()
-        conn.close()
-        
-        if not data:
-            # Metrics missing for this run
-            fig = go.Figure()
-            fig.add_annotation(
-                text="No epoch metrics found for latest run<br><br>Train a new model to generate metrics",
-                xref="paper", yref="paper",
-                x=0.5, y=0.5,
-                showarrow=False,
-                font=dict(size=16, color="#666666"),
-                align="center"
-            )
-            fig.update_layout(
-                xaxis=dict(visible=False),
-                yaxis=dict(visible=False),
-                height=400
-            )
-            return fig
+        return _build_accuracy_chart()
     except Exception as e:
         # Error state
-        fig = go.Figure()
-        fig.add_annotation(
-            text=f"Error loading accuracy chart<br><br>{str(e)}",
-            xref="paper", yref="paper",
-            x=0.5, y=0.5,
-            showarrow=False,
-            font=dict(size=14, color="#cc0000"),
-            align="center"
-        )
-        fig.update_layout(
-            xaxis=dict(visible=False),
-            yaxis=dict(visible=False),
-            height=400
-        )
-        return fig
+        return _message_figure(f"Error loading accuracy chart<br><br>{str(e)}", color="#cc0000", size=14)
+
+
+@cached_until_change
+def _build_accuracy_chart():
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    # Get latest run
+    cursor.execute('SELECT run_id FROM training_runs ORDER BY run_id DESC LIMIT 1')
+    result = cursor.fetchone()
+    
+    if not result:
+        # Show empty state message
+        return _message_figure("No training history yet<br><br>Train a model in the Train tab to see accuracy charts!")
+    
+    run_id = result[0]
+    
+    # Get metrics for this run
+    cursor.execute('''
+        SELECT epoch, train_accuracy, val_accuracy, val_kind
+        FROM metrics
+        WHERE run_id = ?
+        ORDER BY epoch
+    ''', (run_id,))
+    
+    data = cursor.fetchall()
+    
+    if not data:
+        # Metrics missing for this run (or still training - they're saved at the end)
+        return _message_figure("No epoch metrics found for latest run<br><br>Train a new model to generate metrics")
     
     epochs = [row[0] for row in data]
     train_acc = [row[1] * 100 for row in data]
-    val_acc = [row[2] * 100 for row in data]
+    
+    # Validation may be on the full test set, on a subset, or skipped for an
+    # epoch - full and subset results are plotted separately so an estimate
+    # never looks like the real thing
+    full_val = [(row[0], row[2] * 100) for row in data if row[2] is not None and row[3] != 'subset']
+    subset_val = [(row[0], row[2] * 100) for row in data if row[2] is not None and row[3] == 'subset']
     
     # Create plot
     fig = go.Figure()
@@ -255,11 +216,19 @@ def create_accuracy_chart():
         name='Training Accuracy',
         mode='lines+markers'
     ))
-    fig.add_trace(go.Scatter(
-        x=epochs, y=val_acc,
-        name='Validation Accuracy',
-        mode='lines+markers'
-    ))
+    if full_val:
+        fig.add_trace(go.Scatter(
+            x=[epoch for epoch, _ in full_val], y=[acc for _, acc in full_val],
+            name='Validation Accuracy',
+            mode='lines+markers'
+        ))
+    if subset_val:
+        fig.add_trace(go.Scatter(
+            x=[epoch for epoch, _ in subset_val], y=[acc for _, acc in subset_val],
+            name='Validation Accuracy (subset)',
+            mode='lines+markers',
+            line=dict(dash='dot')
+        ))
     
     fig.update_layout(
         title='Accuracy Over Epochs (Latest Run)',
@@ -274,70 +243,31 @@ def create_accuracy_chart():
 def create_performance_dashboard():
     """Create scatter plot showing accuracy vs training time for all models."""
     try:
-        conn = sqlite3.connect('artifacts/training_history.db')
-        cursor = conn.cursor()
-        
-        # Get all runs with performance data (no JOIN - query models separately)
-        cursor.execute('''
-            SELECT model_id, val_accuracy, duration
-            FROM training_runs
-            WHERE duration IS NOT NULL AND val_accuracy IS NOT NULL
-            ORDER BY model_id
-        ''')
-        
-        runs = cursor.fetchall()
-        
-        # Build data list with architecture names
-        data = []
-        for model_id, val_acc, duration in runs:
-            # Look up architecture for this model_id
-            cursor.execute('SELECT architecture FROM models WHERE model_id = ?', (model_id,))
-            arch_result = cursor.fetchone()
-            if arch_result:
-                data.append((arch_result[0], val_acc, duration))
-        
-        conn.close()
-        
-        if not data:
-            # Show empty state message
-            fig = go.Figure()
-            fig.add_annotation(
-                text="No performance data available<br><br>Train models to compare their speed and accuracy!",
-                xref="paper", yref="paper",
-                x=0.5, y=0.5,
-                showarrow=False,
-                font=dict(size=16, color="#666666"),
-                align="center"
-            )
-            fig.update_layout(
-                xaxis=dict(visible=False),
-                yaxis=dict(visible=False),
-                height=400
-            )
-            return fig
+        return _build_performance_dashboard()
     except Exception as e:
         # Error state
-        fig = go.Figure()
-        fig.add_annotation(
-            text=f"Error loading performance dashboard<br><br>{str(e)}",
-            xref="paper", yref="paper",
-            x=0.5, y=0.5,
-            showarrow=False,
-            font=dict(size=14, color="#cc0000"),
-            align="center"
-        )
-        fig.update_layout(
-            xaxis=dict(visible=False),
-            yaxis=dict(visible=False),
-            height=400
-        )
-        return fig
+        return _message_figure(f"Error loading performance dashboard<br><br>{str(e)}", color="#cc0000", size=14)
+
+
+@cached_until_change
+def _build_performance_dashboard():
+    # All runs with performance data, with their architecture names
+    rows = get_connection().execute('''
+        SELECT models.architecture, training_runs.val_accuracy, training_runs.duration
+        FROM training_runs
+        JOIN models ON models.model_id = training_runs.model_id
+        WHERE training_runs.duration IS NOT NULL AND training_runs.val_accuracy IS NOT NULL
+        ORDER BY models.model_id
+    ''').fetchall()
     
-    # Prepare data for plotting
-    architectures = []
-    accuracies = []
-    durations = []
-    colors = []
+    if not rows:
+        # Show empty state message
+        return _message_figure("No performance data available<br><br>Train models to compare their speed and accuracy!")
+    
+    # Group (duration, accuracy %) points by architecture in one pass
+    points = {}
+    for arch, acc, dur in rows:
+        points.setdefault(arch, []).append((dur, acc * 100))
     
     # Colour mapping for architectures
     color_map = {
@@ -346,21 +276,13 @@ def create_performance_dashboard():
         'Deeper CNN': '#2ca02c' # Green
     }
     
-    for arch, acc, dur in data:
-        architectures.append(arch)
-        accuracies.append(acc * 100)  # Convert to percentage
-        durations.append(dur)
-        colors.append(color_map.get(arch, '#9467bd'))  # Default purple
-    
     # Create scatter plot
     fig = go.Figure()
     
     # Add traces for each architecture
-    for arch in set(architectures):
-        arch_mask = [a == arch for a in architectures]
-        arch_accuracies = [accuracies[i] for i in range(len(accuracies)) if arch_mask[i]]
-        arch_durations = [durations[i] for i in range(len(durations)) if arch_mask[i]]
-        arch_colors = [colors[i] for i in range(len(colors)) if arch_mask[i]]
+    for arch, arch_points in points.items():
+        arch_durations = [dur for dur, _ in arch_points]
+        arch_accuracies = [acc for _, acc in arch_points]
         
         fig.add_trace(go.Scatter(
             x=arch_durations,
@@ -369,7 +291,7 @@ def create_performance_dashboard():
             name=arch,
             marker=dict(
                 size=10,
-                color=arch_colors[0] if arch_colors else '#9467bd',
+                color=color_map.get(arch, '#9467bd'),  # Default purple
                 line=dict(width=2, color='white')
             ),
             text=[f'{arch}<br>Accuracy: {acc:.1f}%<br>Time: {dur:.1f}s' 
@@ -392,131 +314,82 @@ def get_best_models():
     """
     Find the best performing model for each architecture.
     Returns a dictionary: {'Architecture': ('filename.keras', accuracy)}
+
+    Comes from the best_models table (updated as training runs finish) and
+    is only re-read when the database changes, so it costs next to nothing
+    per prediction. A newly trained best model is warmed up in the
+    background and swapped in (see inference.BestModelSwitcher).
     """
-    conn = sqlite3.connect('artifacts/training_history.db')
-    cursor = conn.cursor()
-    
-    # Get all architectures (with model_id for lookup)
-    cursor.execute('SELECT model_id, architecture FROM models')
-    models = cursor.fetchall()
-    
-    best_models = {}
-    
-    for model_id, arch in models:
-        # Find best run for this architecture (highest validation accuracy)
-        # Simple query without JOIN
-        cursor.execute('''
-            SELECT model_filename, val_accuracy 
-            FROM training_runs
-            WHERE model_id = ?
-            ORDER BY val_accuracy DESC
-            LIMIT 1
-        ''', (model_id,))
-        
-        result = cursor.fetchone()
-        if result:
-            filename = result[0]
-            # Verify file exists before adding
-            if os.path.exists(f'artifacts/{filename}'):
-                best_models[arch] = (filename, result[1])
-            else:
-                print(f"Warning: Best model for {arch} ({filename}) not found on disk.")
-    
-    conn.close()
-    return best_models
+    return live_models.current()
 
 
 # ============================================================================
 # TRAINING FUNCTIONS
 # ============================================================================
 
-def train_new_model(architecture, epochs, batch_size):
-    """Train a model (MLP or CNN) and show progress each epoch."""
+def start_training_job(architecture, epochs, batch_size, tflite_export="None", input_pipeline="NumPy arrays",
+                       val_every=1, val_subset=0, profile=DEFAULT_PROFILE):
+    """
+    Queue a training job (see jobs.py) and return its ID straight away.
+
+    The training itself runs in a separate worker process, so this
+    handler doesn't hold up the app while a model trains.
+    """
+    job_id = scheduler.submit(architecture, epochs, batch_size, tflite_export, input_pipeline,
+                              val_every=val_every, val_subset=val_subset, profile=profile)
+    return job_id, f"Job {job_id} submitted ({architecture}, {int(epochs)} epochs)..."
+
+
+def watch_training_job(job_id):
+    """Stream a job's progress until it finishes - also used to reattach after a refresh."""
+    if not job_id:
+        yield "Enter a job ID to follow (see the job list below)."
+        return
     try:
-        # Gradio sends these as strings
-        epochs = int(epochs)
-        batch_size = int(batch_size)
-        
-        # Start timing
-        start_time = time.time()
-        
-        # Create model based on selected architecture
-        if architecture == "MLP":
-            new_model = create_mlp()
-        elif architecture == "Small CNN":
-            new_model = create_small_cnn()
-        elif architecture == "Deeper CNN":
-            new_model = create_deeper_cnn()
-        else:
-            yield f"Error: Unknown architecture '{architecture}'"
-            return
-        
-        # Initial message
-        yield f"Starting training ({architecture})...\nEpochs: {epochs}, Batch Size: {batch_size}\n\n"
-        
-        # Get run_id for this training session (save metrics later)
-        run_id = None
-        
-        # Train one epoch at a time to show progress
-        all_results = []
-        for epoch in range(epochs):
-            print(f"Training epoch {epoch + 1}/{epochs}...")
-            
-            # Train for one epoch
-            history = new_model.fit(
-                x_train, y_train,
-                epochs=1,
-                batch_size=batch_size,
-                validation_data=(x_test, y_test),
-                verbose=0  # Suppress Keras output
-            )
-            
-            # Get accuracy for this epoch
-            train_acc = history.history['accuracy'][0] * 100
-            val_acc = history.history['val_accuracy'][0] * 100
-            final_val_acc = history.history['val_accuracy'][0]  # Store for database
-            
-            # Save metrics to database (get run_id on first epoch)
-            if run_id is None:
-                # Calculate duration so far (for first epoch)
-                current_duration = time.time() - start_time
-                # Save training run first to get run_id
-                model_filename = save_training_run(architecture, epochs, batch_size, final_val_acc, current_duration)
-                run_id = get_latest_run_id()
-            
-            # Save epoch metrics
-            save_epoch_metrics(run_id, epoch + 1, history.history['accuracy'][0], history.history['val_accuracy'][0])
-            
-            # Store results
-            epoch_result = f"Epoch {epoch + 1}/{epochs}: Train Acc = {train_acc:.2f}%, Val Acc = {val_acc:.2f}%"
-            all_results.append(epoch_result)
-            
-            # Yield progress update (shows all previous epochs + current)
-            yield "\n".join(all_results) + "\n\n"
-        
-        # Save model file
-        model_path = f'artifacts/{model_filename}'
-        save_model(new_model, model_path)
-        print(f"Model saved to {model_path}")
-        
-        # Calculate total training duration
-        total_duration = time.time() - start_time
-        
-        # Update duration in database
-        conn = sqlite3.connect('artifacts/training_history.db')
-        cursor = conn.cursor()
-        cursor.execute('UPDATE training_runs SET duration = ? WHERE run_id = ?', (total_duration, run_id))
-        conn.commit()
-        conn.close()
+        for text in scheduler.watch(job_id, timeout=1.0):
+            yield f"[Job {job_id.strip()}]\n{text}"
+    except KeyError as e:
+        yield e.args[0]
+
+
+def cancel_training_job(job_id):
+    """Cancel a queued or running job."""
+    if scheduler.cancel(job_id):
+        return f"Cancelling job {job_id.strip()}..."
+    return f"Job '{job_id}' isn't queued or running - nothing to cancel."
+
+
+def get_job_list():
+    """Training jobs for the job list, newest first."""
+    rows = [job.summary() for job in scheduler.list_jobs()]
+    columns = ['Job ID', 'Architecture', 'Epochs', 'Batch Size', 'Profile', 'Status', 'Running for (s)', 'Submitted']
+    return pd.DataFrame(rows, columns=columns)
+
+
+SWEEP_COLUMNS = ['Trial', 'Architecture', 'Batch Size', 'Epochs', 'Epochs Run', 'Best Val Acc (%)', 'Status']
+
+
+def run_sweep_ui(architectures, batch_sizes, epochs, search, n_trials, eta):
+    """Run a hyperparameter sweep (see sweep.py), streaming its status and trial table."""
+    try:
+        # "32, 64, 128" -> [32, 64, 128]
+        batch_sizes = [int(value) for value in str(batch_sizes).replace(',', ' ').split()]
+        epochs = [int(value) for value in str(epochs).replace(',', ' ').split()]
+        if not architectures or not batch_sizes or not epochs:
+            raise ValueError("Pick at least one architecture, batch size and epoch count")
         
-        # Final summary
-        final_result = "\n".join(all_results) + f"\n\nTraining Complete!\nModel saved to: {model_path}\nSaved to database with Run ID {run_id}\nTotal time: {total_duration:.1f}s"
-        yield final_result
+        if search == "Random":
+            configs = random_space(architectures, batch_sizes, epochs, n_trials)
+        else:
+            configs = grid_space(architectures, batch_sizes, epochs)
         
-    except Exception as e:
-        yield f"Error during training: {str(e)}"
+        for text, trials in run_sweep(configs, eta=int(eta)):
+            yield text, pd.DataFrame([trial.row() for trial in trials], columns=SWEEP_COLUMNS)
+    except ValueError as e:
+        yield f"Error: {e}", pd.DataFrame(columns=SWEEP_COLUMNS)
 
 
+@timed('predict.total')
 def predict_with_validation(input_method, uploaded_image, drawn_image):
     """Predict digit from uploaded or drawn image."""
     try:
@@ -555,23 +428,22 @@ def predict_with_validation(input_method, uploaded_image, drawn_image):
             blank_image = Image.new('L', (28, 28), 255)
             return blank_image, blank_image, f"❌ Invalid {input_type} image format. Please try again."
         
-        # Check if image has any content (not completely empty/white)
+        # Greyscale, empty check, resize to 28×28 and normalise in one pass.
+        # Drawn images get inverted (Sketchpad draws black on white, MNIST expects white on black)
         try:
-            img_array = np.array(image)
-            # Convert to greyscale if needed
-            if len(img_array.shape) == 3:
-                img_array = np.mean(img_array, axis=2)
-            
-            # Check if image is mostly empty (all white pixels)
-            if np.mean(img_array) > 250:  # Very light, probably empty
-                blank_image = Image.new('L', (28, 28), 255)
-                return blank_image, blank_image, f"❌ {input_type.capitalize()} image appears to be empty. Please provide a clearer digit."
+            img_input, is_empty = preprocess(image, invert=(input_type == "drawn"))
         except Exception as e:
             blank_image = Image.new('L', (28, 28), 255)
             return blank_image, blank_image, f"❌ Error processing {input_type} image: {str(e)}"
+
+        if is_empty:  # Very light, probably empty
+            count('predict.empty_images')
+            blank_image = Image.new('L', (28, 28), 255)
+            return blank_image, blank_image, f"❌ {input_type.capitalize()} image appears to be empty. Please provide a clearer digit."
         
         # Check if any models exist
-        best_models = get_best_models()
+        with timed('predict.best_models'):
+            best_models = get_best_models()
         if not best_models:
             blank_image = Image.new('L', (28, 28), 255)
             error_df = pd.DataFrame([{
@@ -588,17 +460,7 @@ def predict_with_validation(input_method, uploaded_image, drawn_image):
             # Original image (keep as-is for display)
             original = Image.fromarray(image)
             
-            # For drawn images, invert colours (Sketchpad draws black on white, MNIST expects white on black)
-            if input_type == "drawn":
-                # Invert the image before preprocessing
-                img_array = np.array(image)
-                if len(img_array.shape) == 3:
-                    img_array = np.mean(img_array, axis=2)
-                img_array = 255 - img_array  # Invert
-                image = img_array.astype('uint8')
-            
             # Preprocessed image (what model sees)
-            img_input = preprocess_image(image)
             img_preprocessed = Image.fromarray((img_input * 255).astype('uint8'))
         except Exception as e:
             blank_image = Image.new('L', (28, 28), 255)
@@ -608,31 +470,41 @@ def predict_with_validation(input_method, uploaded_image, drawn_image):
         model_rows = []     # structured data for sorting
         predictions = []
 
-        for arch, (filename, accuracy) in best_models.items():
-            try:
-                model_path = f'artifacts/{filename}'
-                model = load_model(model_path)
-                prediction = model.predict(img_input.reshape(1, 28, 28), verbose=0)
-                probs = prediction[0]
-                digit = int(probs.argmax())
-                confidence = float(probs[digit]) * 100
-                predictions.append(digit)
-                top_probs = sorted(enumerate(probs), key=lambda x: x[1], reverse=True)[:5]
-                model_rows.append({
-                    'arch': arch,
-                    'digit': digit,
-                    'confidence': confidence,
-                    'top_probs': top_probs
-                })
-            except Exception as e:
+        # One call runs every best model (fused graph built by the inference engine),
+        # batched together with any other predictions happening at the same time.
+        # An image that's been predicted before with the same models comes from the cache.
+        try:
+            with timed('predict.inference'):
+                all_probs = prediction_cache.predict(best_models, img_input)
+        except Exception as e:
+            all_probs = {arch: e for arch in best_models}
+
+        for arch in best_models:
+            result = all_probs[arch]
+            if isinstance(result, Exception):
+                count('predict.model_errors')
                 # Store error as very low confidence so it sinks to bottom
                 model_rows.append({
                     'arch': arch,
                     'digit': None,
                     'confidence': -1.0,
                     'top_probs': [],
-                    'error': str(e)
+                    'error': str(result),
+                    'timed_out': isinstance(result, TimeoutError)
                 })
+                continue
+
+            probs = result
+            digit = int(probs.argmax())
+            confidence = float(probs[digit]) * 100
+            predictions.append(digit)
+            top_probs = sorted(enumerate(probs), key=lambda x: x[1], reverse=True)[:5]
+            model_rows.append({
+                'arch': arch,
+                'digit': digit,
+                'confidence': confidence,
+                'top_probs': top_probs
+            })
 
         # Sort models by confidence descending
         sorted_models = sorted(model_rows, key=lambda m: m['confidence'], reverse=True)
@@ -650,7 +522,7 @@ def predict_with_validation(input_method, uploaded_image, drawn_image):
                 table_data.append({
                     'Rank': f"#{idx+1}",
                     'Architecture': m['arch'],
-                    'Prediction': 'Error',
+                    'Prediction': 'Timed out' if m['timed_out'] else 'Error',
                     'Confidence': '-',
                     'Top-5 Probabilities': m['error']
                 })
@@ -727,12 +599,8 @@ def predict_with_preview(image):
     
     for arch, (filename, accuracy) in best_models.items():
         try:
-            # Load model
-            model_path = f'artifacts/{filename}'
-            model = load_model(model_path)
-            
-            # Predict
-            pred = model.predict(img_input, verbose=0)
+            # Predict (model and its serving function are cached by the inference engine)
+            pred = engine.predict(filename, img_input)
             digit = int(pred.argmax())
             confidence = float(pred[0][digit]) * 100
             
@@ -753,6 +621,55 @@ def predict_with_preview(image):
     return original, img_preprocessed, "\n".join(results)
 
 
+def predict_bulk_ui(bulk_file, output_format):
+    """Score a whole .zip/.npy of digits, streaming progress like train_new_model."""
+    if bulk_file is None:
+        yield "❌ Please upload a .zip of images or a .npy file first.", None, None
+        return
+
+    # Gradio gives us a filepath (or a file object with .name on older versions)
+    path = bulk_file if isinstance(bulk_file, str) else bulk_file.name
+
+    results = None
+    try:
+        for status, results, output_path in predict_bulk(path, get_best_models(), output_format):
+            yield status, results, output_path
+    except Exception as e:
+        # Keep showing whatever was predicted before it failed
+        yield f"❌ Error during bulk prediction: {str(e)}", results, None
+
+
+# ============================================================================
+# DIAGNOSTICS
+# ============================================================================
+
+# Columns of the Diagnostics tab's stage table (see instrumentation.snapshot)
+DIAGNOSTICS_COLUMNS = ['Stage', 'Count', 'Errors', 'Mean (ms)', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)',
+                       'Max (ms)', 'Total (s)']
+
+
+def get_diagnostics():
+    """Stage timings, plus counters and gauges, for the Diagnostics tab."""
+    rows, counters = registry.snapshot()
+    stages_df = pd.DataFrame(rows, columns=DIAGNOSTICS_COLUMNS)
+
+    values = [{'Metric': name, 'Type': 'counter', 'Value': n} for name, n in counters.items()]
+    values += [
+        {'Metric': name, 'Type': 'gauge', 'Value': round(value, 4) if isinstance(value, float) else value}
+        for name, value in sorted(registry.gauges().items())
+    ]
+    values_df = pd.DataFrame(values, columns=['Metric', 'Type', 'Value'])
+
+    since = datetime.fromtimestamp(registry.started_at).strftime('%Y-%m-%d %H:%M:%S')
+    return stages_df, values_df, f"Collected since {since}"
+
+
+def reset_diagnostics():
+    """Start the timings and counters again from zero."""
+    registry.reset()
+    return get_diagnostics()
+
+
 # Create Gradio interface with tabs
 with gr.Blocks(theme=custom_theme, title="MNIST Digit Classifier") as demo:
     gr.Markdown("# 🔢 MNIST Digit Recognition")
@@ -786,6 +703,40 @@ with gr.Blocks(theme=custom_theme, title="MNIST Digit Classifier") as demo:
                     maximum=128,
                     step=16
                 )
+                tflite_input = gr.Dropdown(
+                    label="TFLite Export",
+                    choices=["None", "Float", "Int8"],
+                    value="None",
+                    info="Also save a TensorFlow Lite copy (Int8 = quantised, smaller and faster on CPU)"
+                )
+                pipeline_input = gr.Dropdown(
+                    label="Input Pipeline",
+                    choices=list(dataset.INPUT_PIPELINES),
+                    value="NumPy arrays",
+                    info="tf.data caches, shuffles and prefetches batches so input prep overlaps training"
+                )
+                with gr.Row():
+                    val_every_input = gr.Number(
+                        label="Validate Every N Epochs",
+                        value=1,
+                        minimum=1,
+                        step=1
+                    )
+                    val_subset_input = gr.Number(
+                        label="Validation Subset Size",
+                        value=0,
+                        minimum=0,
+                        maximum=10000,
+                        step=500,
+                        info="0 = full 10,000 test images. The last epoch always uses the full set"
+                    )
+                profile_input = gr.Dropdown(
+                    label="Performance Profile",
+                    choices=list(PERFORMANCE_PROFILES),
+                    value=DEFAULT_PROFILE,
+                    info="throughput = all cores and bfloat16 maths (if the CPU has it); "
+                         "latency = all cores, float32; shared-host = this job's share of the cores"
+                )
                 train_button = gr.Button("Start Training", variant="primary")
             
             with gr.Column(scale=2):
@@ -795,12 +746,90 @@ with gr.Blocks(theme=custom_theme, title="MNIST Digit Classifier") as demo:
                     lines=10,
                     value="👈 Select architecture and parameters, then click 'Start Training'\n\nAvailable architectures:\n• MLP: Simple fully-connected network (~30s)\n• Small CNN: Convolutional network (~60s)\n• Deeper CNN: More complex CNN (~90s)\n\nTraining progress will appear here..."
                 )
+                
+                # Training runs as a background job - the ID lets you follow it
+                # again after a page refresh, or cancel it
+                with gr.Row():
+                    job_id_input = gr.Textbox(label="Job ID", scale=2)
+                    reattach_button = gr.Button("Follow Job", variant="secondary", scale=1)
+                    cancel_button = gr.Button("Cancel Job", variant="stop", scale=1)
+        
+        with gr.Accordion("Training Jobs", open=False):
+            refresh_jobs_button = gr.Button("Refresh Job List", variant="secondary")
+            jobs_table = gr.Dataframe(value=get_job_list(), interactive=False)
         
+        # Submitting returns at once; following the job is a separate event.
+        # Followers mostly wait, so any number can run side by side
         train_button.click(
-            fn=train_new_model,
-            inputs=[architecture_input, epochs_input, batch_size_input],
-            outputs=training_output,
+            fn=start_training_job,
+            inputs=[architecture_input, epochs_input, batch_size_input, tflite_input, pipeline_input,
+                    val_every_input, val_subset_input, profile_input],
+            outputs=[job_id_input, training_output],
             api_name=False  # Disable API to avoid Gradio bug
+        ).then(
+            fn=watch_training_job,
+            inputs=job_id_input,
+            outputs=training_output,
+            api_name=False,
+            concurrency_limit=None
+        )
+        reattach_button.click(
+            fn=watch_training_job,
+            inputs=job_id_input,
+            outputs=training_output,
+            api_name=False,
+            concurrency_limit=None
+        )
+        cancel_button.click(
+            fn=cancel_training_job,
+            inputs=job_id_input,
+            outputs=training_output,
+            api_name=False
+        ).then(
+            fn=get_job_list,
+            outputs=jobs_table,
+            api_name=False
+        )
+        refresh_jobs_button.click(
+            fn=get_job_list,
+            outputs=jobs_table,
+            api_name=False
+        )
+    
+    with gr.Tab("Sweep"):
+        gr.Markdown("### Hyperparameter Sweep")
+        gr.Markdown("Train many configurations in parallel. Trials that fall behind are stopped early (successive halving), so most of the compute goes to the promising ones.")
+        
+        with gr.Row():
+            with gr.Column(scale=1):
+                sweep_architectures = gr.CheckboxGroup(
+                    label="Architectures",
+                    choices=["MLP", "Small CNN", "Deeper CNN"],
+                    value=["MLP", "Small CNN"]
+                )
+                sweep_batch_sizes = gr.Textbox(label="Batch Sizes", value="32, 64, 128")
+                sweep_epochs = gr.Textbox(label="Epochs", value="4")
+                sweep_search = gr.Radio(label="Search", choices=["Grid", "Random"], value="Grid")
+                sweep_trials = gr.Number(label="Trials (random search)", value=4, minimum=1, step=1)
+                sweep_eta = gr.Number(
+                    label="Keep top 1/N at each rung",
+                    value=SWEEP_ETA,
+                    minimum=2,
+                    step=1,
+                    info="Trials are compared at epochs 1, N, N², ... and the rest are stopped"
+                )
+                sweep_button = gr.Button("Start Sweep", variant="primary")
+            
+            with gr.Column(scale=2):
+                sweep_output = gr.Textbox(label="Sweep Status", lines=4)
+                sweep_table = gr.Dataframe(value=pd.DataFrame(columns=SWEEP_COLUMNS), interactive=False)
+        
+        sweep_button.click(
+            fn=run_sweep_ui,
+            inputs=[sweep_architectures, sweep_batch_sizes, sweep_epochs, sweep_search, sweep_trials, sweep_eta],
+            outputs=[sweep_output, sweep_table],
+            api_name=False,
+            concurrency_limit=None  # mostly waits on the job scheduler
         )
     
     with gr.Tab("Predict"):
@@ -896,6 +925,26 @@ with gr.Blocks(theme=custom_theme, title="MNIST Digit Classifier") as demo:
                             value=empty_state_df_draw
                         )
                         draw_consensus_output = gr.Markdown("✏️ Draw a digit on the canvas above to get started")
+
+            with gr.TabItem("Bulk Upload"):
+                gr.Markdown("**Score a whole batch of digits**")
+                gr.Markdown("Upload a .zip of digit images or a .npy array of shape N×28×28. Results can be downloaded when it's done.")
+
+                with gr.Row():
+                    with gr.Column(scale=1):
+                        bulk_input = gr.File(label="Upload .zip or .npy", file_types=['.zip', '.npy'])
+                        bulk_format_input = gr.Radio(
+                            label="Download Format",
+                            choices=list(OUTPUT_FORMATS),
+                            value="CSV"
+                        )
+                        bulk_predict_button = gr.Button("Predict All Digits", variant="primary")
+
+                    with gr.Column(scale=2):
+                        bulk_status_output = gr.Textbox(label="Progress", lines=3)
+                        bulk_download_output = gr.File(label="Download Results")
+
+                bulk_results_output = gr.Dataframe(label="Results", interactive=False)
         
         upload_predict_button.click(
             fn=lambda img: predict_with_validation("Upload Image", img, None),
@@ -910,32 +959,71 @@ with gr.Blocks(theme=custom_theme, title="MNIST Digit Classifier") as demo:
             outputs=[draw_original_display, draw_preprocessed_display, draw_prediction_output, draw_consensus_output],
             api_name=False
         )
+
+        bulk_predict_button.click(
+            fn=predict_bulk_ui,
+            inputs=[bulk_input, bulk_format_input],
+            outputs=[bulk_status_output, bulk_results_output, bulk_download_output],
+            api_name=False
+        )
     
     with gr.Tab("History"):
         gr.Markdown("### Training History")
         gr.Markdown("View all previous training runs and their accuracy charts")
         
-        refresh_button = gr.Button("Refresh History", variant="secondary")
+        # Filters - applied by the database, not after loading everything
+        with gr.Row():
+            history_architecture = gr.Dropdown(
+                label="Architecture",
+                choices=["All", "MLP", "Small CNN", "Deeper CNN"],
+                value="All"
+            )
+            history_since = gr.Textbox(label="From (YYYY-MM-DD)", placeholder="Any date")
+            history_until = gr.Textbox(label="To (YYYY-MM-DD)", placeholder="Any date")
+            history_min_accuracy = gr.Number(label="Min Accuracy (%)", value=0, minimum=0, maximum=100)
+        
+        with gr.Row():
+            history_sort = gr.Dropdown(label="Sort By", choices=list(HISTORY_SORT_CHOICES), value="Run ID")
+            history_descending = gr.Checkbox(label="Descending", value=True)
+            history_page_size = gr.Dropdown(label="Runs per Page", choices=[25, 50, 100, 200], value=HISTORY_PAGE_SIZE)
+            history_page = gr.Number(label="Page", value=1, minimum=1, step=1, precision=0)
         
-        # Start with empty DataFrame with the right column names
-        empty_df = pd.DataFrame(columns=['Run ID', 'Architecture', 'Epochs', 'Batch Size', 'Accuracy (%)', 'Filename', 'Timestamp'])
+        refresh_button = gr.Button("Refresh History", variant="secondary")
         
         history_table = gr.Dataframe(
-            label="All Training Runs",
-            value=empty_df,
+            label="Training Runs",
+            value=pd.DataFrame(columns=HISTORY_COLUMNS),
             interactive=False
         )
         
+        with gr.Row():
+            previous_page_button = gr.Button("◀ Previous Page", variant="secondary", scale=1)
+            history_page_info = gr.Markdown()
+            next_page_button = gr.Button("Next Page ▶", variant="secondary", scale=1)
+        
         # Accuracy chart
         accuracy_chart = gr.Plot(label="Training Accuracy Chart")
         
         # Time comparison chart
         time_chart = gr.Plot(label="Performance Dashboard")
         
+        history_inputs = [history_page, history_page_size, history_sort, history_descending,
+                          history_architecture, history_since, history_until, history_min_accuracy]
+        history_outputs = [history_table, history_page_info, history_page]
+        
+        # Paging only reloads the table
+        previous_page_button.click(
+            fn=previous_history_page, inputs=history_page, outputs=history_page, api_name=False
+        ).then(fn=get_training_history, inputs=history_inputs, outputs=history_outputs, api_name=False)
+        next_page_button.click(
+            fn=next_history_page, inputs=history_page, outputs=history_page, api_name=False
+        ).then(fn=get_training_history, inputs=history_inputs, outputs=history_outputs, api_name=False)
+        
         # Load history and chart on button click
         refresh_button.click(
             fn=get_training_history,
-            outputs=history_table,
+            inputs=history_inputs,
+            outputs=history_outputs,
             api_name=False
         ).then(
             fn=create_accuracy_chart,
@@ -946,6 +1034,35 @@ with gr.Blocks(theme=custom_theme, title="MNIST Digit Classifier") as demo:
             outputs=time_chart,
             api_name=False
         )
+    
+    with gr.Tab("Diagnostics"):
+        gr.Markdown("### Diagnostics")
+        gr.Markdown(
+            "Where the time goes: latency of each instrumented stage (prediction, model loading, "
+            "database queries, training epochs) plus counters and cache stats. Percentiles are "
+            "estimated from histogram buckets. The same numbers are available in Prometheus format "
+            f"at http://{serve_http.HTTP_HOST}:{serve_http.HTTP_PORT}/metrics"
+        )
+        
+        with gr.Row():
+            diagnostics_refresh_button = gr.Button("Refresh", variant="secondary")
+            diagnostics_reset_button = gr.Button("Reset Counters", variant="secondary")
+        diagnostics_info = gr.Markdown()
+        
+        diagnostics_stages = gr.Dataframe(
+            label="Stage Latencies",
+            value=pd.DataFrame(columns=DIAGNOSTICS_COLUMNS),
+            interactive=False
+        )
+        diagnostics_values = gr.Dataframe(
+            label="Counters and Gauges",
+            value=pd.DataFrame(columns=['Metric', 'Type', 'Value']),
+            interactive=False
+        )
+        
+        diagnostics_outputs = [diagnostics_stages, diagnostics_values, diagnostics_info]
+        diagnostics_refresh_button.click(fn=get_diagnostics, outputs=diagnostics_outputs, api_name=False)
+        diagnostics_reset_button.click(fn=reset_diagnostics, outputs=diagnostics_outputs, api_name=False)
 
 
 if __name__ == "__main__":
@@ -953,5 +1070,21 @@ if __name__ == "__main__":
     print("- Train tab: Configure and train new models")
     print("- Predict tab: Upload images or draw digits for recognition")
     print("- History tab: View all training runs")
+    print("- Diagnostics tab: Where prediction and training time goes")
     print("\nOpen http://localhost:7860 in your browser\n")
+
+    # Load the current best models in the background so the first
+    # prediction doesn't have to wait for them
+    live_models.preload()
+
+    # Headless prediction API for scripts, sharing the same loaded models
+    try:
+        serve_http.start_in_background()
+        print(f"Prediction API on http://{serve_http.HTTP_HOST}:{serve_http.HTTP_PORT}/predict\n")
+    except OSError as e:
+        print(f"Warning: couldn't start the prediction API on port {serve_http.HTTP_PORT}: {e}\n")
+
+    print("Startup report:")
+    print(startup_report() + "\n")
+
     demo.launch()
@@ -0,0 +1,676 @@
+"""
+Performance benchmarks for the MNIST app.
+
+Run one benchmark by name, e.g.:
+    python benchmarks.py serving
+
+Run with no arguments to list what's available. Numbers are printed
+rather than saved - they depend heavily on the machine.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+
+def _time_calls(fn, repeats):
+    """Call fn() repeatedly and return (median, p95) latency in milliseconds."""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2], timings[int(len(timings) * 0.95) - 1]
+
+
+# ============================================================================
+# INFERENCE
+# ============================================================================
+
+def bench_serving(repeats=200):
+    """Compare model.predict() against the engine's compiled serving functions."""
+    from inference import engine, run_bucketed
+
+    filenames = [f for f in sorted(os.listdir('artifacts')) if f.endswith('.keras')]
+    if not filenames:
+        print("No .keras models in artifacts/ - train one first")
+        return
+
+    print(f"{'Model':<32}{'Batch':>6}{'predict() ms':>16}{'serving fn ms':>16}{'Speed-up':>10}")
+    for filename in filenames:
+        model = engine.get_model(filename)
+        serve = engine.get_serving_fn(filename)
+
+        for batch_size in (1, 32):
+            images = np.random.rand(batch_size, 28, 28).astype('float32')
+
+            # One untimed call each so neither side pays for tracing
+            model.predict(images, verbose=0)
+            run_bucketed(serve, images)
+
+            predict_ms, _ = _time_calls(lambda: model.predict(images, verbose=0), repeats)
+            serve_ms, _ = _time_calls(lambda: run_bucketed(serve, images), repeats)
+            print(f"{filename:<32}{batch_size:>6}{predict_ms:>16.2f}{serve_ms:>16.2f}{predict_ms / serve_ms:>9.1f}x")
+
+
+# Loads one model, predicts one digit and reports (seconds, peak RSS in MB).
+# Run in a fresh interpreter so imports and memory are measured from scratch.
+_STARTUP_SCRIPT = """
+import resource, sys, time
+start = time.perf_counter()
+import numpy as np
+if sys.argv[1] == 'numpy':
+    from numpy_inference import load_numpy_model
+    model = load_numpy_model(sys.argv[2])
+    model(np.zeros((1, 28, 28), dtype='float32'))
+else:
+    from models import load_model
+    model = load_model(sys.argv[2])
+    model(np.zeros((1, 28, 28), dtype='float32'), training=False)
+elapsed = time.perf_counter() - start
+try:
+    # ru_maxrss carries over the parent's peak through fork/exec, VmHWM doesn't
+    with open('/proc/self/status') as f:
+        peak_kb = next(int(line.split()[1]) for line in f if line.startswith('VmHWM'))
+except OSError:
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(f'RESULT {elapsed:.3f} {peak_kb / 1024:.0f}')
+"""
+
+
+def bench_numpy(repeats=50):
+    """Check the NumPy engine matches Keras, and compare worker startup time/memory."""
+    from models import load_model
+    from numpy_inference import load_numpy_model, NUMPY_ATOL
+
+    filenames = [f for f in sorted(os.listdir('artifacts')) if f.endswith('.keras')]
+    if not filenames:
+        print("No .keras models in artifacts/ - train one first")
+        return
+
+    images = np.random.rand(64, 28, 28).astype('float32')
+    print(f"{'Model':<32}{'Max |diff|':>12}{'Agree':>8}{'Keras ms':>10}{'NumPy ms':>10}")
+    mismatched = []
+    for filename in filenames:
+        path = os.path.join('artifacts', filename)
+        keras_model = load_model(path)
+        numpy_model = load_numpy_model(path)
+
+        expected = keras_model(images, training=False).numpy()
+        actual = numpy_model(images)
+        agree = (expected.argmax(axis=1) == actual.argmax(axis=1)).mean() * 100
+        max_diff = np.abs(expected - actual).max()
+        if not max_diff <= NUMPY_ATOL:
+            mismatched.append(f"{filename} ({max_diff:.2e})")
+
+        single = images[:1]
+        keras_ms, _ = _time_calls(lambda: keras_model(single, training=False), repeats)
+        numpy_ms, _ = _time_calls(lambda: numpy_model(single), repeats)
+        print(f"{filename:<32}{max_diff:>12.2e}{agree:>7.0f}%{keras_ms:>10.2f}{numpy_ms:>10.2f}")
+
+    if mismatched:
+        print(f"FAILED: NumPy output differs from Keras by more than {NUMPY_ATOL:g} for {', '.join(mismatched)}")
+        sys.exit(1)
+    print(f"OK: every model within {NUMPY_ATOL:g} of Keras")
+
+    print(f"\nCold start (import + load + first prediction) for {filenames[-1]}:")
+    for backend in ('keras', 'numpy'):
+        output = subprocess.run(
+            [sys.executable, '-c', _STARTUP_SCRIPT, backend, os.path.join('artifacts', filenames[-1])],
+            capture_output=True, text=True, check=True
+        ).stdout
+        seconds, rss_mb = output.split('RESULT ')[1].split()
+        print(f"  {backend:<6} {float(seconds):6.2f}s  {rss_mb:>5} MB peak RSS")
+
+
+def bench_parallel(repeats=100):
+    """All best models one after another vs side by side on the thread pool vs the fused graph."""
+    from inference import engine, live_models
+    from init_db import create_database
+
+    # Make sure the best_models table is there and up to date
+    create_database(verbose=False)
+    best_models = live_models.current()
+    if not best_models:
+        print("No best models yet - train some first")
+        return
+
+    fuse = engine.fuse
+    print(f"Models: {', '.join(best_models)} ({engine.max_threads} inference threads)")
+    print(f"{'Batch':>6}{'Sequential ms':>16}{'Parallel ms':>14}{'Fused ms':>11}")
+    try:
+        for batch_size in (1, 32):
+            images = np.random.rand(batch_size, 28, 28).astype('float32')
+
+            def sequential():
+                for filename, _ in best_models.values():
+                    engine.predict(filename, images)
+
+            def all_models(fused):
+                engine.fuse = fused
+                engine.predict_all(best_models, images)
+
+            # Untimed calls so loading/tracing isn't counted
+            sequential()
+            all_models(False)
+            all_models(True)
+
+            sequential_ms, _ = _time_calls(sequential, repeats)
+            parallel_ms, _ = _time_calls(lambda: all_models(False), repeats)
+            fused_ms, _ = _time_calls(lambda: all_models(True), repeats)
+            print(f"{batch_size:>6}{sequential_ms:>16.2f}{parallel_ms:>14.2f}{fused_ms:>11.2f}")
+    finally:
+        engine.fuse = fuse
+
+def _http_client(port, bodies, content_type, keep_alive, latencies):
+    """Stand-in API client: POST each body to /predict, recording latencies in ms."""
+    import http.client
+
+    conn = None
+    for body in bodies:
+        if conn is None:
+            conn = http.client.HTTPConnection('127.0.0.1', port)
+        start = time.perf_counter()
+        conn.request('POST', '/predict', body, {'Content-Type': content_type})
+        response = conn.getresponse()
+        data = response.read()
+        latencies.append((time.perf_counter() - start) * 1000)
+        if response.status != 200:
+            raise RuntimeError(f"HTTP {response.status}: {data[:200]}")
+        if not keep_alive:
+            conn.close()
+            conn = None
+    if conn is not None:
+        conn.close()
+
+
+def bench_http(clients=8, requests_per_client=50, batch_size=256):
+    """Load test the HTTP prediction API (serve_http.py) with several local clients at once."""
+    import io
+    from PIL import Image
+    import serve_http
+    from inference import live_models, prediction_cache
+    from init_db import create_database
+
+    create_database(verbose=False)
+    if not live_models.current():
+        print("No best models yet - train some first")
+        return
+    live_models.preload().join()
+
+    server = serve_http.start_in_background(port=0)
+    port = server.server_port
+    rng = np.random.default_rng(0)
+
+    def raw_digits(n):
+        return [rng.integers(0, 256, (n, 28, 28), dtype='uint8').tobytes() for _ in range(requests_per_client)]
+
+    def png_digits():
+        bodies = []
+        for _ in range(requests_per_client):
+            buffer = io.BytesIO()
+            Image.fromarray(rng.integers(0, 256, (280, 280), dtype='uint8')).save(buffer, 'PNG')
+            bodies.append(buffer.getvalue())
+        return bodies
+
+    repeated = [rng.integers(0, 256, (28, 28), dtype='uint8').tobytes()] * requests_per_client
+    cases = [
+        ('1 digit, keep-alive', lambda: raw_digits(1), 'application/octet-stream', True, 1),
+        ('1 digit, new connections', lambda: raw_digits(1), 'application/octet-stream', False, 1),
+        ('1 digit, repeated (cached)', lambda: repeated, 'application/octet-stream', True, 1),
+        ('1 PNG (280x280)', png_digits, 'image/png', True, 1),
+        (f'{batch_size} digits per request', lambda: raw_digits(batch_size), 'application/octet-stream', True,
+         batch_size),
+    ]
+
+    print(f"{clients} clients x {requests_per_client} requests each, on http://127.0.0.1:{port}")
+    print(f"{'Case':<30}{'Requests/s':>12}{'Digits/s':>10}{'p50 ms':>9}{'p95 ms':>9}")
+    try:
+        for name, make_bodies, content_type, keep_alive, digits in cases:
+            bodies = [make_bodies() for _ in range(clients)]
+            latencies = []
+            threads = [
+                threading.Thread(target=_http_client, args=(port, bodies[i], content_type, keep_alive, latencies))
+                for i in range(clients)
+            ]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+
+            latencies.sort()
+            requests = len(latencies)
+            print(f"{name:<30}{requests / elapsed:>12.0f}{requests * digits / elapsed:>10.0f}"
+                  f"{latencies[requests // 2]:>9.1f}{latencies[int(requests * 0.95) - 1]:>9.1f}")
+    finally:
+        server.shutdown()
+        server.server_close()
+    print(f"\nPrediction cache: {prediction_cache.stats()}")
+
+def _old_preprocess(image, drawn):
+    """The Predict tab's preprocessing before utils.preprocess() (for comparison)."""
+    from PIL import Image
+
+    img_array = np.array(image)
+    if len(img_array.shape) == 3:
+        img_array = np.mean(img_array, axis=2)
+    empty = np.mean(img_array) > 250
+    if drawn:
+        img_array = np.array(image)
+        if len(img_array.shape) == 3:
+            img_array = np.mean(img_array, axis=2)
+        image = (255 - img_array).astype('uint8')
+    img = Image.fromarray(np.asarray(image).astype('uint8')).convert('L').resize((28, 28))
+    return np.array(img).astype('float32') / 255.0, empty
+
+
+def bench_preprocess(repeats=50, stack_size=10_000):
+    """Old vs new preprocessing for one Sketchpad canvas and a stack of 10k digits."""
+    from utils import preprocess
+
+    rng = np.random.default_rng(0)
+
+    # A 280×280 RGBA canvas like the Sketchpad's: white, with a black stroke
+    canvas = np.full((280, 280, 4), 255, dtype='uint8')
+    canvas[60:220, 130:150, :3] = 0
+    # An RGB photo-sized upload
+    upload = rng.integers(0, 256, (600, 800, 3), dtype='uint8')
+    # Bulk-style 28×28 digits, and the same digits at canvas size
+    stack = rng.integers(0, 256, (stack_size, 28, 28), dtype='uint8')
+    big_stack = rng.integers(0, 256, (stack_size // 10, 280, 280), dtype='uint8')
+
+    cases = [
+        ('1 canvas (280x280 RGBA)', lambda: [_old_preprocess(canvas, True)],
+         lambda: preprocess(canvas, invert=True)),
+        ('1 upload (800x600 RGB)', lambda: [_old_preprocess(upload, False)],
+         lambda: preprocess(upload)),
+        (f'{stack_size:,} digits (28x28)', lambda: [_old_preprocess(image, False) for image in stack],
+         lambda: preprocess(stack)),
+        (f'{len(big_stack):,} images (280x280)', lambda: [_old_preprocess(image, False) for image in big_stack],
+         lambda: preprocess(big_stack)),
+    ]
+
+    print(f"{'Input':<28}{'Old ms':>10}{'New ms':>10}{'Speed-up':>10}{'Max |diff|':>12}")
+    for name, old, new in cases:
+        runs = repeats if name.startswith('1 ') else 3
+        old_ms, _ = _time_calls(old, runs)
+        new_ms, _ = _time_calls(new, runs)
+        old_pixels = np.stack([pixels for pixels, _ in old()])
+        new_pixels = np.asarray(new()[0]).reshape(old_pixels.shape)
+        diff = np.abs(old_pixels - new_pixels).max()
+        print(f"{name:<28}{old_ms:>10.2f}{new_ms:>10.2f}{old_ms / new_ms:>9.1f}x{diff:>12.3f}")
+    print("\nThe canvas differs on purpose: the old code averaged the alpha channel into the grey value,\n"
+          "so black strokes came out at 25% brightness instead of 0.")
+
+
+# ============================================================================
+# TRAINING
+# ============================================================================
+
+def bench_pipeline(epochs=3, batch_size=128):
+    """Epoch times for NumPy arrays vs the tf.data pipeline (epoch 1 includes tracing/caching)."""
+    import dataset
+    from models import create_mlp, create_small_cnn
+
+    (x_train, y_train), (x_test, y_test) = dataset.load_mnist()
+    (x_train_u8, _), (x_test_u8, _) = dataset.load_mnist_uint8()
+
+    print(f"{'Model':<12}{'Pipeline':<14}" + "".join(f"{f'Epoch {i + 1} s':>11}" for i in range(epochs)))
+    for name, create in (('MLP', create_mlp), ('Small CNN', create_small_cnn)):
+        for pipeline in dataset.INPUT_PIPELINES:
+            model = create()
+            if pipeline == 'tf.data':
+                train_data = dataset.make_tf_dataset(x_train_u8, y_train, batch_size, shuffle=True)
+                val_data = dataset.make_tf_dataset(x_test_u8, y_test, batch_size)
+
+            times = []
+            for _ in range(epochs):
+                start = time.perf_counter()
+                if pipeline == 'tf.data':
+                    model.fit(train_data, epochs=1, validation_data=val_data, verbose=0)
+                else:
+                    model.fit(x_train, y_train, epochs=1, batch_size=batch_size,
+                              validation_data=(x_test, y_test), verbose=0)
+                times.append(time.perf_counter() - start)
+            print(f"{name:<12}{pipeline:<14}" + "".join(f"{t:>11.2f}" for t in times))
+
+
+def bench_profiles(architecture='Small CNN', epochs=3, batch_size=128):
+    """
+    Epoch times for each performance profile (epoch 1 includes tracing/XLA compile).
+
+    Each profile runs in a fresh process, as a training job would, since
+    TensorFlow's thread pools can't change once it has started.
+    """
+    from jobs import THREADS_PER_JOB
+    from profiles import PERFORMANCE_PROFILES, thread_env, uses_mixed_precision
+
+    script = (
+        "import json, sys, time\n"
+        "import dataset, training\n"
+        "from profiles import apply_threading\n"
+        "architecture, profile, epochs, batch_size, threads = json.loads(sys.argv[1])\n"
+        "apply_threading(profile, threads)\n"
+        "(x_train, y_train), _ = dataset.load_mnist()\n"
+        "model = training.ARCHITECTURES[architecture](profile=profile)\n"
+        "times = []\n"
+        "for _ in range(epochs):\n"
+        "    start = time.perf_counter()\n"
+        "    model.fit(x_train, y_train, epochs=1, batch_size=batch_size, verbose=0)\n"
+        "    times.append(time.perf_counter() - start)\n"
+        "print(json.dumps(times))\n"
+    )
+
+    print(f"{architecture}, batch size {batch_size} (shared-host gets {THREADS_PER_JOB} threads)")
+    print(f"{'Profile':<14}{'bf16':<6}" + "".join(f"{f'Epoch {i + 1} s':>11}" for i in range(epochs)))
+    for profile in PERFORMANCE_PROFILES:
+        env = dict(os.environ)
+        env.update(thread_env(profile, THREADS_PER_JOB))
+        args = json.dumps([architecture, profile, epochs, batch_size, THREADS_PER_JOB])
+        output = subprocess.run([sys.executable, '-c', script, args], capture_output=True, text=True,
+                                check=True, env=env).stdout
+        times = json.loads(output.strip().splitlines()[-1])
+        bf16 = 'yes' if uses_mixed_precision(profile) else 'no'
+        print(f"{profile:<14}{bf16:<6}" + "".join(f"{t:>11.2f}" for t in times))
+
+
+# ============================================================================
+# DATABASE
+# ============================================================================
+
+def _register_from_threads(db_path, threads, runs_per_thread):
+    """Register runs from several threads at once; returns [(run_id, filename), ...]."""
+    import db
+
+    db.DB_PATH = db_path
+    results = []
+    lock = threading.Lock()
+    ready = threading.Barrier(threads)
+
+    def work():
+        ready.wait()   # all threads start registering together
+        for i in range(runs_per_thread):
+            # A new architecture name as well, so its models row is created concurrently too
+            architecture = ('MLP', 'Small CNN', 'Stress Test')[i % 3]
+            registered = db.register_run(architecture, 1, 32, None)
+            with lock:
+                results.append(registered)
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return results
+
+
+def bench_register(threads=8, processes=4, runs_per_thread=25):
+    """
+    Stress test run registration: threads in this process and several worker
+    processes all register runs at once on a scratch database. Every run
+    must get its own run_id and filename, with one models row per architecture.
+    """
+    import sqlite3
+    import tempfile
+
+    import db
+    from init_db import create_database
+
+    script = (
+        "import json, sys, benchmarks\n"
+        "print(json.dumps(benchmarks._register_from_threads(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]))))\n"
+    )
+    expected = (processes + 1) * threads * runs_per_thread
+    original_path = db.DB_PATH
+    with tempfile.TemporaryDirectory() as scratch:
+        db_path = os.path.join(scratch, 'stress.db')
+        create_database(verbose=False, db_path=db_path)
+
+        start = time.perf_counter()
+        workers = [
+            subprocess.Popen([sys.executable, '-c', script, db_path, str(threads), str(runs_per_thread)],
+                             stdout=subprocess.PIPE, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+            for _ in range(processes)
+        ]
+        try:
+            results = _register_from_threads(db_path, threads, runs_per_thread)
+        finally:
+            db.DB_PATH = original_path
+        for worker in workers:
+            output, _ = worker.communicate()
+            results += [tuple(registered) for registered in json.loads(output)]
+        elapsed = time.perf_counter() - start
+
+        conn = sqlite3.connect(db_path)
+        rows = dict(conn.execute('SELECT run_id, model_filename FROM training_runs').fetchall())
+        architectures = [name for (name,) in conn.execute('SELECT architecture FROM models')]
+        conn.close()
+
+    print(f"{len(results)} runs registered by {processes + 1} processes x {threads} threads "
+          f"in {elapsed:.2f}s ({len(results) / elapsed:.0f} runs/s)")
+
+    problems = []
+    if len(results) != expected or len(rows) != expected:
+        problems.append(f"expected {expected} runs, got {len(results)} returned and {len(rows)} in the database")
+    if len({run_id for run_id, _ in results}) != len(results):
+        problems.append("duplicate run IDs")
+    if len({filename for _, filename in results}) != len(results):
+        problems.append("duplicate filenames")
+    if any(rows.get(run_id) != filename or not filename.endswith(f'_run{run_id}.keras')
+           for run_id, filename in results):
+        problems.append("a returned filename doesn't match its run in the database")
+    if len(architectures) != len(set(architectures)):
+        problems.append(f"duplicate models rows: {sorted(architectures)}")
+
+    if problems:
+        print("FAILED: " + "; ".join(problems))
+        sys.exit(1)
+    print("OK: every run got its own run ID and filename, one models row per architecture")
+
+
+def _synthetic_history(db_path, runs, epochs=3):
+    """Create a scratch database at db_path with `runs` made-up runs (5 minutes apart from 2025-01-01)."""
+    import random
+    import sqlite3
+
+    from init_db import create_database
+
+    create_database(verbose=False, db_path=db_path)
+    rng = random.Random(0)
+
+    conn = sqlite3.connect(db_path)
+    conn.executemany('INSERT INTO models (architecture) VALUES (?)', [(a,) for a in ('MLP', 'Small CNN', 'Deeper CNN')])
+    start = time.perf_counter()
+    conn.executemany('''
+        INSERT INTO training_runs (model_id, epochs, batch_size, val_accuracy, model_filename, duration, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, datetime('2025-01-01', ? || ' seconds'))
+    ''', [(rng.randint(1, 3), epochs, rng.choice([32, 64, 128]), rng.uniform(0.9, 0.995),
+           f'model_run{run_id}.keras', rng.uniform(10, 120), run_id * 300)
+          for run_id in range(1, runs + 1)])
+    conn.executemany('INSERT INTO metrics (run_id, epoch, train_accuracy, val_accuracy, val_kind) VALUES (?, ?, ?, ?, ?)',
+                     [(run_id, epoch, 0.9, 0.9, 'full') for run_id in range(1, runs + 1) for epoch in range(1, epochs + 1)])
+    conn.commit()
+    print(f"Built {runs} runs ({runs * epochs} metric rows) in {time.perf_counter() - start:.1f}s\n")
+    return conn
+
+
+def bench_history(runs=100_000, epochs=3, repeats=5):
+    """
+    History queries on a scratch database of `runs` synthetic runs, with and
+    without the indexes from init_db.py, plus the old one-lookup-per-row load.
+    """
+    import tempfile
+
+    import db
+
+    indexes = ['idx_training_runs_model_accuracy', 'idx_training_runs_created_at', 'idx_metrics_run_epoch']
+
+    original_path = db.DB_PATH
+    with tempfile.TemporaryDirectory() as scratch:
+        db_path = os.path.join(scratch, 'history.db')
+        conn = _synthetic_history(db_path, runs, epochs)
+
+        db.DB_PATH = db_path
+        try:
+            middle = runs // 2
+            cases = [
+                ("Newest 50 runs", lambda: db.query_runs()),
+                ("Page 1000", lambda: db.query_runs(page=1000)),
+                ("Small CNN by accuracy", lambda: db.query_runs(sort_by='val_accuracy', architecture='Small CNN')),
+                ("One month", lambda: db.query_runs(since='2025-03-01', until='2025-03-31')),
+                ("Accuracy >= 99%, best first", lambda: db.query_runs(sort_by='val_accuracy', min_accuracy=0.99)),
+                ("Metrics for one run", lambda: db.get_connection().execute(
+                    'SELECT epoch, val_accuracy FROM metrics WHERE run_id = ? ORDER BY epoch', (middle,)).fetchall()),
+            ]
+
+            indexed = [_time_calls(fn, repeats)[0] for _, fn in cases]
+            for index in indexes:
+                conn.execute(f'DROP INDEX {index}')
+            conn.commit()
+            unindexed = [_time_calls(fn, repeats)[0] for _, fn in cases]
+        finally:
+            db.DB_PATH = original_path
+
+        print(f"{'Query':<32}{'Indexed ms':>12}{'No index ms':>13}")
+        for (name, _), with_index, without_index in zip(cases, indexed, unindexed):
+            print(f"{name:<32}{with_index:>12.2f}{without_index:>13.2f}")
+
+        # What the History tab used to do: every run, then one models lookup per row
+        start = time.perf_counter()
+        rows = conn.execute('SELECT run_id, model_id FROM training_runs ORDER BY run_id DESC').fetchall()
+        for _, model_id in rows:
+            conn.execute('SELECT architecture FROM models WHERE model_id = ?', (model_id,)).fetchone()
+        print(f"\nOld History load (all runs + {len(rows)} lookups): {(time.perf_counter() - start) * 1000:.0f} ms")
+        conn.close()
+
+
+def bench_charts(runs=10_000, repeats=20):
+    """
+    History chart refreshes on a scratch database: the first build, cached
+    refreshes, and the rebuild after something is written.
+    """
+    import tempfile
+
+    import db
+
+    original_path = db.DB_PATH
+    with tempfile.TemporaryDirectory() as scratch:
+        db_path = os.path.join(scratch, 'charts.db')
+        writer = _synthetic_history(db_path, runs)
+        db.DB_PATH = db_path
+        try:
+            import app_ui
+
+            def refresh():
+                app_ui.create_accuracy_chart()
+                app_ui.create_performance_dashboard()
+
+            start = time.perf_counter()
+            refresh()
+            first_ms = (time.perf_counter() - start) * 1000
+            cached_ms, cached_p95 = _time_calls(refresh, repeats)
+
+            # Any commit (here from another connection, like a training worker) invalidates them
+            writer.execute("INSERT INTO training_runs (model_id, epochs, batch_size, val_accuracy, duration) "
+                           "VALUES (1, 3, 32, 0.97, 30)")
+            writer.commit()
+            start = time.perf_counter()
+            refresh()
+            rebuild_ms = (time.perf_counter() - start) * 1000
+        finally:
+            db.DB_PATH = original_path
+        writer.close()
+
+    print(f"Both History charts, {runs} runs:")
+    print(f"  First build        {first_ms:8.1f} ms")
+    print(f"  Cached refresh     {cached_ms:8.2f} ms (p95 {cached_p95:.2f} ms)")
+    print(f"  After a write      {rebuild_ms:8.1f} ms")
+
+
+# ============================================================================
+# INSTRUMENTATION
+# ============================================================================
+
+def bench_instrumentation(calls=200_000):
+    """What timing a stage and bumping a counter cost per call (microseconds)."""
+    from instrumentation import MetricsRegistry
+
+    registry = MetricsRegistry()
+
+    @registry.timed('bench.decorated')
+    def decorated():
+        pass
+
+    def with_block():
+        with registry.timed('bench.block'):
+            pass
+
+    def counter():
+        registry.count('bench.counter')
+
+    def nothing():
+        pass
+
+    baseline = None
+    print(f"{'Call':<28}{'us/call':>10}")
+    for name, fn in (('plain function', nothing), ('with timed(...)', with_block),
+                     ('@timed(...) function', decorated), ('count(...)', counter)):
+        start = time.perf_counter()
+        for _ in range(calls):
+            fn()
+        us = (time.perf_counter() - start) / calls * 1e6
+        baseline = us if baseline is None else baseline
+        extra = f"  (+{us - baseline:.2f})" if fn is not nothing else ""
+        print(f"{name:<28}{us:>10.2f}{extra}")
+
+    text = registry.prometheus_text()
+    print(f"\n/metrics for these stages: {len(text.splitlines())} lines, {len(text)} bytes")
+
+
+# ============================================================================
+# STARTUP
+# ============================================================================
+
+def bench_startup():
+    """Import app_ui in a fresh process and report import time, memory and what got loaded."""
+    script = (
+        "import time; start = time.perf_counter()\n"
+        "import app_ui\n"
+        "print(f'Importing app_ui took {time.perf_counter() - start:.2f}s')\n"
+        "print(app_ui.startup_report())\n"
+    )
+    output = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True).stdout
+    print(output)
+
+
+BENCHMARKS = {
+    'serving': bench_serving,
+    'numpy': bench_numpy,
+    'parallel': bench_parallel,
+    'http': bench_http,
+    'preprocess': bench_preprocess,
+    'pipeline': bench_pipeline,
+    'profiles': bench_profiles,
+    'register': bench_register,
+    'history': bench_history,
+    'charts': bench_charts,
+    'instrumentation': bench_instrumentation,
+    'startup': bench_startup,
+}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print("Usage: python benchmarks.py <benchmark>")
+        print("Available: " + ", ".join(BENCHMARKS))
+        sys.exit(1)
+
+    BENCHMARKS[sys.argv[1]]()
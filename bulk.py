@@ -0,0 +1,283 @@
+"""
+Bulk prediction: score a whole zip of digit images or an N×28×28 .npy file.
+
+Inputs are read in fixed-size chunks (the .npy is memory-mapped and the
+zip is read one member at a time), so memory use stays the same however
+many digits there are. Results are written to a CSV or Parquet file as
+each chunk finishes. Parquet needs pyarrow, which is optional - without
+it only CSV is offered.
+"""
+
+import csv
+import importlib.util
+import os
+import tempfile
+import zipfile
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from inference import engine
+from utils import preprocess
+
+
+# How many digits to preprocess and predict at once
+BULK_CHUNK_SIZE = 1024
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif')
+
+# Result rows shown in the UI while it runs (the full results are in the download)
+BULK_PREVIEW_ROWS = 1000
+
+# Parquet is only offered if pyarrow is installed
+OUTPUT_FORMATS = ('CSV', 'Parquet') if importlib.util.find_spec('pyarrow') else ('CSV',)
+
+
+# ============================================================================
+# INPUT READING
+# ============================================================================
+
+def to_uint8(array, scale=None):
+    """
+    Bring an array of 28×28 digits to uint8 0-255 (accepts 0-1 floats too).
+
+    scale is what to multiply by (255.0 for 0-1 input, 1.0 for 0-255).
+    If it's None it's guessed from the array's maximum - so pass it in
+    when converting a file piece by piece, or each piece could be scaled
+    differently.
+    """
+    if array.dtype == np.uint8:
+        return np.asarray(array)
+    array = np.asarray(array, dtype='float32')
+    if scale is None:
+        scale = 255.0 if array.size and array.max() <= 1.0 else 1.0
+    if scale != 1.0:
+        array = array * scale
+    return np.clip(array, 0, 255).astype('uint8')
+
+
+def _iter_npy_chunks(path, chunk_size):
+    """Yield (names, uint8 images) chunks from an N×28×28 .npy file."""
+    data = np.load(path, mmap_mode='r')
+    if data.ndim != 3 or data.shape[1:] != (28, 28):
+        raise ValueError(f"Expected an array of shape (N, 28, 28), got {data.shape}")
+
+    # 0-1 or 0-255 is decided for the whole file (one extra pass over the
+    # memory map), not chunk by chunk - a chunk of faint 0-255 digits
+    # would otherwise look like 0-1
+    scale = None
+    if data.dtype != np.uint8:
+        file_max = max((data[start:start + chunk_size].max() for start in range(0, len(data), chunk_size)),
+                       default=0)
+        scale = 255.0 if file_max <= 1.0 else 1.0
+
+    for start in range(0, len(data), chunk_size):
+        chunk = data[start:start + chunk_size]
+        names = [str(i) for i in range(start, start + len(chunk))]
+        yield names, to_uint8(chunk, scale)
+
+
+def _iter_zip_chunks(path, chunk_size):
+    """Yield (names, uint8 images) chunks from a zip of image files."""
+    with zipfile.ZipFile(path) as archive:
+        members = [
+            name for name in archive.namelist()
+            if name.lower().endswith(IMAGE_EXTENSIONS) and not name.startswith('__MACOSX/')
+        ]
+        if not members:
+            raise ValueError("No images found in zip file")
+
+        names = []
+        chunk = np.empty((chunk_size, 28, 28), dtype='uint8')
+        for name in members:
+            with archive.open(name) as f:
+                chunk[len(names)] = preprocess(Image.open(f), dtype='uint8')[0]
+            names.append(name)
+
+            if len(names) == chunk_size:
+                yield names, chunk.copy()
+                names = []
+
+        if names:
+            yield names, chunk[:len(names)].copy()
+
+
+def count_inputs(path):
+    """Number of digits in a bulk input file (for progress messages)."""
+    if path.lower().endswith('.npy'):
+        return len(np.load(path, mmap_mode='r'))
+    with zipfile.ZipFile(path) as archive:
+        return sum(
+            1 for name in archive.namelist()
+            if name.lower().endswith(IMAGE_EXTENSIONS) and not name.startswith('__MACOSX/')
+        )
+
+
+def iter_chunks(path, chunk_size=BULK_CHUNK_SIZE):
+    """Yield (names, uint8 images of shape (n, 28, 28)) from a .zip or .npy file."""
+    if path.lower().endswith('.npy'):
+        return _iter_npy_chunks(path, chunk_size)
+    if path.lower().endswith('.zip'):
+        return _iter_zip_chunks(path, chunk_size)
+    raise ValueError("Bulk input must be a .zip of images or a .npy array")
+
+
+# ============================================================================
+# OUTPUT WRITERS
+# ============================================================================
+
+class _CsvWriter:
+    """Appends result rows to a CSV file (None is written as an empty cell)."""
+
+    def __init__(self, path, columns, types):
+        self.file = open(path, 'w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(columns)
+
+    def write(self, columns, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+
+class _ParquetWriter:
+    """Appends result rows to a Parquet file, one row group per chunk."""
+
+    def __init__(self, path, columns, types):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Parquet output needs pyarrow (pip install pyarrow) - use CSV instead")
+        self.pa = pa
+        self.pq = pq
+        self.path = path
+        # Fixed types, so a chunk where a model failed (all None) has the same schema
+        self.types = [pa.type_for_alias(name) for name in types]
+        self.writer = None
+
+    def write(self, columns, rows):
+        table = self.pa.Table.from_arrays(
+            [self.pa.array(list(column), type=column_type) for column, column_type in zip(zip(*rows), self.types)],
+            names=columns
+        )
+        if self.writer is None:
+            self.writer = self.pq.ParquetWriter(self.path, table.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+# ============================================================================
+# BULK PREDICTION
+# ============================================================================
+
+def predict_bulk(path, best_models, output_format='csv', chunk_size=BULK_CHUNK_SIZE):
+    """
+    Predict every digit in a .zip or .npy file with all best models.
+
+    Works as a generator (like train_new_model) so progress can be shown
+    while it runs.
+
+    Args:
+        path (str): .zip of images or .npy array of shape (N, 28, 28)
+        best_models (dict): as returned by get_best_models()
+        output_format (str): 'csv' or 'parquet'
+        chunk_size (int): digits preprocessed and predicted at a time
+
+    Yields:
+        tuple: (status message, results so far, output file path). The
+        results are a DataFrame of the first BULK_PREVIEW_ROWS rows, and
+        the path is None until the final yield.
+
+    A model that fails (or times out) on a chunk leaves its columns empty
+    for those digits and the rest carry on; the final message says which.
+    If the generator is closed or raises before the end, the half-written
+    output file is deleted.
+    """
+    if not best_models:
+        raise ValueError("No trained models found. Please train some models first!")
+
+    output_format = output_format.lower()
+    if output_format not in ('csv', 'parquet'):
+        raise ValueError(f"Unknown output format '{output_format}'")
+
+    total = count_inputs(path)
+    architectures = list(best_models)
+    columns = ['index', 'name']
+    types = ['int64', 'string']
+    for arch in architectures:
+        columns += [f'{arch} prediction', f'{arch} confidence']
+        types += ['int64', 'double']
+    columns.append('consensus')
+    types.append('bool')
+
+    fd, output_path = tempfile.mkstemp(prefix='bulk_predictions_', suffix=f'.{output_format}')
+    os.close(fd)
+    try:
+        writer = (_CsvWriter if output_format == 'csv' else _ParquetWriter)(output_path, columns, types)
+    except ImportError:
+        os.remove(output_path)
+        raise
+
+    done = 0
+    preview = []
+    failures = {}    # architecture -> (digits it failed on, first error)
+    complete = False
+    try:
+        for names, images in iter_chunks(path, chunk_size):
+            # Normalise the whole chunk at once
+            batch, _ = preprocess(images)
+            results = engine.predict_all(best_models, batch)
+
+            per_arch = []
+            for arch in architectures:
+                result = results[arch]
+                if isinstance(result, Exception):
+                    failed, error = failures.get(arch, (0, result))
+                    failures[arch] = (failed + len(names), error)
+                    per_arch.append(None)
+                    continue
+                digits = result.argmax(axis=1)
+                confidences = result[np.arange(len(result)), digits] * 100
+                per_arch.append((digits, confidences))
+
+            # Consensus between the models that worked (None if none did)
+            worked = [digits for digits, _ in filter(None, per_arch)]
+            if worked:
+                digit_matrix = np.stack(worked, axis=1)
+                agree = (digit_matrix == digit_matrix[:, :1]).all(axis=1)
+
+            rows = []
+            for i, name in enumerate(names):
+                row = [done + i, name]
+                for outputs in per_arch:
+                    if outputs is None:
+                        row += [None, None]
+                    else:
+                        digits, confidences = outputs
+                        row += [int(digits[i]), round(float(confidences[i]), 2)]
+                row.append(bool(agree[i]) if worked else None)
+                rows.append(row)
+            writer.write(columns, rows)
+            preview += rows[:BULK_PREVIEW_ROWS - len(preview)]
+
+            done += len(names)
+            yield f"Predicted {done}/{total} digits...", pd.DataFrame(preview, columns=columns), None
+        complete = True
+    finally:
+        # Also runs on GeneratorExit, when Gradio closes it because the user left
+        writer.close()
+        if not complete:
+            os.remove(output_path)
+
+    message = f"✅ Done! Predicted {done} digits with {len(architectures)} model(s)."
+    for arch, (failed, error) in failures.items():
+        message += f"\n⚠️ {arch} failed on {failed} digit(s) - its columns are empty for those: {error}"
+    if done > len(preview):
+        message += f" Showing the first {len(preview)} - download the file for the rest."
+    yield message, pd.DataFrame(preview, columns=columns), output_path
@@ -0,0 +1,240 @@
+"""
+Memory-mapped MNIST cache.
+
+mnist.load_data() decompresses the archive and every process then makes
+its own float32 copy of the images (about 220 MB each). Instead, the
+normalised arrays are written once to artifacts/mnist_cache/ as plain
+.npy files and opened with np.load(mmap_mode='r'). Every process then
+shares the same pages through the OS page cache, and "loading" is almost
+instant.
+
+The raw uint8 images are cached too, for the tf.data pipeline
+(make_tf_dataset) which normalises inside the graph instead.
+
+The cache is rebuilt automatically if any file is missing or doesn't
+match the manifest. Run `python dataset.py` to build it and do a full
+checksum check.
+"""
+
+import hashlib
+import json
+import os
+import sys
+
+import numpy as np
+
+from lazy import lazy_import
+
+tf = lazy_import('tensorflow')
+
+
+CACHE_DIR = os.path.join('artifacts', 'mnist_cache')
+MANIFEST_FILE = 'manifest.json'
+
+# Bump if the cached format changes, so old caches get rebuilt
+CACHE_VERSION = 2
+
+# What each cached array should look like
+EXPECTED = {
+    'x_train': ((60000, 28, 28), 'float32'),
+    'y_train': ((60000,), 'uint8'),
+    'x_test': ((10000, 28, 28), 'float32'),
+    'y_test': ((10000,), 'uint8'),
+    'x_train_uint8': ((60000, 28, 28), 'uint8'),
+    'x_test_uint8': ((10000, 28, 28), 'uint8'),
+}
+
+# Training input pipelines the Train tab can choose between
+INPUT_PIPELINES = ('NumPy arrays', 'tf.data')
+
+# Examples held in the tf.data shuffle buffer. A fixed size keeps memory
+# predictable; 10k is enough to mix MNIST well
+SHUFFLE_BUFFER = 10000
+
+
+# ============================================================================
+# BUILDING THE CACHE
+# ============================================================================
+
+def _sha256(path):
+    """Checksum of a file, read in 1 MB blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_atomic(path, array):
+    """Write an .npy file under a temporary name, then rename it into place."""
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+def build_cache(cache_dir=CACHE_DIR):
+    """
+    Convert MNIST into normalised .npy files plus a manifest of checksums.
+
+    Safe if two processes do it at the same time - each file is renamed
+    into place whole, and the manifest is written last.
+    """
+    # Only the converter needs TensorFlow (for the download/decompression)
+    from tensorflow.keras.datasets import mnist
+
+    print("Building MNIST cache...")
+    os.makedirs(cache_dir, exist_ok=True)
+    (x_train, y_train), (x_test, y_test) = mnist.load_data()
+
+    arrays = {
+        'x_train': x_train.astype('float32') / 255.0,
+        'y_train': y_train.astype('uint8'),
+        'x_test': x_test.astype('float32') / 255.0,
+        'y_test': y_test.astype('uint8'),
+        'x_train_uint8': x_train.astype('uint8'),
+        'x_test_uint8': x_test.astype('uint8'),
+    }
+
+    manifest = {'version': CACHE_VERSION, 'files': {}}
+    for name, array in arrays.items():
+        path = os.path.join(cache_dir, f'{name}.npy')
+        _write_atomic(path, array)
+        manifest['files'][name] = {
+            'shape': list(array.shape),
+            'dtype': str(array.dtype),
+            'sha256': _sha256(path),
+        }
+
+    manifest_path = os.path.join(cache_dir, MANIFEST_FILE)
+    tmp_path = f'{manifest_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+    print(f"✓ MNIST cache written to {cache_dir}")
+    return manifest
+
+
+# ============================================================================
+# CHECKING AND LOADING
+# ============================================================================
+
+def verify_cache(cache_dir=CACHE_DIR, full=False):
+    """
+    Check the cache is complete and matches its manifest.
+
+    The quick check (default) only reads the .npy headers, so it's cheap
+    enough to run on every startup. full=True also recomputes checksums.
+    Returns True if the cache is good.
+    """
+    try:
+        with open(os.path.join(cache_dir, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return False
+
+    if manifest.get('version') != CACHE_VERSION:
+        return False
+
+    for name, (shape, dtype) in EXPECTED.items():
+        entry = manifest.get('files', {}).get(name)
+        path = os.path.join(cache_dir, f'{name}.npy')
+        if entry is None or tuple(entry['shape']) != shape or entry['dtype'] != dtype:
+            return False
+        try:
+            array = np.load(path, mmap_mode='r')
+        except (OSError, ValueError):
+            return False
+        if array.shape != shape or str(array.dtype) != dtype:
+            return False
+        if full and _sha256(path) != entry['sha256']:
+            return False
+
+    return True
+
+
+def _open_cached(cache_dir, *names):
+    """Memory-map cached arrays, building the cache first if it's missing or broken."""
+    if not verify_cache(cache_dir):
+        build_cache(cache_dir)
+    return [np.load(os.path.join(cache_dir, f'{name}.npy'), mmap_mode='r') for name in names]
+
+
+def load_mnist(cache_dir=CACHE_DIR):
+    """
+    Memory-mapped, normalised MNIST: ((x_train, y_train), (x_test, y_test)).
+
+    Arrays are read-only views onto the cache files. Builds the cache
+    first if it's missing or broken.
+    """
+    x_train, y_train, x_test, y_test = _open_cached(cache_dir, 'x_train', 'y_train', 'x_test', 'y_test')
+    return (x_train, y_train), (x_test, y_test)
+
+
+def load_mnist_uint8(cache_dir=CACHE_DIR):
+    """Same as load_mnist(), but the images are raw 0-255 uint8."""
+    x_train, y_train, x_test, y_test = _open_cached(
+        cache_dir, 'x_train_uint8', 'y_train', 'x_test_uint8', 'y_test'
+    )
+    return (x_train, y_train), (x_test, y_test)
+
+
+def stratified_subset(labels, size, seed=0):
+    """
+    Indices of a fixed, class-balanced sample of `size` examples.
+
+    Each digit gets its share of the sample in proportion to how often it
+    appears. The same seed always gives the same subset, so validation
+    numbers stay comparable between epochs and runs.
+    """
+    labels = np.asarray(labels)
+    size = min(int(size), len(labels))
+    rng = np.random.default_rng(seed)
+
+    classes, counts = np.unique(labels, return_counts=True)
+    shares = np.floor(counts / len(labels) * size).astype(int)
+    # Hand out what rounding down left over to the biggest classes
+    shares[np.argsort(-counts)[:size - shares.sum()]] += 1
+
+    picked = [rng.choice(np.flatnonzero(labels == digit), share, replace=False)
+              for digit, share in zip(classes, shares)]
+    return np.sort(np.concatenate(picked))
+
+
+# ============================================================================
+# TF.DATA PIPELINE
+# ============================================================================
+
+def _normalise(images, labels):
+    """Runs inside the graph: uint8 0-255 -> float32 0-1."""
+    return tf.cast(images, tf.float32) / 255.0, labels
+
+
+def make_tf_dataset(images, labels, batch_size, shuffle=False, seed=None):
+    """
+    Build a tf.data pipeline over uint8 images.
+
+    The uint8 examples are cached after the first pass (a quarter of the
+    float32 size), shuffled with a fixed-size buffer, batched, normalised
+    in the graph on whole batches, and prefetched so the next batch is
+    ready while the current one trains.
+    """
+    ds = tf.data.Dataset.from_tensor_slices((np.asarray(images), np.asarray(labels)))
+    ds = ds.cache()
+    if shuffle:
+        ds = ds.shuffle(SHUFFLE_BUFFER, seed=seed, reshuffle_each_iteration=True)
+    ds = ds.batch(batch_size)
+    ds = ds.map(_normalise, num_parallel_calls=tf.data.AUTOTUNE)
+    return ds.prefetch(tf.data.AUTOTUNE)
+
+
+if __name__ == "__main__":
+    if verify_cache(full=True):
+        print("✓ MNIST cache is up to date")
+    else:
+        build_cache()
+        if not verify_cache(full=True):
+            print("✗ MNIST cache failed verification after rebuilding")
+            sys.exit(1)
+        print("✓ MNIST cache verified")
@@ -0,0 +1,435 @@
+"""
+Database helpers for recording training runs.
+
+These used to live in app_ui.py. They're in their own module so the
+training worker processes (see jobs.py) can write results without
+importing the whole Gradio app.
+
+All access goes through get_connection(), which keeps one connection
+per thread (and process) instead of opening a new one for every query.
+The database runs in WAL mode, so the History tab can read while a
+training job is writing, and writers wait for each other (busy_timeout)
+rather than failing with "database is locked".
+"""
+
+import functools
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from instrumentation import timed
+
+
+DB_PATH = 'artifacts/training_history.db'
+
+# How long a connection waits for another writer before giving up
+BUSY_TIMEOUT_MS = 10000
+
+_local = threading.local()
+
+
+# ============================================================================
+# CONNECTIONS
+# ============================================================================
+
+def configure_connection(conn):
+    """
+    Apply the settings every connection uses.
+
+    WAL lets readers and one writer work at the same time, and is stored
+    in the database file, so setting it again is a no-op. With WAL,
+    synchronous=NORMAL only syncs at checkpoints - a power cut can lose
+    the last few commits, but never corrupts the database.
+    """
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+    return conn
+
+
+def get_connection():
+    """This thread's connection to DB_PATH, opened (and configured) on first use."""
+    conn = getattr(_local, 'conn', None)
+    # A forked process or a different DB_PATH needs its own connection
+    if conn is None or _local.key != (os.getpid(), DB_PATH):
+        conn = configure_connection(sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT_MS / 1000))
+        _local.conn = conn
+        _local.key = (os.getpid(), DB_PATH)
+        _local.depth = 0
+    return conn
+
+
+@contextmanager
+def transaction(immediate=False):
+    """
+    Run a block of writes as one transaction on this thread's connection.
+
+    Commits at the end (or rolls back on an exception). Nested blocks join
+    the outer transaction, so helpers that use this can be grouped by the
+    caller into a single commit.
+
+    immediate=True takes the write lock up front (BEGIN IMMEDIATE), so
+    anything read inside the block can't change before it's written -
+    other writers wait (busy_timeout) until it commits.
+    """
+    conn = get_connection()
+    if immediate and _local.depth == 0:
+        conn.execute('BEGIN IMMEDIATE')
+    _local.depth += 1
+    try:
+        yield conn
+    except BaseException:
+        if _local.depth == 1:
+            conn.rollback()
+        raise
+    else:
+        if _local.depth == 1:
+            conn.commit()
+    finally:
+        _local.depth -= 1
+
+
+# ============================================================================
+# CHANGE TRACKING
+# ============================================================================
+
+_watcher = {'conn': None, 'key': None}
+_watcher_lock = threading.Lock()
+
+
+def data_version():
+    """
+    A value that changes whenever anything commits to the database.
+
+    Read from a connection that never writes itself, so its
+    PRAGMA data_version moves on for every commit from any other
+    connection - other threads, training workers, even other programs.
+    """
+    with _watcher_lock:
+        if _watcher['key'] != (os.getpid(), DB_PATH):
+            _watcher['conn'] = configure_connection(
+                sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False))
+            _watcher['key'] = (os.getpid(), DB_PATH)
+        return _watcher['key'], _watcher['conn'].execute('PRAGMA data_version').fetchone()[0]
+
+
+def cached_until_change(fn):
+    """
+    Memoise a function that only reads the database, until the data changes.
+
+    Results are kept per arguments and all dropped together when
+    data_version() moves on. Callers arriving while a result is being
+    worked out wait for it rather than all doing the work. Exceptions
+    aren't cached.
+    """
+    lock = threading.Lock()
+    state = {'version': None, 'results': {}}
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        key = (args, tuple(sorted(kwargs.items())))
+        with lock:
+            # Read before fn runs: a commit landing part-way through just
+            # means the next call works it out again
+            version = data_version()
+            if version != state['version']:
+                state['version'] = version
+                state['results'] = {}
+            if key not in state['results']:
+                state['results'][key] = fn(*args, **kwargs)
+            return state['results'][key]
+
+    wrapper.cache_clear = lambda: state.update(version=None, results={})
+    return wrapper
+
+
+# ============================================================================
+# TRAINING RUNS
+# ============================================================================
+
+def register_run(architecture, epochs, batch_size, val_accuracy, duration=None, sweep_id=None, sweep_trial=None,
+                 profile=None):
+    """
+    Create a training run and return (run_id, model_filename).
+
+    The run_id is the new row's own ID and the filename is built from it,
+    all in one transaction that holds the write lock, so runs registered
+    at the same time (from any number of threads or worker processes)
+    always get their own ID and file.
+    """
+    with transaction(immediate=True) as conn:
+        cursor = conn.cursor()
+
+        # Get or create model_id for this architecture
+        cursor.execute('SELECT model_id FROM models WHERE architecture = ?', (architecture,))
+        result = cursor.fetchone()
+
+        if result:
+            model_id = result[0]  # Architecture already exists
+        else:
+            # First time training this architecture - create new model entry
+            cursor.execute('INSERT INTO models (architecture) VALUES (?)', (architecture,))
+            model_id = cursor.lastrowid  # Get the auto-generated model_id
+
+        # Insert training run record - run_id is AUTOINCREMENT, so it's never reused
+        cursor.execute('''
+            INSERT INTO training_runs
+            (model_id, epochs, batch_size, val_accuracy, duration, sweep_id, sweep_trial, profile)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (model_id, epochs, batch_size, val_accuracy, duration, sweep_id, sweep_trial, profile))
+        run_id = cursor.lastrowid
+
+        # Unique filename from the run's own ID
+        arch_clean = architecture.lower().replace(' ', '_')
+        model_filename = f'model_{arch_clean}_run{run_id}.keras'
+        cursor.execute('UPDATE training_runs SET model_filename = ? WHERE run_id = ?', (model_filename, run_id))
+
+    return run_id, model_filename
+
+
+def save_epoch_metrics(rows):
+    """
+    Save epoch-by-epoch training metrics to database, in one executemany.
+
+    Each row is (run_id, epoch, train_accuracy, val_accuracy, val_kind).
+    val_kind says what val_accuracy was measured on: 'full' (the whole
+    test set) or 'subset'. Both are None for epochs that weren't validated.
+    """
+    with transaction() as conn:
+        conn.executemany('''
+            INSERT INTO metrics (run_id, epoch, train_accuracy, val_accuracy, val_kind)
+            VALUES (?, ?, ?, ?, ?)
+        ''', rows)
+
+
+class MetricsBuffer:
+    """
+    Holds a run's epoch metrics until they're written with save_epoch_metrics.
+
+    flush_every=None keeps everything until flush() - normally at the end
+    of the run, in the same transaction as finish_run. flush_every=1
+    writes every epoch straight away, for sweeps that compare trials
+    while they're still training.
+    """
+
+    def __init__(self, flush_every=None):
+        self.flush_every = flush_every
+        self.rows = []
+
+    def add(self, run_id, epoch, train_accuracy, val_accuracy, val_kind='full'):
+        self.rows.append((run_id, epoch, train_accuracy, val_accuracy, val_kind))
+        if self.flush_every and len(self.rows) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            save_epoch_metrics(self.rows)
+            self.rows = []
+
+
+def save_tflite_results(run_id, tflite_mode, tflite_accuracy, tflite_drift):
+    """Record the TFLite export for a run and how much its accuracy drifted."""
+    with transaction() as conn:
+        conn.execute('''
+            UPDATE training_runs
+            SET tflite_mode = ?, tflite_accuracy = ?, tflite_drift = ?
+            WHERE run_id = ?
+        ''', (tflite_mode, tflite_accuracy, tflite_drift, run_id))
+
+
+def finish_run(run_id, duration, val_accuracy=None):
+    """Set the total training time for a finished run, and its final validation accuracy if given."""
+    with transaction() as conn:
+        conn.execute('UPDATE training_runs SET duration = ? WHERE run_id = ?', (duration, run_id))
+        if val_accuracy is not None:
+            conn.execute('UPDATE training_runs SET val_accuracy = ? WHERE run_id = ?', (val_accuracy, run_id))
+
+
+def delete_run(run_id):
+    """Remove a run and its metrics (used when a training job is cancelled part-way)."""
+    with transaction() as conn:
+        conn.execute('DELETE FROM metrics WHERE run_id = ?', (run_id,))
+        conn.execute('DELETE FROM training_runs WHERE run_id = ?', (run_id,))
+
+
+# ============================================================================
+# BEST MODELS
+# ============================================================================
+
+def update_best_model(run_id):
+    """
+    Make a finished run its architecture's best model if it beats the current one.
+
+    Only call this once the run's model file has been saved - normally in
+    the same transaction as finish_run. The comparison happens inside the
+    one UPSERT, so two runs finishing at once can't both win.
+    """
+    with transaction() as conn:
+        conn.execute('''
+            INSERT INTO best_models (architecture, run_id, model_filename, val_accuracy)
+            SELECT models.architecture, training_runs.run_id, training_runs.model_filename, training_runs.val_accuracy
+            FROM training_runs
+            JOIN models ON models.model_id = training_runs.model_id
+            WHERE training_runs.run_id = ? AND training_runs.val_accuracy IS NOT NULL
+            ON CONFLICT (architecture) DO UPDATE SET
+                run_id = excluded.run_id,
+                model_filename = excluded.model_filename,
+                val_accuracy = excluded.val_accuracy,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE excluded.val_accuracy > best_models.val_accuracy
+        ''', (run_id,))
+
+
+def rebuild_best_models(conn, models_dir):
+    """
+    Work out the best_models table from scratch (init_db.py does this).
+
+    Picks the most accurate run per architecture whose model file is in
+    models_dir. Runs without one - sweep trials that were stopped early,
+    or files that have been deleted - are passed over for the next best
+    instead of leaving the architecture out. The caller commits.
+    """
+    rows = conn.execute('''
+        SELECT models.architecture, training_runs.run_id, training_runs.model_filename, training_runs.val_accuracy
+        FROM training_runs
+        JOIN models ON models.model_id = training_runs.model_id
+        WHERE training_runs.val_accuracy IS NOT NULL AND training_runs.model_filename IS NOT NULL
+        ORDER BY models.architecture, training_runs.val_accuracy DESC, training_runs.run_id
+    ''').fetchall()
+
+    best = {}
+    for architecture, run_id, filename, val_accuracy in rows:
+        if architecture not in best and os.path.exists(os.path.join(models_dir, filename)):
+            best[architecture] = (architecture, run_id, filename, val_accuracy)
+
+    conn.execute('DELETE FROM best_models')
+    conn.executemany(
+        'INSERT INTO best_models (architecture, run_id, model_filename, val_accuracy) VALUES (?, ?, ?, ?)',
+        best.values()
+    )
+    return {architecture: row[2] for architecture, row in best.items()}
+
+
+@cached_until_change
+@timed('db.best_models')
+def load_best_models():
+    """
+    The best model for each architecture, from the best_models table.
+
+    Returns:
+        dict: {'Architecture': ('filename.keras', accuracy)}. Shared between
+        callers until the database changes, so don't modify it.
+    """
+    rows = get_connection().execute('''
+        SELECT best_models.architecture, best_models.model_filename, best_models.val_accuracy
+        FROM best_models
+        JOIN models ON models.architecture = best_models.architecture
+        ORDER BY models.model_id
+    ''').fetchall()
+    return {architecture: (filename, val_accuracy) for architecture, filename, val_accuracy in rows}
+
+
+# ============================================================================
+# HISTORY
+# ============================================================================
+
+# Columns query_runs can sort by, and the SQL for each
+HISTORY_SORT_COLUMNS = {
+    'run_id': 'training_runs.run_id',
+    'architecture': 'models.architecture',
+    'val_accuracy': 'training_runs.val_accuracy',
+    'duration': 'training_runs.duration',
+    'created_at': 'training_runs.created_at',
+}
+
+HISTORY_PAGE_SIZE = 50
+
+
+@timed('db.history_query')
+def query_runs(page=1, page_size=HISTORY_PAGE_SIZE, sort_by='run_id', descending=True, architecture=None,
+               since=None, until=None, min_accuracy=None):
+    """
+    One page of training runs, filtered and sorted in SQL.
+
+    Args:
+        page: 1-based page number
+        sort_by: a key of HISTORY_SORT_COLUMNS (ties are broken by run_id)
+        architecture: only runs of this architecture
+        since / until: only runs created on or between these dates ('YYYY-MM-DD', UTC like created_at)
+        min_accuracy: only runs with at least this validation accuracy (0-1)
+
+    Returns:
+        (rows, total): a list of dicts (one per run, keyed by column name)
+        and how many runs match the filters altogether.
+    """
+    if sort_by not in HISTORY_SORT_COLUMNS:
+        raise ValueError(f"Can't sort by '{sort_by}' (choose from {', '.join(HISTORY_SORT_COLUMNS)})")
+
+    conditions, params = [], []
+    if architecture:
+        # As a model_id, so the (model_id, val_accuracy) index can give the
+        # order directly instead of sorting every run of the architecture
+        conditions.append('training_runs.model_id = (SELECT model_id FROM models WHERE architecture = ?)')
+        params.append(architecture)
+    if since:
+        conditions.append('training_runs.created_at >= date(?)')
+        params.append(since)
+    if until:
+        # The whole of the `until` day
+        conditions.append("training_runs.created_at < date(?, '+1 day')")
+        params.append(until)
+    if min_accuracy is not None:
+        conditions.append('training_runs.val_accuracy >= ?')
+        params.append(min_accuracy)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    order = 'DESC' if descending else 'ASC'
+    page = max(1, int(page))
+    page_size = max(1, int(page_size))
+
+    conn = get_connection()
+    total = conn.execute(f'''
+        SELECT COUNT(*)
+        FROM training_runs
+        JOIN models ON models.model_id = training_runs.model_id
+        {where}
+    ''', params).fetchone()[0]
+
+    cursor = conn.execute(f'''
+        SELECT training_runs.run_id, models.architecture, training_runs.epochs, training_runs.batch_size,
+               training_runs.val_accuracy, training_runs.duration, training_runs.profile,
+               training_runs.sweep_id, training_runs.model_filename, training_runs.created_at
+        FROM training_runs
+        JOIN models ON models.model_id = training_runs.model_id
+        {where}
+        ORDER BY {HISTORY_SORT_COLUMNS[sort_by]} {order}, training_runs.run_id {order}
+        LIMIT ? OFFSET ?
+    ''', params + [page_size, (page - 1) * page_size])
+
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()], total
+
+
+# ============================================================================
+# SWEEPS
+# ============================================================================
+
+def get_sweep_curves(sweep_id):
+    """
+    Per-epoch validation accuracy for every trial in a sweep.
+
+    Returns:
+        dict: {trial number: {epoch: val_accuracy}}
+    """
+    rows = get_connection().execute('''
+        SELECT training_runs.sweep_trial, metrics.epoch, metrics.val_accuracy
+        FROM metrics
+        JOIN training_runs ON training_runs.run_id = metrics.run_id
+        WHERE training_runs.sweep_id = ? AND metrics.val_accuracy IS NOT NULL
+    ''', (sweep_id,)).fetchall()
+
+    curves = {}
+    for trial, epoch, val_accuracy in rows:
+        curves.setdefault(trial, {})[epoch] = val_accuracy
+    return curves
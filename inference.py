@@ -0,0 +1,997 @@
+"""
+Inference engine that keeps trained models loaded between predictions.
+
+Loading a .keras file means unzipping it and rebuilding the whole graph,
+which is far slower than the prediction itself. The engine keeps models
+in memory in an LRU cache, keyed on the artifact filename plus its
+modification time so a retrained/overwritten file is picked up
+automatically.
+
+For calls with no deadline (bulk scoring, warming up new best models)
+the engine also builds one fused graph over the current best models, so
+a single call returns every architecture's probabilities. Calls with a
+deadline (the Predict tab, the HTTP API) run each model as its own task
+side by side on a small thread pool, so one slow or broken model shows
+up as an error instead of holding up the others. If the fused graph
+fails, its models are re-run one task each, so only the culprit shows
+up as an error.
+
+Concurrent prediction requests are grouped by a MicroBatcher so several
+users clicking Predict at once share one batched forward pass, and a
+PredictionCache remembers the results for images it has already seen.
+
+Which models count as "best" comes from the best_models table, through a
+BestModelSwitcher: when training produces a new best model, it's loaded
+and warmed up in the background while the old one keeps serving, then
+swapped in - no restart, and no request waits for it. The switcher pins
+each set to its files' modification times when it takes the set on, so
+requests don't stat the model files, and an architecture whose file has
+gone missing is left out rather than failing every prediction.
+
+Nothing here uses model.predict(): for a handful of images it spends far
+longer building its data adapter and callbacks than running the model.
+Every cached model instead gets a tf.function serving signature with a
+fixed (None, 28, 28) input spec, warmed up when the model is loaded.
+
+Architectures can also be switched to the TFLite interpreter backend,
+which runs the .tflite export saved next to the .keras file, or to the
+pure-NumPy backend in numpy_inference.py.
+"""
+
+import hashlib
+import os
+import queue
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+import numpy as np
+
+from db import load_best_models
+from instrumentation import registry, timed, count
+from lazy import lazy_import
+from models import load_model, load_tflite
+from numpy_inference import load_numpy_model
+
+# Only imported once a Keras/TFLite model is actually used, so a worker on
+# the NumPy backend never loads TensorFlow
+tf = lazy_import('tensorflow')
+
+
+# Default location of saved models (same folder save_model writes to)
+ARTIFACTS_DIR = 'artifacts'
+
+# Rough memory budget for resident models. The three built-in
+# architectures are all well under 10 MB each, so this is plenty.
+DEFAULT_MEMORY_BUDGET_MB = 256
+
+# Micro-batching: wait at most this long for more requests to share a batch
+BATCH_MAX_SIZE = 32
+BATCH_MAX_WAIT_MS = 5
+
+# Batch sizes the serving functions actually run with. Inputs are padded
+# up to the next bucket (and split if bigger than the last one), so the
+# backend only ever sees a few shapes and can reuse its kernels for them.
+BATCH_BUCKETS = (1, 8, 32, 128, 512)
+
+# Threads for running models side by side (TensorFlow releases the GIL while it runs)
+INFERENCE_THREADS = 4
+
+# How long the Predict tab waits for a model before showing it as timed out
+MODEL_TIMEOUT_S = 5.0
+
+# Run the Keras best models as one fused graph (one task) when there's no
+# deadline. With a deadline each model is always its own task, so each one
+# gets the whole deadline and a hung model doesn't take the others down with it
+FUSE_KERAS_MODELS = True
+
+# Prediction results remembered for repeated inputs (28×28 images)
+PREDICTION_CACHE_SIZE = 1024
+
+# Fused graphs kept for different sets of best models - two, so requests
+# still on the old set keep their graph while a new one is swapped in
+FUSED_GRAPHS_KEPT = 2
+
+# How often the served best models' files are checked for being rewritten
+# or deleted (between checks, requests don't touch the filesystem)
+BEST_MODELS_RECHECK_S = 5.0
+
+
+# Inference backend per architecture: 'keras' (default), 'tflite' or 'numpy'.
+# e.g. {'Deeper CNN': 'tflite'} to serve the Deeper CNN with the TFLite interpreter.
+INFERENCE_BACKENDS = {}
+BACKENDS = ('keras', 'tflite', 'numpy')
+
+# Environment variable that picks backends without editing the code (serve_http.py's
+# --backend does the same): 'numpy' for every architecture, or 'MLP=numpy,Deeper CNN=tflite'
+BACKEND_ENV_VAR = 'MNIST_INFERENCE_BACKEND'
+
+
+# ============================================================================
+# MODEL CACHE
+# ============================================================================
+
+def parse_backends(spec):
+    """
+    Turn a backend setting like 'numpy' or 'numpy,Deeper CNN=tflite' into
+    (backend for every architecture or None, {'Architecture': backend}).
+
+    Raises ValueError for a backend that isn't one of BACKENDS.
+    """
+    default = None
+    backends = {}
+    for part in spec.split(','):
+        if not part.strip():
+            continue
+        arch, _, backend = part.rpartition('=')
+        backend = backend.strip().lower()
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend '{backend}' (expected one of {BACKENDS})")
+        if arch.strip():
+            backends[arch.strip()] = backend
+        else:
+            default = backend
+    return default, backends
+
+
+def _model_size_bytes(model):
+    """Estimate how much memory a model's weights take up."""
+    return sum(w.nbytes for w in model.get_weights())
+
+
+def _serving_signature():
+    """Fixed input spec - with a None batch dimension the graph is traced once."""
+    return [tf.TensorSpec(shape=(None, 28, 28), dtype=tf.float32)]
+
+
+def make_serving_fn(model):
+    """Wrap a Keras model in a compiled inference function and warm it up."""
+    @tf.function(input_signature=_serving_signature())
+    def serve(images):
+        return model(images, training=False)
+
+    # First call traces the graph - do it now rather than on a user's request
+    serve(np.zeros((1, 28, 28), dtype='float32'))
+    return serve
+
+
+def _bucket_size(n):
+    """Smallest batch bucket that fits n images."""
+    for size in BATCH_BUCKETS:
+        if size >= n:
+            return size
+    return BATCH_BUCKETS[-1]
+
+
+def run_bucketed(fn, images):
+    """
+    Call a serving function on images padded to bucket-sized batches.
+
+    Args:
+        fn: tf.function (or TFLiteModel) taking a (batch, 28, 28) float32
+            batch and returning one tensor/array or a list of them
+        images (np.ndarray): array of shape (N, 28, 28), values 0-1
+
+    Returns:
+        list: one numpy array of shape (N, ...) per output of fn
+    """
+    images = np.asarray(images, dtype='float32').reshape(-1, 28, 28)
+    max_bucket = BATCH_BUCKETS[-1]
+    pieces = []
+
+    for start in range(0, len(images), max_bucket):
+        chunk = images[start:start + max_bucket]
+        n = len(chunk)
+        size = _bucket_size(n)
+        if size != n:
+            padded = np.zeros((size, 28, 28), dtype='float32')
+            padded[:n] = chunk
+            chunk = padded
+
+        outputs = fn(chunk)
+        if not isinstance(outputs, (list, tuple)):
+            outputs = [outputs]
+        pieces.append([np.asarray(output)[:n] for output in outputs])
+
+    return [np.concatenate(parts) for parts in zip(*pieces)]
+
+
+class InferenceEngine:
+    """
+    LRU cache of loaded models.
+
+    Models are keyed on (filename, mtime, backend). When the cache goes over
+    the memory budget, the least recently used models are dropped first.
+    """
+
+    def __init__(self, artifacts_dir=ARTIFACTS_DIR, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB):
+        self.artifacts_dir = artifacts_dir
+        self.memory_budget_bytes = int(memory_budget_mb * 1024 * 1024)
+        self._models = OrderedDict()   # (filename, mtime, backend) -> (model, serving fn, size_bytes)
+        self._lock = threading.Lock()
+        self._loading = {}             # key -> Event, so two threads don't load the same file
+        self.hits = 0
+        self.misses = 0
+        self._fused = OrderedDict()    # version -> (version, architectures, graph function, load errors)
+        self._fused_building = {}      # version -> Lock, so one thread builds each graph
+        self._unfused = OrderedDict()  # versions whose fused graph failed
+        self._fused_lock = threading.Lock()
+        self._adhoc_serving = weakref.WeakKeyDictionary()   # models not loaded through the cache
+        self.backends = dict(INFERENCE_BACKENDS)
+        self.default_backend = 'keras'
+        if os.environ.get(BACKEND_ENV_VAR):
+            try:
+                self.configure_backends(os.environ[BACKEND_ENV_VAR])
+            except ValueError as e:
+                print(f"Warning: ignoring {BACKEND_ENV_VAR}: {e}")
+        self.fuse = FUSE_KERAS_MODELS
+        self.max_threads = INFERENCE_THREADS
+        self._pool = None              # started on first use
+        self._stuck = {}               # task key -> Future of a timed-out task still running
+        self.timeouts = 0
+
+    def _key(self, filename, backend='keras', mtime=None):
+        """
+        Cache key for a model file - changes whenever the file is rewritten.
+
+        Pass the file's mtime if it's already known (see pin()) to save a stat.
+        """
+        if mtime is None:
+            mtime = os.path.getmtime(os.path.join(self.artifacts_dir, filename))
+        if filename.endswith('.tflite'):
+            backend = 'tflite'
+        return (filename, mtime, backend)
+
+    def get_model(self, filename, backend='keras', mtime=None):
+        """Return the loaded model for an artifact filename, loading it if needed."""
+        return self._get_entry(filename, backend, mtime)[0]
+
+    def get_serving_fn(self, filename, backend='keras', mtime=None):
+        """Return the compiled serving function for an artifact filename."""
+        return self._get_entry(filename, backend, mtime)[1]
+
+    def serving_fn_for_model(self, model):
+        """Serving function for a model object that didn't come from the cache."""
+        with self._lock:
+            serve = self._adhoc_serving.get(model)
+        if serve is None:
+            serve = make_serving_fn(model)
+            with self._lock:
+                self._adhoc_serving[model] = serve
+        return serve
+
+    def predict(self, filename, images, backend='keras'):
+        """Probabilities of shape (N, 10) for a batch of (N, 28, 28) images."""
+        return self._run_one(self.get_serving_fn(filename, backend), images, backend)
+
+    @staticmethod
+    def _run_one(serve, images, backend):
+        """Run one model's serving function on a batch."""
+        if backend == 'numpy':
+            # No graph to retrace, so no point padding to buckets
+            return serve(images)
+        return run_bucketed(serve, images)[0]
+
+    def _get_entry(self, filename, backend='keras', mtime=None):
+        """(model, serving fn, size) for a file, loading and warming it up on a miss."""
+        key = self._key(filename, backend, mtime)
+
+        while True:
+            with self._lock:
+                if key in self._models:
+                    self._models.move_to_end(key)
+                    self.hits += 1
+                    return self._models[key]
+
+                pending = self._loading.get(key)
+                if pending is None:
+                    # Nobody else is loading it - this thread will
+                    pending = threading.Event()
+                    self._loading[key] = pending
+                    self.misses += 1
+                    break
+
+            # Another thread is already loading this file, wait for it
+            pending.wait()
+
+        try:
+            path = os.path.join(self.artifacts_dir, filename)
+            if key[2] == 'tflite':
+                # The interpreter is its own serving function
+                model = load_tflite(path)
+                entry = (model, model, os.path.getsize(path))
+            elif key[2] == 'numpy':
+                model = load_numpy_model(path)
+                entry = (model, model, model.weights_nbytes)
+            else:
+                model = load_model(path)
+                entry = (model, make_serving_fn(model), _model_size_bytes(model))
+            with self._lock:
+                self._drop_stale(key)
+                self._models[key] = entry
+                self._evict()
+            return entry
+        finally:
+            with self._lock:
+                del self._loading[key]
+            pending.set()
+
+    def _drop_stale(self, current_key):
+        """Remove older versions of a file that has since been overwritten."""
+        filename, _, backend = current_key
+        for key in list(self._models):
+            if key[0] == filename and key[2] == backend and key != current_key:
+                del self._models[key]
+
+    def _evict(self):
+        """Drop least recently used models until we're within the memory budget."""
+        # Always keep at least the most recent model, even if it's over budget on its own
+        while len(self._models) > 1 and self.memory_bytes() > self.memory_budget_bytes:
+            self._models.popitem(last=False)
+
+    def memory_bytes(self):
+        """Total estimated memory used by cached models."""
+        return sum(size for _, _, size in self._models.values())
+
+    def clear(self):
+        """Forget all cached models."""
+        with self._lock:
+            self._models.clear()
+        with self._fused_lock:
+            self._fused.clear()
+            self._fused_building.clear()
+            self._unfused.clear()
+
+    def stats(self):
+        """Cache statistics (for debugging / diagnostics)."""
+        with self._lock:
+            return {
+                'models': [key[0] for key in self._models],
+                'memory_mb': self.memory_bytes() / (1024 * 1024),
+                'budget_mb': self.memory_budget_bytes / (1024 * 1024),
+                'hits': self.hits,
+                'misses': self.misses,
+                'timeouts': self.timeouts,
+                'stuck_tasks': sum(not future.done() for future in self._stuck.values()),
+            }
+
+    def pin(self, best_models):
+        """
+        Look up the modification time of every file a set of best models uses.
+
+        Returns a ServedModels holding the architectures whose file exists,
+        with the ones whose file is missing in its `missing` dict instead.
+        This is the only place predictions stat the model files - the
+        switcher pins each set once, rather than every request doing it.
+        """
+        served = ServedModels()
+        for arch, (filename, accuracy) in best_models.items():
+            try:
+                served.mtimes[filename] = os.path.getmtime(os.path.join(self.artifacts_dir, filename))
+            except OSError:
+                served.missing[arch] = FileNotFoundError(f"{filename} not found on disk")
+                continue
+            served[arch] = (filename, accuracy)
+
+            # The TFLite export too, in case the architecture gets switched to it
+            tflite_name = os.path.splitext(filename)[0] + '.tflite'
+            try:
+                served.mtimes[tflite_name] = os.path.getmtime(os.path.join(self.artifacts_dir, tflite_name))
+            except OSError:
+                pass
+
+        served.version = tuple(sorted(
+            (arch, filename, served.mtimes[filename]) for arch, (filename, _) in served.items()
+        ))
+        return served
+
+    # ------------------------------------------------------------------
+    # Backend selection
+    # ------------------------------------------------------------------
+
+    def set_backend(self, architecture, backend):
+        """Choose 'keras', 'tflite' or 'numpy' inference for one architecture."""
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend '{backend}' (expected one of {BACKENDS})")
+        self.backends[architecture] = backend
+
+    def configure_backends(self, spec):
+        """Apply a backend setting such as 'numpy' or 'MLP=numpy,Deeper CNN=tflite' (see parse_backends)."""
+        default, backends = parse_backends(spec)
+        if default is not None:
+            # Applies to every architecture not named in the setting
+            self.default_backend = default
+            self.backends = {}
+        self.backends.update(backends)
+
+    def backend_for(self, architecture):
+        """The backend an architecture runs on."""
+        return self.backends.get(architecture, self.default_backend)
+
+    def _split_backends(self, served):
+        """
+        Split pinned best models into those served by the fused Keras graph and the rest.
+
+        Returns ({'Architecture': (filename, accuracy)} for Keras,
+                 {'Architecture': (filename, backend)} for TFLite/NumPy).
+        """
+        keras_models = {}
+        other_models = {}
+        for arch, (filename, accuracy) in served.items():
+            backend = self.backend_for(arch)
+            if backend == 'numpy':
+                other_models[arch] = (filename, 'numpy')
+                continue
+            if backend == 'tflite':
+                tflite_name = os.path.splitext(filename)[0] + '.tflite'
+                if tflite_name in served.mtimes:
+                    other_models[arch] = (tflite_name, 'tflite')
+                    continue
+                # Not exported for this run - fall back to the Keras model
+                print(f"Warning: no TFLite export for {filename}, using Keras instead.")
+            keras_models[arch] = (filename, accuracy)
+        return keras_models, other_models
+
+    # ------------------------------------------------------------------
+    # Fused multi-model prediction
+    # ------------------------------------------------------------------
+
+    def _get_fused(self, best_models, mtimes, version):
+        """
+        Return the fused graph for these best models, building it only if it's not cached.
+
+        A build where some models failed to load is cached too (with the
+        errors), so a broken file isn't reloaded on every request. The
+        version includes each file's modification time, so replacing the
+        file - or a new set of best models - gets a fresh build.
+        """
+        with self._fused_lock:
+            fused = self._fused.get(version)
+            if fused is not None:
+                self._fused.move_to_end(version)
+                return fused
+            building = self._fused_building.setdefault(version, threading.Lock())
+
+        # Built outside _fused_lock, so requests for other versions (e.g. the
+        # old best models during a swap) aren't held up by the model loading
+        with building:
+            with self._fused_lock:
+                fused = self._fused.get(version)
+            if fused is None:
+                fused = self._build_fused(version, best_models, mtimes)
+                with self._fused_lock:
+                    self._fused[version] = fused
+                    self._fused.move_to_end(version)
+                    while len(self._fused) > FUSED_GRAPHS_KEPT:
+                        old_version, _ = self._fused.popitem(last=False)
+                        self._fused_building.pop(old_version, None)
+            return fused
+
+    def _build_fused(self, version, best_models, mtimes):
+        """Wrap all the best models in one tf.function with a single input."""
+        architectures = []
+        loaded = []
+        errors = {}
+        for arch, (filename, _) in best_models.items():
+            try:
+                loaded.append(self.get_model(filename, mtime=mtimes.get(filename)))
+                architectures.append(arch)
+            except Exception as e:
+                errors[arch] = e
+
+        @tf.function(input_signature=_serving_signature())
+        def fused(images):
+            return [model(images, training=False) for model in loaded]
+
+        if loaded:
+            fused(np.zeros((1, 28, 28), dtype='float32'))   # warm up
+
+        return version, architectures, fused, errors
+
+    def _get_pool(self):
+        """Thread pool the models run on, started on first use. Call with self._lock held."""
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.max_threads, thread_name_prefix='inference')
+        return self._pool
+
+    def _model_tasks(self, models, served, images, results):
+        """
+        One task per model for {'Architecture': (filename, backend)}.
+
+        Returns {(architecture,): (task key, function)}; models that fail
+        to load get their exception in results instead.
+        """
+        tasks = {}
+        for arch, (filename, backend) in models.items():
+            try:
+                serve = self.get_serving_fn(filename, backend, served.mtimes.get(filename))
+            except Exception as e:
+                results[arch] = e
+                continue
+            tasks[(arch,)] = ((filename, backend),
+                              lambda serve=serve, backend=backend: [self._run_one(serve, images, backend)])
+        return tasks
+
+    def _run_tasks(self, tasks, timeout):
+        """
+        Run {architectures: (task key, function)} side by side on the pool.
+
+        Returns {'Architecture': output, or the exception / TimeoutError}.
+
+        A task that's already running can't be cancelled, so one that times
+        out keeps its worker thread until it finishes. The pool is swapped
+        for a fresh one so the stuck thread doesn't shrink it (the old
+        pool's threads exit as they finish), and until the stuck task is
+        done the same task key gets an immediate TimeoutError rather than
+        a second thread stuck behind it.
+        """
+        results = {}
+        futures = {}
+        # Submitted under the lock, so another request that times out can't
+        # shut the pool down between getting it and submitting to it
+        with self._lock:
+            pool = self._get_pool()
+            for architectures, (key, task) in tasks.items():
+                stuck = self._stuck.get(key)
+                if stuck is not None and not stuck.done():
+                    error = TimeoutError("still busy with an earlier request that timed out")
+                    results.update(dict.fromkeys(architectures, error))
+                    continue
+                self._stuck.pop(key, None)
+                futures[pool.submit(task)] = (architectures, key)
+        if not futures:
+            return results
+
+        _, not_done = wait(futures, timeout=timeout)
+        for future, (architectures, key) in futures.items():
+            if future in not_done:
+                if not future.cancel():
+                    # Left to finish in the background - its result is just ignored
+                    with self._lock:
+                        self._stuck = {k: f for k, f in self._stuck.items() if not f.done()}
+                        self._stuck[key] = future
+                        if self._pool is pool:
+                            pool.shutdown(wait=False)
+                            self._pool = None
+                outputs = [TimeoutError(f"no result within {timeout:g}s")] * len(architectures)
+            else:
+                try:
+                    outputs = future.result()
+                except Exception as e:
+                    outputs = [e] * len(architectures)
+            results.update(zip(architectures, outputs))
+        return results
+
+    @timed('inference.predict_all')
+    def predict_all(self, best_models, images, timeout=None):
+        """
+        Run every best model on a batch of images in one call.
+
+        Args:
+            best_models (dict): {'Architecture': ('filename.keras', accuracy)}
+                as returned by get_best_models() - ideally already pinned
+                (live_models.current() is), otherwise it's pinned here
+            images (np.ndarray): float32 array of shape (N, 28, 28), values 0-1
+            timeout (float): seconds to wait for the models (None waits as
+                long as it takes)
+
+        Returns:
+            dict: {'Architecture': probabilities of shape (N, 10)}, in the
+            same order as best_models. If a model couldn't be loaded or
+            failed its value is the exception instead (FileNotFoundError
+            if its file is missing), and a TimeoutError if it didn't
+            finish in time.
+
+        Without a timeout, Keras-backed architectures share the fused
+        graph (one task) unless self.fuse is off. With one, every model
+        is its own task, so each gets the whole deadline - the fused
+        graph could only time out all of them together. The tasks run
+        side by side on the engine's thread pool. Models are loaded
+        before the clock starts, so a slow first load doesn't count as a
+        timeout.
+
+        If the fused graph raises, its models are run again as one task
+        each, so the others still get a result, and that set of best
+        models isn't fused any more.
+        """
+        if isinstance(best_models, ServedModels):
+            served = best_models
+            results = {}
+        else:
+            served = self.pin(best_models)
+            results = dict(served.missing)
+
+        keras_models, other_models = self._split_backends(served)
+        keras_tasks = {arch: (filename, 'keras') for arch, (filename, _) in keras_models.items()}
+        version = tuple(item for item in served.version if item[0] in keras_models)
+        fused_architectures = ()
+
+        if keras_models and self.fuse and timeout is None and version not in self._unfused:
+            _, architectures, fused, errors = self._get_fused(keras_models, served.mtimes, version)
+            results.update(errors)
+            tasks = self._model_tasks(other_models, served, images, results)
+            if architectures:
+                fused_architectures = tuple(architectures)
+                tasks[fused_architectures] = (('fused', version), lambda: run_bucketed(fused, images))
+        else:
+            tasks = self._model_tasks({**other_models, **keras_tasks}, served, images, results)
+        results.update(self._run_tasks(tasks, timeout))
+
+        if any(isinstance(results[arch], Exception) for arch in fused_architectures):
+            # Something in the fused graph failed - run its models one by
+            # one to find out which, and stop fusing this set
+            count('inference.fused_fallbacks')
+            with self._fused_lock:
+                self._unfused[version] = True
+                while len(self._unfused) > FUSED_GRAPHS_KEPT:
+                    self._unfused.popitem(last=False)
+            retry = {arch: keras_tasks[arch] for arch in fused_architectures}
+            results.update(self._run_tasks(self._model_tasks(retry, served, images, results), timeout))
+
+        timeouts = sum(isinstance(results[arch], TimeoutError) for arch in served)
+        if timeouts:
+            with self._lock:
+                self.timeouts += timeouts
+            count('inference.timeouts', timeouts)
+
+        return {arch: results[arch] for arch in best_models}
+
+
+# ============================================================================
+# BEST MODEL HOT-SWAP
+# ============================================================================
+
+class ServedModels(dict):
+    """
+    A set of best models pinned to their files, made by InferenceEngine.pin().
+
+    It's an ordinary {'Architecture': ('filename.keras', accuracy)} dict,
+    plus:
+        mtimes: {filename: modification time} for every file it can use
+            (each .keras file and any .tflite export next to it)
+        missing: {'Architecture': FileNotFoundError} for the ones left out
+        version: identifies the set - changes if any file is swapped or rewritten
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.mtimes = {}
+        self.missing = {}
+        self.version = ()
+
+
+class BestModelSwitcher:
+    """
+    The best model per architecture that's being served right now.
+
+    `load` returns the latest best models (db.load_best_models, which only
+    re-reads the table when the database changes). When they change - a
+    training job just beat the previous best - the new set is pinned,
+    loaded and run once in a background thread while requests keep getting
+    the old set, then swapped in with a single assignment. A set that fails
+    to load is never swapped in.
+
+    Pinning (checking the files' modification times) happens when the
+    table changes and every BEST_MODELS_RECHECK_S seconds, not on every
+    request. A best model whose file has been deleted is left out, with a
+    warning, instead of failing predictions.
+    """
+
+    def __init__(self, engine, load=load_best_models, recheck_s=BEST_MODELS_RECHECK_S):
+        self.engine = engine
+        self._load = load
+        self.recheck_s = recheck_s
+        self._lock = threading.Lock()
+        self._source = None     # what load() returned when the files were last pinned
+        self._checked_at = 0.0
+        self._serving = None    # pinned best models requests get
+        self._warming = None    # newer pinned best models being warmed up
+        self._failed = None     # newer pinned best models that wouldn't load
+        self.swaps = 0
+
+    def current(self):
+        """
+        {'Architecture': ('filename.keras', accuracy)} to predict with (a ServedModels).
+
+        Shared between callers, so don't modify it.
+        """
+        latest = self._load()
+        now = time.monotonic()
+        with self._lock:
+            if (self._serving is not None and latest == self._source
+                    and now - self._checked_at < self.recheck_s):
+                return self._serving
+
+            candidate = self.engine.pin(latest)
+            self._source, self._checked_at = latest, now
+
+            if self._serving is None:
+                # Nothing to serve in the meantime - use the latest straight away
+                self._serving = candidate
+                self._warn_missing(candidate)
+            elif candidate.version == self._serving.version:
+                # Back to what's being served - drop any swap still warming up
+                self._warming = None
+            elif not any(other is not None and candidate.version == other.version
+                         for other in (self._warming, self._failed)):
+                self._warming = candidate
+                threading.Thread(target=self._warm_up, args=(candidate,), name='model-swap', daemon=True).start()
+            return self._serving
+
+    @staticmethod
+    def _warn_missing(served):
+        for arch, error in served.missing.items():
+            print(f"Warning: Best model for {arch} ({error}) - leaving it out.")
+
+    def _warm_up(self, best_models):
+        """Load and run a new set of best models, then swap them in if that worked."""
+        try:
+            results = self.engine.predict_all(best_models, np.zeros((1, 28, 28), dtype='float32'))
+            errors = {arch: result for arch, result in results.items() if isinstance(result, Exception)}
+        except Exception as e:
+            errors = {arch: e for arch in best_models}
+
+        with self._lock:
+            if self._warming is not best_models:
+                return   # an even newer set came along - that one will swap in
+            self._warming = None
+            if errors:
+                self._failed = best_models
+                for arch, error in errors.items():
+                    print(f"Warning: new best {arch} model {best_models[arch][0]} didn't load, "
+                          f"still serving {self._serving.get(arch, ('nothing',))[0]}: {error}")
+                return
+            self._serving = best_models
+            self.swaps += 1
+        self._warn_missing(best_models)
+        print(f"Now serving best models: {', '.join(f for f, _ in best_models.values())}")
+
+    def preload(self):
+        """
+        Warm up the best models being served in a background thread.
+
+        Called at launch, so the first Predict click (or HTTP request)
+        doesn't wait for the models to load. Returns the thread, which
+        benchmarks join() before timing anything.
+        """
+        best_models = self.current()
+
+        def _warm():
+            results = self.engine.predict_all(best_models, np.zeros((1, 28, 28), dtype='float32'))
+            for arch, result in results.items():
+                if isinstance(result, Exception):
+                    print(f"Warning: could not preload {best_models[arch][0]}: {result}")
+
+        thread = threading.Thread(target=_warm, name='model-preload', daemon=True)
+        thread.start()
+        return thread
+
+
+# ============================================================================
+# REQUEST MICRO-BATCHING
+# ============================================================================
+
+class MicroBatcher:
+    """
+    Collects single-image prediction requests from many threads into batches.
+
+    Each Gradio worker thread calls predict() with one image. A background
+    thread takes the first waiting request, then keeps collecting more for
+    up to max_wait_ms (or until max_batch_size), runs them through the
+    engine as one batch, and hands each caller back its own row. A model
+    that takes longer than `timeout` seconds comes back as a TimeoutError.
+    """
+
+    def __init__(self, engine, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS,
+                 timeout=MODEL_TIMEOUT_S):
+        self.engine = engine
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.occupancy = {}   # batch size -> number of batches that size
+
+    def _ensure_started(self):
+        """Start the batching thread on first use."""
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+                self._thread.start()
+
+    def predict(self, best_models, image):
+        """
+        Predict one image with every best model, batched with other callers.
+
+        Args:
+            best_models (dict): as returned by get_best_models()
+            image (np.ndarray): float32 array of shape (28, 28), values 0-1
+
+        Returns:
+            dict: {'Architecture': probabilities of shape (10,)}, or the
+            exception for a model that failed.
+        """
+        self._ensure_started()
+        future = Future()
+        self._queue.put((best_models, np.asarray(image, dtype='float32').reshape(28, 28), future))
+        return future.result()
+
+    def _collect(self):
+        """Block for the first request, then gather more until the batch is full or time runs out."""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        """Batching thread main loop."""
+        while True:
+            batch = self._collect()
+
+            # Requests that arrived around a model swap can have different best models
+            groups = {}
+            for best_models, image, future in batch:
+                key = tuple(sorted(best_models.items()))
+                groups.setdefault(key, (best_models, []))[1].append((image, future))
+
+            for best_models, requests in groups.values():
+                self._run_group(best_models, requests)
+
+            with self._stats_lock:
+                self.batches += 1
+                self.items += len(batch)
+                self.occupancy[len(batch)] = self.occupancy.get(len(batch), 0) + 1
+
+    def _run_group(self, best_models, requests):
+        """One forward pass for a group of requests that share the same models."""
+        count('inference.batches')
+        try:
+            images = np.stack([image for image, _ in requests])
+            results = self.engine.predict_all(best_models, images, timeout=self.timeout)
+        except Exception as e:
+            for _, future in requests:
+                future.set_exception(e)
+            return
+
+        for row, (_, future) in enumerate(requests):
+            future.set_result({
+                arch: result if isinstance(result, Exception) else result[row]
+                for arch, result in results.items()
+            })
+
+    def stats(self):
+        """Batch occupancy counters."""
+        with self._stats_lock:
+            return {
+                'batches': self.batches,
+                'items': self.items,
+                'mean_batch_size': self.items / self.batches if self.batches else 0.0,
+                'occupancy': dict(sorted(self.occupancy.items())),
+                'queued': self._queue.qsize(),
+            }
+
+
+# ============================================================================
+# PREDICTION RESULT CACHE
+# ============================================================================
+
+class PredictionCache:
+    """
+    Remembers the results for images that have been predicted before.
+
+    People re-upload the same sample images and click Predict again and
+    again. Results are kept in an LRU cache keyed on a hash of the
+    preprocessed 28×28 image plus the version of the best models (files,
+    their modification times and backends), so a new best model never
+    gets an old answer - and as soon as a new version shows up, everything
+    cached for the old one is dropped. Misses go through the batcher.
+    """
+
+    def __init__(self, batcher, max_entries=PREDICTION_CACHE_SIZE):
+        self.batcher = batcher
+        self.engine = batcher.engine
+        self.max_entries = max_entries
+        self._results = OrderedDict()   # image hash -> results, oldest first
+        self._version = None            # best models version the results are for
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _version_of(self, best_models):
+        """Identify the models that will produce a result (including their backends)."""
+        if not isinstance(best_models, ServedModels):
+            best_models = self.engine.pin(best_models)
+        return (
+            best_models.version,
+            tuple(sorted((arch, self.engine.backend_for(arch)) for arch in best_models)),
+        )
+
+    def predict(self, best_models, image):
+        """
+        Predict one image with every best model, reusing an earlier result if there is one.
+
+        Arguments and return value as for MicroBatcher.predict(). The
+        probability arrays are shared with other callers, so they're read-only.
+        """
+        image = np.ascontiguousarray(image, dtype='float32').reshape(28, 28)
+        key = hashlib.blake2b(image.tobytes(), digest_size=16).digest()
+        version = self._version_of(best_models)
+
+        with self._lock:
+            if version != self._version:
+                # New best models (or backends) - nothing cached is any use now
+                if self._results:
+                    self.invalidations += 1
+                self._results.clear()
+                self._version = version
+            elif key in self._results:
+                self._results.move_to_end(key)
+                self.hits += 1
+                return self._results[key]
+            self.misses += 1
+
+        results = self.batcher.predict(best_models, image)
+        if any(isinstance(result, Exception) for result in results.values()):
+            # Don't remember failures - the next click should try again
+            return results
+
+        results = {arch: np.array(result) for arch, result in results.items()}
+        for result in results.values():
+            result.flags.writeable = False
+        with self._lock:
+            # Models may have been swapped while this was predicting
+            if version == self._version:
+                self._results[key] = results
+                while len(self._results) > self.max_entries:
+                    self._results.popitem(last=False)
+        return results
+
+    def clear(self):
+        """Forget all cached results."""
+        with self._lock:
+            self._results.clear()
+
+    def stats(self):
+        """Hit/miss statistics."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._results),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'invalidations': self.invalidations,
+            }
+
+# Shared engine used by the app and models.predict_digit
+engine = InferenceEngine()
+
+# Shared batcher used by the Predict tab
+batcher = MicroBatcher(engine)
+
+# Shared result cache in front of the batcher
+prediction_cache = PredictionCache(batcher)
+
+# Best models served by the app, swapped over as training finds better ones
+live_models = BestModelSwitcher(engine)
+
+# Cache and batcher stats show up in the Diagnostics tab and on /metrics
+registry.register_gauges('model_cache', engine.stats)
+registry.register_gauges('batcher', batcher.stats)
+registry.register_gauges('prediction_cache', prediction_cache.stats)
+registry.register_gauges('best_models', lambda: {'swaps': live_models.swaps})
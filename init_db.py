@@ -1,18 +1,35 @@
 """
 Database initialisation for training history.
-Creates SQLite database with three tables.
+Creates SQLite database with four tables (models, training_runs, metrics
+and best_models) and their indexes, and adds any columns an older
+database is missing. best_models is rebuilt from the model files on disk.
 """
 
 import sqlite3
 import os
 
-def create_database():
-    """Set up the SQLite database and tables."""
+import db
+from db import configure_connection, rebuild_best_models
+
+def create_database(verbose=True, db_path=None):
+    """
+    Set up the SQLite database and tables.
+
+    Safe to run on an existing database - it only adds what's missing.
+    The app calls it with verbose=False at startup so older databases
+    get upgraded automatically. db_path defaults to db.DB_PATH as it is
+    when called (so pointing db.DB_PATH at a scratch database covers this
+    too), and is only passed for scratch databases (e.g. benchmarks.py).
+    """
+    if db_path is None:
+        db_path = db.DB_PATH
+
     # Make sure artifacts folder exists
-    os.makedirs('artifacts', exist_ok=True)
+    os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
     
-    # Connect to database (creates file if doesn't exist)
-    conn = sqlite3.connect('artifacts/training_history.db')
+    # Connect to database (creates file if doesn't exist), with the same
+    # settings as the app's connections - this is where WAL mode gets switched on
+    conn = configure_connection(sqlite3.connect(db_path))
     cursor = conn.cursor()
     
     # Models table - stores different architectures
@@ -42,7 +59,39 @@ def create_database():
     # Add duration column if it doesn't exist (for Phase 15 upgrade)
     try:
         cursor.execute('ALTER TABLE training_runs ADD COLUMN duration REAL')
-        print("✓ Added duration column to training_runs table")
+        if verbose:
+            print("✓ Added duration column to training_runs table")
+    except sqlite3.OperationalError:
+        # Column already exists
+        pass
+    
+    # TFLite export details - which export was made and how far its
+    # test accuracy drifted from the Keras model
+    for column, column_type in [('tflite_mode', 'TEXT'), ('tflite_accuracy', 'REAL'), ('tflite_drift', 'REAL')]:
+        try:
+            cursor.execute(f'ALTER TABLE training_runs ADD COLUMN {column} {column_type}')
+            if verbose:
+                print(f"✓ Added {column} column to training_runs table")
+        except sqlite3.OperationalError:
+            # Column already exists
+            pass
+    
+    # Hyperparameter sweeps - which sweep (and which trial in it) a run
+    # belongs to. NULL for runs started from the Train tab
+    for column, column_type in [('sweep_id', 'TEXT'), ('sweep_trial', 'INTEGER')]:
+        try:
+            cursor.execute(f'ALTER TABLE training_runs ADD COLUMN {column} {column_type}')
+            if verbose:
+                print(f"✓ Added {column} column to training_runs table")
+        except sqlite3.OperationalError:
+            # Column already exists
+            pass
+    
+    # Performance profile the run was trained with (see profiles.py)
+    try:
+        cursor.execute('ALTER TABLE training_runs ADD COLUMN profile TEXT')
+        if verbose:
+            print("✓ Added profile column to training_runs table")
     except sqlite3.OperationalError:
         # Column already exists
         pass
@@ -60,12 +109,53 @@ def create_database():
         )
     ''')
     
+    # Which evaluation produced val_accuracy: 'full' (whole test set),
+    # 'subset' (stratified sample) or NULL (epoch wasn't validated)
+    try:
+        cursor.execute('ALTER TABLE metrics ADD COLUMN val_kind TEXT')
+        # Everything recorded before this was a full evaluation
+        cursor.execute("UPDATE metrics SET val_kind = 'full' WHERE val_accuracy IS NOT NULL")
+        if verbose:
+            print("✓ Added val_kind column to metrics table")
+    except sqlite3.OperationalError:
+        # Column already exists
+        pass
+    
+    # Indexes for the History tab: best run per architecture, date range
+    # filters, and loading a run's metrics in epoch order
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_training_runs_model_accuracy ON training_runs (model_id, val_accuracy)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_training_runs_created_at ON training_runs (created_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_metrics_run_epoch ON metrics (run_id, epoch)')
+    
+    # Best run per architecture - what the Predict tab serves. Kept up to
+    # date as runs finish (db.update_best_model), so predictions never
+    # have to search training_runs
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS best_models (
+            architecture TEXT PRIMARY KEY,
+            run_id INTEGER,
+            model_filename TEXT,
+            val_accuracy REAL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (run_id) REFERENCES training_runs(run_id)
+        )
+    ''')
+    
+    # Rebuilt every time, so it always matches the model files actually on
+    # disk (the models live next to the database)
+    best = rebuild_best_models(conn, os.path.dirname(db_path) or '.')
+    
     conn.commit()
     conn.close()
     
+    if not verbose:
+        return
+    
     print("✓ Database created successfully!")
-    print("  Tables: models, training_runs, metrics")
-    print("  Location: artifacts/training_history.db")
+    print("  Tables: models, training_runs, metrics, best_models")
+    for architecture, filename in best.items():
+        print(f"  Best {architecture}: {filename}")
+    print(f"  Location: {db_path}")
 
 if __name__ == "__main__":
     create_database()
@@ -0,0 +1,282 @@
+"""
+Timing and counters for the app's hot paths.
+
+Code wraps the stages worth watching in timed() - as a `with` block or
+a decorator - and bumps counters with count(). Every stage gets a
+latency histogram with fixed buckets, so recording is just a few
+additions under a lock (a microsecond or two) and memory never grows.
+
+Other modules can also register gauges: a function returning a dict of
+numbers (e.g. the prediction cache's hit/miss stats), read whenever the
+metrics are looked at.
+
+Everything can be read three ways:
+- snapshot(): rows for the Diagnostics tab (count, mean, p50/p95/p99, max)
+- prometheus_text(): Prometheus text format, served on /metrics by serve_http.py
+- export()/merge(): plain JSON-able state, so a training job's worker
+  process can send its timings back to the app when it finishes
+
+Stage names are dotted, starting with the area they belong to:
+image.*, predict.*, inference.*, model.*, db.*, http.*, train.*
+"""
+
+import functools
+import threading
+import time
+
+
+# Histogram bucket upper bounds in seconds - 0.1ms up to 5 minutes
+# (the top end is for training epochs and model saving)
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+           0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# Prefix for every Prometheus metric name
+METRIC_PREFIX = 'mnist'
+
+
+class Histogram:
+    """Counts of observations per bucket, plus their sum and maximum."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)   # the last one is +Inf
+        self.total = 0.0
+        self.count = 0
+        self.max = 0.0
+        self.errors = 0
+
+    def observe(self, seconds):
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                break
+        else:
+            i = len(BUCKETS)
+        self.counts[i] += 1
+        self.total += seconds
+        self.count += 1
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        """
+        Estimate a quantile (0-1) in seconds, the way Prometheus's
+        histogram_quantile() does: linear within the bucket it falls in.
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for i, n in enumerate(self.counts):
+            if cumulative + n >= rank and n:
+                lower = BUCKETS[i - 1] if i else 0.0
+                upper = BUCKETS[i] if i < len(BUCKETS) else self.max
+                # Never estimate past the slowest one actually seen
+                return min(lower + (upper - lower) * (rank - cumulative) / n, self.max)
+            cumulative += n
+        return self.max
+
+    def to_dict(self):
+        return {'counts': list(self.counts), 'total': self.total, 'count': self.count,
+                'max': self.max, 'errors': self.errors}
+
+    def add(self, state):
+        """Add another histogram's to_dict() into this one."""
+        for i, n in enumerate(state['counts']):
+            self.counts[i] += n
+        self.total += state['total']
+        self.count += state['count']
+        self.max = max(self.max, state['max'])
+        self.errors += state['errors']
+
+
+class _Timer:
+    """What timed() returns - a context manager that also works as a decorator."""
+
+    __slots__ = ('registry', 'stage', 'start')
+
+    def __init__(self, registry, stage):
+        self.registry = registry
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.registry.observe(self.stage, time.perf_counter() - self.start, error=exc_type is not None)
+        return False
+
+    def __call__(self, fn):
+        registry, stage = self.registry, self.stage
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            # A fresh timer per call, so it's safe from several threads at once
+            with _Timer(registry, stage):
+                return fn(*args, **kwargs)
+        return wrapper
+
+
+class MetricsRegistry:
+    """Latency histograms per stage, counters and gauges, safe to use from any thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}   # stage -> Histogram
+        self._counters = {}     # name -> int
+        self._gauges = {}       # prefix -> function returning {name: number}
+        self.started_at = time.time()
+
+    # ------------------------------------------------------------------
+    # Recording
+    # ------------------------------------------------------------------
+
+    def observe(self, stage, seconds, error=False):
+        """Record one timing for a stage."""
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = Histogram()
+            histogram.observe(seconds)
+            if error:
+                histogram.errors += 1
+
+    def timed(self, stage):
+        """
+        Time a block (`with timed('predict.inference'):`) or every call
+        of a function (`@timed('model.load')`). Time spent before an
+        exception still counts, and the exception is counted as an error.
+        """
+        return _Timer(self, stage)
+
+    def count(self, name, n=1):
+        """Add n to a counter."""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def register_gauges(self, prefix, fn):
+        """Report fn()'s numbers (a dict) as gauges named prefix_<key>."""
+        with self._lock:
+            self._gauges[prefix] = fn
+
+    def reset(self):
+        """Forget all timings and counters (gauges stay registered)."""
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+            self.started_at = time.time()
+
+    # ------------------------------------------------------------------
+    # Passing metrics between processes
+    # ------------------------------------------------------------------
+
+    def export(self):
+        """Timings and counters as plain dicts/lists (JSON-able)."""
+        with self._lock:
+            return {
+                'histograms': {stage: h.to_dict() for stage, h in self._histograms.items()},
+                'counters': dict(self._counters),
+            }
+
+    def merge(self, state):
+        """Add another process's export() into this registry."""
+        with self._lock:
+            for stage, histogram_state in state.get('histograms', {}).items():
+                self._histograms.setdefault(stage, Histogram()).add(histogram_state)
+            for name, n in state.get('counters', {}).items():
+                self._counters[name] = self._counters.get(name, 0) + n
+
+    # ------------------------------------------------------------------
+    # Reading
+    # ------------------------------------------------------------------
+
+    def gauges(self):
+        """Current value of every registered gauge, {'prefix_key': number}."""
+        with self._lock:
+            sources = list(self._gauges.items())
+        values = {}
+        for prefix, fn in sources:
+            try:
+                stats = fn()
+            except Exception as e:
+                print(f"Warning: couldn't read {prefix} gauges: {e}")
+                continue
+            for key, value in stats.items():
+                # Only plain numbers - lists and dicts don't fit in a gauge
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    values[f'{prefix}_{key}'] = value
+        return values
+
+    def snapshot(self):
+        """
+        (stage rows, counters) for the Diagnostics tab.
+
+        Each stage row has Stage, Count, Errors, Mean/p50/p95/p99/Max in ms
+        and Total (s). Percentiles are estimated from the histogram buckets.
+        """
+        with self._lock:
+            rows = []
+            for stage in sorted(self._histograms):
+                h = self._histograms[stage]
+                rows.append({
+                    'Stage': stage,
+                    'Count': h.count,
+                    'Errors': h.errors,
+                    'Mean (ms)': round(h.total / h.count * 1000, 3) if h.count else 0.0,
+                    'p50 (ms)': round(h.quantile(0.50) * 1000, 3),
+                    'p95 (ms)': round(h.quantile(0.95) * 1000, 3),
+                    'p99 (ms)': round(h.quantile(0.99) * 1000, 3),
+                    'Max (ms)': round(h.max * 1000, 3),
+                    'Total (s)': round(h.total, 3),
+                })
+            counters = dict(sorted(self._counters.items()))
+        return rows, counters
+
+    def prometheus_text(self):
+        """Everything in Prometheus's text exposition format (version 0.0.4)."""
+        stage_metric = f'{METRIC_PREFIX}_stage_seconds'
+        lines = [
+            f'# HELP {stage_metric} Time spent in each instrumented stage.',
+            f'# TYPE {stage_metric} histogram',
+        ]
+        with self._lock:
+            for stage in sorted(self._histograms):
+                h = self._histograms[stage]
+                cumulative = 0
+                for bound, n in zip(BUCKETS, h.counts):
+                    cumulative += n
+                    lines.append(f'{stage_metric}_bucket{{stage="{stage}",le="{bound:g}"}} {cumulative}')
+                lines.append(f'{stage_metric}_bucket{{stage="{stage}",le="+Inf"}} {h.count}')
+                lines.append(f'{stage_metric}_sum{{stage="{stage}"}} {h.total!r}')
+                lines.append(f'{stage_metric}_count{{stage="{stage}"}} {h.count}')
+
+            lines += [
+                f'# HELP {METRIC_PREFIX}_stage_errors_total Instrumented stages that raised an exception.',
+                f'# TYPE {METRIC_PREFIX}_stage_errors_total counter',
+            ]
+            lines += [f'{METRIC_PREFIX}_stage_errors_total{{stage="{stage}"}} {self._histograms[stage].errors}'
+                      for stage in sorted(self._histograms)]
+
+            lines += [
+                f'# HELP {METRIC_PREFIX}_events_total Counted events.',
+                f'# TYPE {METRIC_PREFIX}_events_total counter',
+            ]
+            lines += [f'{METRIC_PREFIX}_events_total{{event="{name}"}} {n}'
+                      for name, n in sorted(self._counters.items())]
+            started_at = self.started_at
+
+        for name, value in sorted(self.gauges().items()):
+            metric = f'{METRIC_PREFIX}_{name}'
+            lines += [f'# TYPE {metric} gauge', f'{metric} {value!r}']
+
+        lines += [
+            f'# TYPE {METRIC_PREFIX}_metrics_start_time_seconds gauge',
+            f'{METRIC_PREFIX}_metrics_start_time_seconds {started_at!r}',
+        ]
+        return '\n'.join(lines) + '\n'
+
+
+# Shared registry for the whole process, and shortcuts to it
+registry = MetricsRegistry()
+timed = registry.timed
+count = registry.count
+observe = registry.observe
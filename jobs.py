@@ -0,0 +1,332 @@
+"""
+Background training jobs.
+
+Training used to run inside the Gradio request handler, tying up a
+worker for minutes, and two people training at once fought over every
+core. Now the Train tab submits a job and gets a job ID back straight
+away. The scheduler runs at most MAX_CONCURRENT_JOBS at a time, each in
+its own worker process limited to THREADS_PER_JOB threads; the rest
+wait in a queue.
+
+Each worker is a fresh `python jobs.py` process that only imports
+training.py and db.py (not the Gradio app), and TensorFlow's memory goes
+back to the OS when it exits. It reports its status text as JSON lines
+on stdout and stops early if "cancel" is written to its stdin, so the
+UI can poll a job, reattach to it after a browser refresh, or cancel it.
+Just before it finishes it also sends its stage timings, which are added
+to the app's own (see instrumentation.py).
+"""
+
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+import instrumentation
+from profiles import DEFAULT_PROFILE, thread_env
+
+
+# How many training jobs can run at the same time
+MAX_CONCURRENT_JOBS = 2
+
+# CPU threads each job's TensorFlow may use (split the cores between the slots)
+THREADS_PER_JOB = max(1, (os.cpu_count() or 1) // MAX_CONCURRENT_JOBS)
+
+# Finished jobs kept around for the job list / reattaching
+FINISHED_JOBS_KEPT = 50
+
+# How long a cancelled job gets to stop cleanly before it's killed
+CANCEL_GRACE_SECONDS = 30
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+
+# ============================================================================
+# WORKER PROCESS
+# ============================================================================
+
+def _worker_env(threads, profile=DEFAULT_PROFILE):
+    """
+    Environment for a worker: TensorFlow/OpenMP read these when they start up.
+
+    The thread counts come from the job's performance profile; `threads`
+    is the job's share of the cores, for profiles that don't ask for more.
+    """
+    env = dict(os.environ)
+    env.update(thread_env(profile, threads))
+    env['PYTHONUNBUFFERED'] = '1'
+    return env
+
+
+def run_worker(spec):
+    """
+    Body of a worker process: run one training job.
+
+    Status updates go to stdout as JSON lines; everything else that gets
+    printed goes to stderr, which ends up in the app's log.
+    """
+    updates = sys.stdout
+    sys.stdout = sys.stderr
+
+    def report(status, text):
+        updates.write(json.dumps({'status': status, 'text': text}) + '\n')
+        updates.flush()
+
+    # "cancel" on stdin (or the app going away) stops training after the current batch
+    cancel_event = threading.Event()
+
+    def _wait_for_cancel():
+        sys.stdin.readline()
+        cancel_event.set()
+
+    threading.Thread(target=_wait_for_cancel, daemon=True).start()
+
+    import training
+
+    text = ""
+    try:
+        for text in training.train_model(stop_event=cancel_event, **spec):
+            report(RUNNING, text)
+    except training.TrainingCancelled as e:
+        status, text = CANCELLED, str(e)
+    except Exception as e:
+        status, text = FAILED, f"{text}\n\nError during training: {e}".lstrip()
+    else:
+        status = DONE
+
+    # Timings first, so they're in the app's metrics by the time the job shows as finished
+    updates.write(json.dumps({'metrics': instrumentation.registry.export()}) + '\n')
+    report(status, text)
+
+
+# ============================================================================
+# SCHEDULER
+# ============================================================================
+
+class Job:
+    """One training request and its current state."""
+
+    def __init__(self, job_id, spec):
+        self.id = job_id
+        self.spec = spec
+        self.status = QUEUED
+        self.text = "Queued - waiting for a free training slot..."
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.process = None
+        self.cancel_requested_at = None
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+    def summary(self):
+        """Row for the job list."""
+        end = self.finished_at or time.time()
+        return {
+            'Job ID': self.id,
+            'Architecture': self.spec['architecture'],
+            'Epochs': self.spec['epochs'],
+            'Batch Size': self.spec['batch_size'],
+            'Profile': self.spec['profile'],
+            'Status': self.status,
+            'Running for (s)': round(end - self.started_at, 1) if self.started_at else None,
+            'Submitted': time.strftime('%H:%M:%S', time.localtime(self.submitted_at)),
+        }
+
+
+class JobScheduler:
+    """
+    Queues training jobs and runs them in worker processes.
+
+    Nothing is started until the first job is submitted, so the app's
+    startup doesn't pay for it.
+    """
+
+    def __init__(self, max_jobs=MAX_CONCURRENT_JOBS, threads_per_job=THREADS_PER_JOB):
+        self.max_jobs = max_jobs
+        self.threads_per_job = threads_per_job
+        self._jobs = OrderedDict()   # job_id -> Job, oldest first
+        self._pending = deque()      # job_ids waiting for a slot
+        self._changed = threading.Condition()
+        self._thread = None
+
+    def submit(self, architecture, epochs, batch_size, tflite_export="None", input_pipeline="NumPy arrays",
+               val_every=1, val_subset=None, profile=DEFAULT_PROFILE, sweep_id=None, sweep_trial=None):
+        """Queue a training job (arguments as for training.train_model). Returns its job ID."""
+        spec = {
+            'architecture': architecture,
+            'epochs': int(epochs),
+            'batch_size': int(batch_size),
+            'tflite_export': tflite_export,
+            'input_pipeline': input_pipeline,
+            'val_every': int(val_every),
+            'val_subset': int(val_subset) if val_subset else None,
+            'profile': profile,
+            'sweep_id': sweep_id,
+            'sweep_trial': sweep_trial,
+        }
+        job = Job(uuid.uuid4().hex[:8], spec)
+        with self._changed:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='job-scheduler', daemon=True)
+                self._thread.start()
+            self._jobs[job.id] = job
+            self._pending.append(job.id)
+            self._forget_old_jobs()
+            self._changed.notify_all()
+        return job.id
+
+    def get(self, job_id):
+        """The Job with this ID, or None if it's unknown (or long finished)."""
+        with self._changed:
+            return self._jobs.get((job_id or '').strip())
+
+    def list_jobs(self):
+        """All known jobs, newest first."""
+        with self._changed:
+            return list(reversed(self._jobs.values()))
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job. Returns False if there was nothing to cancel."""
+        with self._changed:
+            job = self._jobs.get((job_id or '').strip())
+            if job is None or job.finished:
+                return False
+            if job.status == QUEUED:
+                self._pending.remove(job.id)
+                self._finish(job, CANCELLED, "Cancelled before it started.")
+            elif job.cancel_requested_at is None:
+                # The worker stops after the current batch and cleans up
+                job.cancel_requested_at = time.time()
+                job.text += "\n\nCancelling..."
+                try:
+                    job.process.stdin.write('cancel\n')
+                    job.process.stdin.flush()
+                except OSError:
+                    pass   # already exiting
+            self._changed.notify_all()
+            return True
+
+    def watch(self, job_id, timeout=None):
+        """
+        Yield a job's status text each time it changes, until it finishes.
+
+        Raises KeyError for an unknown job ID.
+        """
+        last = None
+        while True:
+            with self._changed:
+                job = self._jobs.get((job_id or '').strip())
+                if job is None:
+                    raise KeyError(f"No job with ID '{job_id}'")
+                if job.text == last and not job.finished:
+                    self._changed.wait(timeout)
+                    continue
+                text, finished = job.text, job.finished
+            last = text
+            yield text
+            if finished:
+                return
+
+    # ------------------------------------------------------------------
+    # Scheduler thread and worker readers
+    # ------------------------------------------------------------------
+
+    def _loop(self):
+        """Start queued jobs when a slot is free, and kill cancelled jobs that won't stop."""
+        while True:
+            with self._changed:
+                for job in self._jobs.values():
+                    if (job.status == RUNNING and job.cancel_requested_at
+                            and time.time() - job.cancel_requested_at > CANCEL_GRACE_SECONDS):
+                        job.process.kill()
+
+                running = sum(1 for job in self._jobs.values() if job.status == RUNNING)
+                while self._pending and running < self.max_jobs:
+                    self._start(self._jobs[self._pending.popleft()])
+                    running += 1
+                self._changed.wait(1.0)
+
+    def _start(self, job):
+        job.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), json.dumps(job.spec)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+            env=_worker_env(self.threads_per_job, job.spec['profile']),
+        )
+        job.status = RUNNING
+        job.started_at = time.time()
+        job.text = f"Starting worker for job {job.id}..."
+        threading.Thread(target=self._read_updates, args=(job,), name=f'job-{job.id}', daemon=True).start()
+
+    def _read_updates(self, job):
+        """
+        Follow one worker's stdout until it exits.
+
+        However that ends, the job is left in a finished state - otherwise
+        it would show as running (and hold a slot) forever.
+        """
+        error = None
+        try:
+            for line in job.process.stdout:
+                try:
+                    update = json.loads(line)
+                except ValueError:
+                    # Something in the worker printed straight to stdout - not an update
+                    print(f"Warning: job {job.id} worker wrote a line that isn't JSON: {line.rstrip()[:200]}")
+                    continue
+                if 'metrics' in update:
+                    instrumentation.registry.merge(update['metrics'])
+                    continue
+                with self._changed:
+                    if update['status'] == RUNNING:
+                        job.text = update['text'] + ("\n\nCancelling..." if job.cancel_requested_at else "")
+                    else:
+                        self._finish(job, update['status'], update['text'])
+                    self._changed.notify_all()
+        except Exception as e:
+            # Can't follow it any more - stop the worker rather than leave it blocked on a full pipe
+            error = e
+            job.process.kill()
+        finally:
+            exit_code = job.process.wait()
+            with self._changed:
+                if not job.finished:
+                    if job.cancel_requested_at:
+                        self._finish(job, CANCELLED, job.text.replace("Cancelling...", "Training cancelled (worker killed)."))
+                    elif error is not None:
+                        self._finish(job, FAILED, job.text + f"\n\nLost track of the worker: {error}")
+                    else:
+                        self._finish(job, FAILED, job.text + f"\n\nWorker exited unexpectedly (code {exit_code}).")
+                # A slot is free now
+                self._changed.notify_all()
+
+    def _finish(self, job, status, text):
+        job.status = status
+        job.text = text
+        job.finished_at = time.time()
+
+    def _forget_old_jobs(self):
+        finished = [job.id for job in self._jobs.values() if job.finished]
+        for job_id in finished[:max(0, len(finished) - FINISHED_JOBS_KEPT)]:
+            del self._jobs[job_id]
+
+
+# Shared scheduler for the app
+scheduler = JobScheduler()
+
+
+if __name__ == "__main__":
+    # Worker process - see JobScheduler._start()
+    run_worker(json.loads(sys.argv[1]))
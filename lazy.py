@@ -0,0 +1,192 @@
+"""
+Lazy loading for the slow-to-import parts of the app.
+
+TensorFlow alone takes several seconds and a few hundred MB to import,
+and the MNIST dataset takes a couple more to load. A replica that only
+serves predictions (or just shows the History tab) shouldn't pay for
+things it never uses, so heavy modules are wrapped in a LazyModule that
+only imports on first attribute access, and expensive values are built
+on first call with lazy_value().
+
+startup_report() shows what has actually been loaded, how long each
+import took and how much memory the process is using.
+"""
+
+import importlib
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+
+# When this module was first imported - used if the real process start time isn't available
+_IMPORTED_AT = time.perf_counter()
+
+# module name / value label -> seconds spent importing/loading it
+LOAD_TIMES = {}
+
+# Every lazy thing created, so the report can show what's still unloaded
+_REGISTRY = []
+
+
+# ============================================================================
+# LAZY MODULES AND VALUES
+# ============================================================================
+
+class LazyModule:
+    """
+    Stands in for a module until something is actually used from it.
+
+    LazyModule('tensorflow', 'keras.layers') behaves like
+    `from tensorflow.keras import layers`, but nothing is imported until
+    the first attribute lookup (e.g. layers.Dense).
+    """
+
+    def __init__(self, module_name, attribute=None):
+        self._module_name = module_name
+        self._attribute = attribute
+        self._module = None
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    @property
+    def label(self):
+        """Shown in the startup report - the module that actually gets imported."""
+        return self._module_name
+
+    @property
+    def loaded(self):
+        # Counts as loaded if anything imported it, not just this proxy
+        return self._module_name in sys.modules
+
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    already_imported = self._module_name in sys.modules
+                    start = time.perf_counter()
+                    module = importlib.import_module(self._module_name)
+                    if not already_imported:
+                        LOAD_TIMES.setdefault(self._module_name, time.perf_counter() - start)
+                    for part in (self._attribute or '').split('.'):
+                        if part:
+                            module = getattr(module, part)
+                    self._module = module
+        return self._module
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __repr__(self):
+        name = f'{self._module_name}.{self._attribute}' if self._attribute else self._module_name
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return f'<LazyModule {name} ({state})>'
+
+
+def lazy_import(module_name, attribute=None):
+    """Return a LazyModule for module_name (optionally an attribute path inside it)."""
+    return LazyModule(module_name, attribute)
+
+
+class _LazyValue:
+    """Callable that builds a value on first call and returns the same one after."""
+
+    def __init__(self, label, factory):
+        self.label = label
+        self._factory = factory
+        self._value = None
+        self._done = False
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    @property
+    def loaded(self):
+        return self._done
+
+    def __call__(self):
+        if not self._done:
+            with self._lock:
+                if not self._done:
+                    start = time.perf_counter()
+                    self._value = self._factory()
+                    LOAD_TIMES.setdefault(self.label, time.perf_counter() - start)
+                    self._done = True
+        return self._value
+
+
+def lazy_value(label):
+    """
+    Decorator: compute a function's result on first call, then reuse it.
+
+    Thread-safe, so two requests arriving at once only load it once.
+    """
+    def decorator(factory):
+        return _LazyValue(label, factory)
+    return decorator
+
+
+# ============================================================================
+# STARTUP REPORT
+# ============================================================================
+
+def memory_usage_mb():
+    """(current RSS, peak RSS) of this process in MB."""
+    current = peak = None
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS'):
+                    current = int(line.split()[1]) / 1024
+                elif line.startswith('VmHWM'):
+                    peak = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    if peak is None and resource is not None:
+        # Not Linux - ru_maxrss is KB on Linux but bytes on macOS
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak = maxrss / (1024 * 1024) if maxrss > 10 ** 7 else maxrss / 1024
+    return current, peak
+
+
+def seconds_since_start():
+    """How long this process has been running (includes imports before this module)."""
+    try:
+        # Field 22 of /proc/self/stat is the start time in clock ticks after boot
+        with open('/proc/self/stat') as f:
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return uptime - start_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, AttributeError):
+        return time.perf_counter() - _IMPORTED_AT
+
+
+def startup_report():
+    """Text report of load times, what's still unloaded, and memory use."""
+    current, peak = memory_usage_mb()
+    lines = [f"Time since start: {seconds_since_start():.2f}s"]
+    if current is not None:
+        lines.append(f"Memory: {current:.0f} MB RSS (peak {peak:.0f} MB)")
+    elif peak is not None:
+        lines.append(f"Memory: peak {peak:.0f} MB RSS")
+
+    # Several modules can lazily import the same thing - only list it once
+    loaded = {}
+    for item in _REGISTRY:
+        loaded[item.label] = loaded.get(item.label, False) or item.loaded
+
+    for label, is_loaded in loaded.items():
+        if not is_loaded:
+            lines.append(f"  {label:<24} not loaded yet")
+        elif label in LOAD_TIMES:
+            lines.append(f"  {label:<24} loaded in {LOAD_TIMES[label]:.2f}s")
+        else:
+            lines.append(f"  {label:<24} loaded (imported elsewhere)")
+    return "\n".join(lines)
@@ -6,89 +6,251 @@ Three model architectures for MNIST digit classification.
 3. Deeper CNN — two conv layers + dropout (~99%+, ~90s)
 
 All compiled with Adam optimiser and sparse categorical crossentropy.
+A performance profile (profiles.py) can switch on XLA and bfloat16.
+
+Trained models can also be exported to TensorFlow Lite (float or int8
+quantised) for lighter CPU-only inference.
+
+TensorFlow is imported lazily (see lazy.py), the first time a model is
+actually built, loaded or exported.
 """
 
-from tensorflow import keras
-from tensorflow.keras import layers
 import numpy as np
 import os
+import threading
+
+from instrumentation import timed
+from lazy import lazy_import
+from profiles import get_profile, uses_mixed_precision
+
+tf = lazy_import('tensorflow')
+keras = lazy_import('tensorflow', 'keras')
+layers = lazy_import('tensorflow', 'keras.layers')
+
+
+# Number of training images used to calibrate int8 quantisation
+TFLITE_CALIBRATION_SAMPLES = 500
 
 
 # ============================================================================
 # MODEL ARCHITECTURES
 # ============================================================================
+# Each builder takes an optional performance profile (see profiles.py),
+# which decides whether the layers compute in bfloat16 and whether the
+# train step is XLA-compiled. No profile = plain float32, no XLA.
 
-def create_mlp():
-    """Create a simple MLP for digit classification."""
-    model = keras.Sequential([
-        layers.Flatten(input_shape=(28, 28)),  
-        layers.Dense(128, activation='relu'),   
-        layers.Dense(10, activation='softmax')  
-    ])
-    
+def _layer_dtypes(profile):
+    """(hidden layer dtype, output layer dtype) for a profile."""
+    if profile is not None and uses_mixed_precision(profile):
+        # Keep the softmax in float32 - bfloat16 is too coarse for it
+        return 'mixed_bfloat16', 'float32'
+    return None, None
+
+
+def _compile(model, profile):
     model.compile(
         optimizer='adam',
         loss='sparse_categorical_crossentropy',
-        metrics=['accuracy']
+        metrics=['accuracy'],
+        jit_compile=get_profile(profile)['jit_compile'] if profile is not None else None
     )
-    
     return model
 
-def create_small_cnn():
-    """Create a small CNN — one conv layer + pooling + dense."""
+
+def create_mlp(profile=None):
+    """Create a simple MLP for digit classification."""
+    dtype, output_dtype = _layer_dtypes(profile)
     model = keras.Sequential([
-        layers.Reshape((28, 28, 1), input_shape=(28, 28)),
-        layers.Conv2D(32, kernel_size=(3, 3), activation='relu'),
-        layers.MaxPooling2D(pool_size=(2, 2)),
-        layers.Flatten(),
-        layers.Dense(64, activation='relu'),
-        layers.Dense(10, activation='softmax')
+        layers.Flatten(input_shape=(28, 28), dtype=dtype),
+        layers.Dense(128, activation='relu', dtype=dtype),
+        layers.Dense(10, activation='softmax', dtype=output_dtype)
     ])
     
-    model.compile(
-        optimizer='adam',
-        loss='sparse_categorical_crossentropy',
-        metrics=['accuracy']
-    )
+    return _compile(model, profile)
+
+def create_small_cnn(profile=None):
+    """Create a small CNN — one conv layer + pooling + dense."""
+    dtype, output_dtype = _layer_dtypes(profile)
+    model = keras.Sequential([
+        layers.Reshape((28, 28, 1), input_shape=(28, 28), dtype=dtype),
+        layers.Conv2D(32, kernel_size=(3, 3), activation='relu', dtype=dtype),
+        layers.MaxPooling2D(pool_size=(2, 2), dtype=dtype),
+        layers.Flatten(dtype=dtype),
+        layers.Dense(64, activation='relu', dtype=dtype),
+        layers.Dense(10, activation='softmax', dtype=output_dtype)
+    ])
     
-    return model
+    return _compile(model, profile)
 
-def create_deeper_cnn():
+def create_deeper_cnn(profile=None):
     """Bigger CNN with two conv layers and dropout."""
+    dtype, output_dtype = _layer_dtypes(profile)
     model = keras.Sequential([
-        layers.Reshape((28, 28, 1), input_shape=(28, 28)),
-        layers.Conv2D(32, kernel_size=(3, 3), activation='relu'),
-        layers.Conv2D(64, kernel_size=(3, 3), activation='relu'),
-        layers.MaxPooling2D(pool_size=(2, 2)),
-        layers.Dropout(0.25),
-        layers.Flatten(),
-        layers.Dense(128, activation='relu'),
-        layers.Dropout(0.5),
-        layers.Dense(10, activation='softmax')
+        layers.Reshape((28, 28, 1), input_shape=(28, 28), dtype=dtype),
+        layers.Conv2D(32, kernel_size=(3, 3), activation='relu', dtype=dtype),
+        layers.Conv2D(64, kernel_size=(3, 3), activation='relu', dtype=dtype),
+        layers.MaxPooling2D(pool_size=(2, 2), dtype=dtype),
+        layers.Dropout(0.25, dtype=dtype),
+        layers.Flatten(dtype=dtype),
+        layers.Dense(128, activation='relu', dtype=dtype),
+        layers.Dropout(0.5, dtype=dtype),
+        layers.Dense(10, activation='softmax', dtype=output_dtype)
     ])
     
-    model.compile(
-        optimizer='adam',
-        loss='sparse_categorical_crossentropy',
-        metrics=['accuracy']
-    )
-    
-    return model
+    return _compile(model, profile)
+
+def as_float32(model):
+    """
+    A float32 copy of a model trained with mixed precision (or the model
+    itself if it's float32 already).
 
-def save_model(model, filepath):
-    """Save trained model to disk."""
+    The weights are float32 either way, so they copy straight across.
+    The copy is what gets saved: every inference backend (and the TFLite
+    converter) expects float32.
+    """
+    config = model.get_config()
+    if all(layer['config'].get('dtype') in (None, 'float32') for layer in config['layers']):
+        return model
+    for layer in config['layers']:
+        layer['config']['dtype'] = 'float32'
+    copy = keras.Sequential.from_config(config)
+    copy.set_weights(model.get_weights())
+    return copy
+
+@timed('model.save')
+def save_model(model, filepath, tflite=None, calibration_data=None):
+    """
+    Save trained model to disk (as float32, see as_float32).
+
+    If `tflite` is 'float' or 'int8', a .tflite copy is written next to the
+    .keras file as well (int8 needs `calibration_data`, e.g. x_train).
+    Returns the .tflite path, or None if no export was asked for.
+    """
     # Create artifacts directory if it doesn't exist
     os.makedirs('artifacts', exist_ok=True)
     
+    model = as_float32(model)
     model.save(filepath)
     print(f"Model saved to {filepath}")
 
+    if tflite:
+        tflite_path = os.path.splitext(filepath)[0] + '.tflite'
+        export_tflite(model, tflite_path, tflite, calibration_data)
+        return tflite_path
+    return None
+
+@timed('model.load')
 def load_model(filepath):
     """Load model from disk."""
     model = keras.models.load_model(filepath)
     print(f"Model loaded from {filepath}")
     return model
 
+
+# ============================================================================
+# TENSORFLOW LITE EXPORT
+# ============================================================================
+
+def export_tflite(model, filepath, mode='float', calibration_data=None):
+    """
+    Convert a Keras model to a .tflite file.
+
+    mode='float' keeps float32 weights. mode='int8' does full integer
+    post-training quantisation, using a slice of `calibration_data` to work
+    out the activation ranges. Input and output stay float32 either way so
+    callers don't need to know which one they've got.
+    """
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+
+    if mode == 'int8':
+        if calibration_data is None:
+            raise ValueError("int8 quantisation needs calibration data (e.g. x_train)")
+
+        def representative_dataset():
+            for image in calibration_data[:TFLITE_CALIBRATION_SAMPLES]:
+                yield [np.asarray(image, dtype='float32').reshape(1, 28, 28)]
+
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    elif mode != 'float':
+        raise ValueError(f"Unknown TFLite mode '{mode}' (expected 'float' or 'int8')")
+
+    with open(filepath, 'wb') as f:
+        f.write(converter.convert())
+    print(f"TFLite ({mode}) model saved to {filepath}")
+
+
+class TFLiteModel:
+    """
+    Callable wrapper around a TFLite interpreter.
+
+    Takes a float32 batch of shape (N, 28, 28) and returns (N, 10)
+    probabilities, like calling the Keras model. An interpreter can only
+    run one thing at a time, so calls are serialised with a lock.
+    """
+
+    def __init__(self, filepath):
+        try:
+            # The standalone runtime is much smaller than full TensorFlow
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            Interpreter = tf.lite.Interpreter
+
+        self.filepath = filepath
+        self.interpreter = Interpreter(model_path=filepath)
+        self.interpreter.allocate_tensors()
+        self.input_index = self.interpreter.get_input_details()[0]['index']
+        self.output_index = self.interpreter.get_output_details()[0]['index']
+        self.batch_size = 1
+        self._lock = threading.Lock()
+
+    def __call__(self, images):
+        images = np.asarray(images, dtype='float32')
+        with self._lock:
+            # Resizing means reallocating, so only do it when the batch size changes
+            if len(images) != self.batch_size:
+                self.interpreter.resize_tensor_input(self.input_index, list(images.shape))
+                self.interpreter.allocate_tensors()
+                self.batch_size = len(images)
+            self.interpreter.set_tensor(self.input_index, images)
+            self.interpreter.invoke()
+            return self.interpreter.get_tensor(self.output_index).copy()
+
+
+@timed('model.load_tflite')
+def load_tflite(filepath):
+    """Load a .tflite model as a callable TFLiteModel."""
+    model = TFLiteModel(filepath)
+    print(f"TFLite model loaded from {filepath}")
+    return model
+
+
+def tflite_accuracy_drift(model, tflite_path, x_test, y_test, batch_size=500):
+    """
+    Compare a Keras model with its TFLite export on the test set.
+
+    The Keras side is the float32 copy (as_float32) - what was saved and
+    converted - so a mixed precision model's own bf16/fp16 rounding
+    doesn't count as TFLite drift.
+
+    Returns:
+        tuple: (keras accuracy, tflite accuracy), both 0-1. Drift is the
+        difference between them.
+    """
+    model = as_float32(model)
+    tflite_model = load_tflite(tflite_path)
+    keras_correct = 0
+    tflite_correct = 0
+
+    for start in range(0, len(x_test), batch_size):
+        images = np.asarray(x_test[start:start + batch_size], dtype='float32')
+        labels = y_test[start:start + batch_size]
+        keras_correct += int((model(images, training=False).numpy().argmax(axis=1) == labels).sum())
+        tflite_correct += int((tflite_model(images).argmax(axis=1) == labels).sum())
+
+    return keras_correct / len(x_test), tflite_correct / len(x_test)
+
 def preprocess_image(image):
     """Get image ready for the model — normalise and add batch dim."""
     # Normalise to 0-1 range
@@ -100,12 +262,27 @@ def preprocess_image(image):
     return image
 
 def predict_digit(model, image):
-    """Run prediction on an image, return (digit, confidence)."""
+    """
+    Run prediction on an image, return (digit, confidence).
+
+    `model` can be a loaded Keras model or the filename of a saved model in
+    artifacts/ - filenames go through the shared inference engine so the
+    model is only loaded from disk once. Either way the prediction runs
+    through a compiled serving function rather than model.predict().
+    """
+    # Imported here because inference.py imports this module
+    from inference import engine, run_bucketed
+
+    if isinstance(model, str):
+        serve = engine.get_serving_fn(os.path.basename(model))
+    else:
+        serve = engine.serving_fn_for_model(model)
+
     # Preprocess image
     processed = preprocess_image(image)
     
     # Get predictions (array of 10 probabilities)
-    prediction = model.predict(processed, verbose=0)
+    prediction = run_bucketed(serve, processed)[0]
     
     # Find digit with highest probability
     digit = int(prediction.argmax())
@@ -0,0 +1,186 @@
+"""
+Pure-NumPy forward pass for the built-in architectures.
+
+Reads the weights straight out of a saved .keras file (it's a zip with
+config.json and model.weights.h5) and runs the Dense/Conv2D/MaxPool
+stacks from models.py with plain NumPy. Nothing here imports TensorFlow,
+so a prediction-only worker can start in well under a second and use a
+fraction of the memory.
+
+Only the layer types the three architectures use are supported:
+InputLayer, Reshape, Flatten, Dense, Conv2D (valid padding, stride 1),
+MaxPooling2D (valid padding) and Dropout (ignored at inference).
+"""
+
+import io
+import json
+import re
+import zipfile
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+# Images per im2col pass - keeps the unfolded conv input to a few hundred MB at most
+NUMPY_CHUNK_SIZE = 64
+
+# Largest difference from the Keras model's output allowed (benchmarks.py numpy
+# and tests/test_numpy_inference.py check it) - float32 rounding is well under this
+NUMPY_ATOL = 1e-5
+
+
+# ============================================================================
+# ACTIVATIONS
+# ============================================================================
+
+def _relu(x):
+    return np.maximum(x, 0, out=x)
+
+
+def _softmax(x):
+    x = x - x.max(axis=-1, keepdims=True)
+    np.exp(x, out=x)
+    x /= x.sum(axis=-1, keepdims=True)
+    return x
+
+
+ACTIVATIONS = {
+    'relu': _relu,
+    'softmax': _softmax,
+    'linear': lambda x: x,
+    None: lambda x: x,
+}
+
+
+# ============================================================================
+# LAYERS
+# ============================================================================
+
+def _dense(x, kernel, bias, activation):
+    """Fully-connected layer: one matmul."""
+    return ACTIVATIONS[activation](x @ kernel + bias)
+
+
+def _conv2d(x, kernel, bias, activation):
+    """
+    Valid, stride-1 2D convolution (channels last) using im2col.
+
+    sliding_window_view gives every kh×kw patch without copying; the one
+    copy happens when the patches are laid out as rows of a matrix, which
+    then goes through a single matmul with the flattened kernel.
+    """
+    kh, kw, in_channels, filters = kernel.shape
+    n, height, width, _ = x.shape
+    out_h, out_w = height - kh + 1, width - kw + 1
+
+    # (n, out_h, out_w, channels, kh, kw) -> (n, out_h, out_w, kh, kw, channels)
+    patches = sliding_window_view(x, (kh, kw), axis=(1, 2)).transpose(0, 1, 2, 4, 5, 3)
+    columns = patches.reshape(n * out_h * out_w, kh * kw * in_channels)
+
+    out = columns @ kernel.reshape(kh * kw * in_channels, filters) + bias
+    return ACTIVATIONS[activation](out.reshape(n, out_h, out_w, filters))
+
+
+def _max_pool(x, pool_h, pool_w):
+    """Non-overlapping max pooling (pool size == stride, valid padding)."""
+    n, height, width, channels = x.shape
+    out_h, out_w = height // pool_h, width // pool_w
+    x = x[:, :out_h * pool_h, :out_w * pool_w, :]
+    return x.reshape(n, out_h, pool_h, out_w, pool_w, channels).max(axis=(2, 4))
+
+
+# ============================================================================
+# LOADING FROM .keras FILES
+# ============================================================================
+
+def _weights_key(class_name, seen):
+    """
+    Name Keras gives a layer's group inside model.weights.h5.
+
+    Layers are stored under their snake_case class name, numbered in order
+    when there's more than one (dense, dense_1, dense_2, ...).
+    """
+    # Conv2D -> conv2d, MaxPooling2D -> max_pooling2d
+    base = re.sub(r'(?<!^)(?=[A-Z][a-z])', '_', class_name).lower()
+    count = seen.get(base, 0)
+    seen[base] = count + 1
+    return base if count == 0 else f'{base}_{count}'
+
+
+class NumpyModel:
+    """
+    A built-in architecture rebuilt as a list of NumPy operations.
+
+    Call it with a float32 batch of shape (N, 28, 28) to get (N, 10)
+    probabilities, the same as calling the Keras model.
+    """
+
+    def __init__(self, ops, weights_nbytes=0, filepath=None):
+        self.ops = ops
+        self.weights_nbytes = weights_nbytes   # for the inference engine's memory budget
+        self.filepath = filepath
+
+    def __call__(self, images):
+        images = np.asarray(images, dtype='float32')
+        outputs = [self._forward(images[start:start + NUMPY_CHUNK_SIZE])
+                   for start in range(0, len(images), NUMPY_CHUNK_SIZE)]
+        return np.concatenate(outputs) if outputs else np.empty((0, 10), dtype='float32')
+
+    def _forward(self, x):
+        for op in self.ops:
+            x = op(x)
+        return x
+
+
+def load_numpy_model(filepath):
+    """Load a saved .keras model as a NumpyModel (needs h5py, not TensorFlow)."""
+    import h5py
+
+    with zipfile.ZipFile(filepath) as archive:
+        config = json.loads(archive.read('config.json'))
+        weights_file = h5py.File(io.BytesIO(archive.read('model.weights.h5')), 'r')
+
+    if config.get('class_name') != 'Sequential':
+        raise ValueError(f"Only Sequential models are supported, got {config.get('class_name')}")
+
+    ops = []
+    nbytes = 0
+    seen = {}
+    with weights_file:
+        for layer in config['config']['layers']:
+            class_name = layer['class_name']
+            layer_config = layer['config']
+            if class_name == 'InputLayer':
+                continue
+
+            key = _weights_key(class_name, seen)
+            group = weights_file['layers'][key]['vars'] if key in weights_file['layers'] else {}
+            weights = [np.asarray(group[str(i)], dtype='float32') for i in range(len(group))]
+            nbytes += sum(w.nbytes for w in weights)
+
+            if class_name == 'Reshape':
+                target = tuple(layer_config['target_shape'])
+                ops.append(lambda x, target=target: x.reshape((len(x),) + target))
+            elif class_name == 'Flatten':
+                ops.append(lambda x: x.reshape(len(x), -1))
+            elif class_name == 'Dense':
+                kernel, bias = weights
+                ops.append(lambda x, k=kernel, b=bias, a=layer_config['activation']: _dense(x, k, b, a))
+            elif class_name == 'Conv2D':
+                if tuple(layer_config['strides']) != (1, 1) or layer_config['padding'] != 'valid':
+                    raise NotImplementedError("Only valid, stride-1 convolutions are supported")
+                kernel, bias = weights
+                ops.append(lambda x, k=kernel, b=bias, a=layer_config['activation']: _conv2d(x, k, b, a))
+            elif class_name == 'MaxPooling2D':
+                pool = tuple(layer_config['pool_size'])
+                if tuple(layer_config['strides']) != pool or layer_config['padding'] != 'valid':
+                    raise NotImplementedError("Only non-overlapping valid max pooling is supported")
+                ops.append(lambda x, p=pool: _max_pool(x, *p))
+            elif class_name == 'Dropout':
+                continue   # no-op at inference time
+            else:
+                raise NotImplementedError(f"Layer type {class_name} isn't supported by the NumPy engine")
+
+    model = NumpyModel(ops, nbytes, filepath)
+    print(f"NumPy model loaded from {filepath}")
+    return model
@@ -0,0 +1,121 @@
+"""
+Performance profiles for building and training models.
+
+A profile is a named set of CPU settings:
+
+- intra_op_threads / inter_op_threads: TensorFlow's thread pools. None
+  means "this job's share of the cores" (see jobs.THREADS_PER_JOB), so
+  jobs running side by side don't oversubscribe the machine.
+- jit_compile: compile the train step with XLA, which fuses ops. Off
+  everywhere for now: on CPU, XLA's convolutions were several times
+  slower than TensorFlow's own (oneDNN) kernels, and the MLP gained
+  nothing (see `python benchmarks.py profiles`).
+- mixed_precision: compute in bfloat16 (weights stay float32), only if
+  the CPU has native bfloat16 support. The output layer stays float32
+  so the softmax is stable.
+
+Nothing here imports TensorFlow until apply_threading() is called.
+"""
+
+import os
+
+
+CPU_COUNT = os.cpu_count() or 1
+
+PERFORMANCE_PROFILES = {
+    # Most samples/sec for one job that has the machine to itself
+    'throughput': {
+        'intra_op_threads': CPU_COUNT,
+        'inter_op_threads': 2,
+        'jit_compile': False,
+        'mixed_precision': True,
+    },
+    # Quickest turnaround for short runs - plain float32
+    'latency': {
+        'intra_op_threads': CPU_COUNT,
+        'inter_op_threads': 1,
+        'jit_compile': False,
+        'mixed_precision': False,
+    },
+    # Plays nicely with other jobs - just this job's share of the cores
+    'shared-host': {
+        'intra_op_threads': None,
+        'inter_op_threads': 1,
+        'jit_compile': False,
+        'mixed_precision': False,
+    },
+}
+
+# Used when nothing else is asked for
+DEFAULT_PROFILE = 'shared-host'
+
+
+def get_profile(name):
+    """The settings for a profile name (None means DEFAULT_PROFILE)."""
+    name = name or DEFAULT_PROFILE
+    if name not in PERFORMANCE_PROFILES:
+        raise ValueError(f"Unknown performance profile '{name}' (choose from {', '.join(PERFORMANCE_PROFILES)})")
+    return PERFORMANCE_PROFILES[name]
+
+
+def bfloat16_supported():
+    """True if the CPU can do bfloat16 maths natively (AVX512-BF16 or AMX)."""
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('flags'):
+                    flags = line.split()
+                    return 'avx512_bf16' in flags or 'amx_bf16' in flags
+    except OSError:
+        pass
+    return False
+
+
+def uses_mixed_precision(name):
+    """Whether a profile will actually train in bfloat16 on this machine."""
+    return get_profile(name)['mixed_precision'] and bfloat16_supported()
+
+
+def thread_counts(name, default_threads=None):
+    """
+    (intra-op, inter-op) threads for a profile; default_threads fills in a None.
+
+    Without default_threads, a job worker uses the share the scheduler gave
+    it in TF_NUM_INTRAOP_THREADS, and anything else uses every core.
+    """
+    profile = get_profile(name)
+    if default_threads is None:
+        default_threads = int(os.environ.get('TF_NUM_INTRAOP_THREADS', CPU_COUNT))
+    intra = profile['intra_op_threads'] or default_threads
+    return intra, min(profile['inter_op_threads'], intra)
+
+
+def thread_env(name, default_threads=None):
+    """Environment variables that set the thread pools before TensorFlow starts."""
+    intra, inter = thread_counts(name, default_threads)
+    return {
+        'OMP_NUM_THREADS': str(intra),
+        'TF_NUM_INTRAOP_THREADS': str(intra),
+        'TF_NUM_INTEROP_THREADS': str(inter),
+    }
+
+
+def apply_threading(name, default_threads=None):
+    """
+    Set TensorFlow's thread pools for a profile.
+
+    Only works before TensorFlow has run anything - after that the pools
+    are fixed for the life of the process, so this just warns.
+    """
+    import tensorflow as tf
+
+    intra, inter = thread_counts(name, default_threads)
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(intra)
+        tf.config.threading.set_inter_op_parallelism_threads(inter)
+    except RuntimeError:
+        current = (tf.config.threading.get_intra_op_parallelism_threads(),
+                   tf.config.threading.get_inter_op_parallelism_threads())
+        if current != (intra, inter):
+            print(f"Warning: TensorFlow already started - can't switch to {intra}/{inter} threads "
+                  f"for the '{name}' profile")
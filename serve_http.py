@@ -0,0 +1,277 @@
+"""
+Headless HTTP prediction API.
+
+Every Gradio event is registered with api_name=False, so the only way to
+get predictions used to be the browser UI. This is a small HTTP service
+for scripts and other programs instead. It doesn't build the Gradio
+Blocks at all - `python serve_http.py [port] [--backend numpy]` runs it
+on its own - and app_ui.py also starts it next to the UI.
+
+--backend picks the inference backend ('keras', 'tflite' or 'numpy', or
+per architecture like 'MLP=numpy,Deeper CNN=tflite'). The
+MNIST_INFERENCE_BACKEND environment variable does the same, for the app too.
+
+It uses the same inference engine, best-model hot-swapping, micro-batcher
+and prediction cache as the Predict tab. The server speaks HTTP/1.1, so
+a client can keep one connection open for many requests, and each
+connection gets its own thread.
+
+Endpoints:
+    GET  /health    status and the best models being served
+    GET  /metrics   stage timings, counters and cache stats in Prometheus
+                    text format (see instrumentation.py)
+    POST /predict   one or more digits, as one of these content types:
+        application/octet-stream   raw uint8 pixels, 784 bytes per 28×28
+                                   image (N images = N×784 bytes)
+        image/png (or image/*)     one image file of any size, preprocessed
+                                   like an upload (?invert=1 for black on white)
+        application/x-npy          a .npy array of shape (28, 28) or
+                                   (N, 28, 28), uint8 0-255 or float 0-1
+
+/predict answers with JSON:
+    {"count": N,
+     "models": {"MLP": {"model": "model_mlp_run1.keras",
+                        "digits": [7, ...],
+                        "probabilities": [[0.0, ..., 0.99, ...], ...]}, ...},
+     "errors": {"Deeper CNN": "TimeoutError: no result within 5s"}}
+"""
+
+import argparse
+import io
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+from PIL import Image
+
+from bulk import to_uint8
+from inference import engine, live_models, prediction_cache, MODEL_TIMEOUT_S
+from init_db import create_database
+from instrumentation import registry, timed, count
+from utils import preprocess
+
+
+HTTP_HOST = '127.0.0.1'
+HTTP_PORT = 8000
+
+# Biggest request body accepted (64 MB is about 85,000 raw 28×28 digits)
+MAX_BODY_BYTES = 64 * 1024 * 1024
+
+IMAGE_BYTES = 28 * 28
+
+
+class BadRequest(Exception):
+    """A request the client needs to fix (sent back as a 4xx with the message)."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+# ============================================================================
+# REQUEST DECODING
+# ============================================================================
+
+@timed('http.decode')
+def decode_images(body, content_type, invert=False):
+    """
+    Turn a request body into a float32 batch of shape (N, 28, 28), values 0-1.
+
+    Raises BadRequest if the body doesn't match its content type.
+    """
+    content_type = content_type.split(';')[0].strip().lower()
+
+    if content_type == 'application/octet-stream':
+        if not body or len(body) % IMAGE_BYTES:
+            raise BadRequest(f"Raw input must be a multiple of {IMAGE_BYTES} bytes (28×28 uint8 per image), "
+                             f"got {len(body)}")
+        images = np.frombuffer(body, dtype='uint8').reshape(-1, 28, 28)
+
+    elif content_type.startswith('image/'):
+        try:
+            images = Image.open(io.BytesIO(body))
+            images.load()
+        except Exception as e:
+            raise BadRequest(f"Couldn't read the image: {e}")
+
+    elif content_type in ('application/x-npy', 'application/npy'):
+        try:
+            array = np.load(io.BytesIO(body), allow_pickle=False)
+        except Exception as e:
+            raise BadRequest(f"Couldn't read the .npy file: {e}")
+        if array.ndim == 2:
+            array = array[np.newaxis]
+        if array.ndim != 3 or array.shape[1:] != (28, 28) or not len(array):
+            raise BadRequest(f"Expected an array of shape (28, 28) or (N, 28, 28), got {array.shape}")
+        if not (np.issubdtype(array.dtype, np.integer) or np.issubdtype(array.dtype, np.floating)):
+            raise BadRequest(f"Expected uint8 or float pixels, got {array.dtype}")
+        images = to_uint8(array)
+
+    else:
+        raise BadRequest(f"Unsupported content type '{content_type}' - use application/octet-stream, "
+                         f"image/png or application/x-npy", status=415)
+
+    pixels, _ = preprocess(images, invert=invert)
+    return pixels.reshape(-1, 28, 28)
+
+
+def predict_images(images):
+    """
+    {'count': N, 'models': {...}, 'errors': {...}} for a batch of digits.
+
+    One digit goes through the prediction cache and micro-batcher, so
+    requests from several connections share forward passes. A batch
+    is already big enough to go straight to the engine.
+    """
+    best_models = live_models.current()
+    if not best_models:
+        raise BadRequest("No trained models found - train some models first", status=503)
+
+    if len(images) == 1:
+        results = {
+            arch: result if isinstance(result, Exception) else result[np.newaxis]
+            for arch, result in prediction_cache.predict(best_models, images[0]).items()
+        }
+    else:
+        results = engine.predict_all(best_models, images, timeout=MODEL_TIMEOUT_S)
+
+    response = {'count': len(images), 'models': {}, 'errors': {}}
+    for arch, result in results.items():
+        if isinstance(result, Exception):
+            response['errors'][arch] = f"{type(result).__name__}: {result}"
+            continue
+        response['models'][arch] = {
+            'model': best_models[arch][0],
+            'digits': result.argmax(axis=1).tolist(),
+            'probabilities': result.astype('float64').round(6).tolist(),
+        }
+    return response
+
+
+# ============================================================================
+# HTTP SERVER
+# ============================================================================
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    """Handles one connection - HTTP/1.1, so it can carry many requests."""
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'MNISTPredict/1.0'
+    # The headers and body go out as separate writes - without this, Nagle's
+    # algorithm holds the body back for the client's delayed ACK (~40ms)
+    # on every request after the first on a kept-alive connection
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == '/metrics':
+            self._send(200, registry.prometheus_text().encode(), 'text/plain; version=0.0.4; charset=utf-8')
+            return
+        if path != '/health':
+            self._send_json(404, {'error': f"Unknown path '{self.path}'"})
+            return
+        best_models = live_models.current()
+        self._send_json(200, {
+            'status': 'ok',
+            'models': {arch: filename for arch, (filename, _) in best_models.items()},
+        })
+
+    @timed('http.predict')
+    def do_POST(self):
+        url = urlsplit(self.path)
+        try:
+            # Read the body first, so the connection is ready for the next request whatever happens
+            body = self._read_body()
+            if url.path != '/predict':
+                raise BadRequest(f"Unknown path '{url.path}'", status=404)
+            invert = parse_qs(url.query).get('invert', ['0'])[0].lower() in ('1', 'true', 'yes')
+            images = decode_images(body, self.headers.get('Content-Type', ''), invert)
+            self._send_json(200, predict_images(images))
+        except BadRequest as e:
+            self._send_json(e.status, {'error': str(e)})
+        except Exception as e:
+            self._send_json(500, {'error': f"Prediction failed: {e}"})
+
+    def _read_body(self):
+        """
+        The request body. Every error here leaves the body unread, so it
+        also closes the connection - the unread bytes would otherwise be
+        taken for the next request.
+        """
+        length = self.headers.get('Content-Length')
+        if length is None:
+            self.close_connection = True
+            raise BadRequest("Content-Length is required", status=411)
+        try:
+            length = int(length)
+        except ValueError:
+            self.close_connection = True
+            raise BadRequest(f"Bad Content-Length '{length}'")
+        if length < 0:
+            self.close_connection = True
+            raise BadRequest(f"Bad Content-Length '{length}'")
+        if length > MAX_BODY_BYTES:
+            self.close_connection = True
+            raise BadRequest(f"Request body too large (limit {MAX_BODY_BYTES // (1024 * 1024)} MB)", status=413)
+        return self.rfile.read(length)
+
+    def _send_json(self, status, payload):
+        self._send(status, json.dumps(payload).encode(), 'application/json')
+
+    def _send(self, status, body, content_type):
+        count(f'http.responses.{status}')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if self.close_connection:
+            # Tell the client not to send anything else on this connection
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # One line per request would drown out everything else in the log
+        pass
+
+
+def make_server(host=HTTP_HOST, port=HTTP_PORT):
+    """The HTTP server (not started yet). Port 0 picks a free port."""
+    server = ThreadingHTTPServer((host, port), PredictionHandler)
+    server.daemon_threads = True
+    return server
+
+
+def start_in_background(host=HTTP_HOST, port=HTTP_PORT):
+    """Start the server on a background thread and return it (server.shutdown() stops it)."""
+    server = make_server(host, port)
+    threading.Thread(target=server.serve_forever, name='http-api', daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve predictions over HTTP.")
+    parser.add_argument('port', type=int, nargs='?', default=HTTP_PORT)
+    parser.add_argument('--backend', help="'keras', 'tflite' or 'numpy', or per architecture "
+                                          "like 'MLP=numpy,Deeper CNN=tflite'")
+    args = parser.parse_args()
+    port = args.port
+    if args.backend:
+        try:
+            engine.configure_backends(args.backend)
+        except ValueError as e:
+            parser.error(str(e))
+
+    # Make sure the database has all the latest tables (safe to run every time)
+    create_database(verbose=False)
+    live_models.preload()
+
+    server = make_server(HTTP_HOST, port)
+    print(f"Serving predictions on http://{HTTP_HOST}:{server.server_port}/predict (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,203 @@
+"""
+Hyperparameter sweeps with successive-halving early stopping.
+
+A sweep trains every configuration in a search space (a full grid, or
+a random sample of it) as background jobs through the shared job
+scheduler, so trials run in parallel worker processes.
+
+Rather than letting every trial finish, trials are compared at "rungs"
+- epochs 1, eta, eta², ... - using the per-epoch validation accuracy
+already recorded in the metrics table. When a trial reaches a rung and
+at least `eta` trials have results there, it only carries on if it's in
+the top 1/eta of them; otherwise it's stopped. This is the asynchronous
+form of successive halving (ASHA): trials never wait for each other, and
+most of the compute goes to the promising configurations.
+
+Every trial, stopped or not, stays in the history database with the
+sweep's ID.
+"""
+
+import itertools
+import random
+import time
+import uuid
+
+from db import get_sweep_curves
+from jobs import scheduler, DONE, RUNNING, FINISHED_STATES
+
+
+# Keep the top 1/SWEEP_ETA of trials at each rung (2 = successive halving)
+SWEEP_ETA = 2
+
+# First rung, in epochs
+MIN_RUNG_EPOCHS = 1
+
+# How often the sweep checks on its trials
+SWEEP_POLL_SECONDS = 1.0
+
+
+# ============================================================================
+# SEARCH SPACE
+# ============================================================================
+
+def grid_space(architectures, batch_sizes, epochs):
+    """Every combination of architecture, batch size and epochs, as a list of configs."""
+    return [
+        {'architecture': architecture, 'batch_size': int(batch_size), 'epochs': int(n_epochs)}
+        for architecture, batch_size, n_epochs in itertools.product(architectures, batch_sizes, epochs)
+    ]
+
+
+def random_space(architectures, batch_sizes, epochs, n_trials, seed=None):
+    """n_trials configs sampled from the grid without repeats (all of it if n_trials is bigger)."""
+    grid = grid_space(architectures, batch_sizes, epochs)
+    return random.Random(seed).sample(grid, min(int(n_trials), len(grid)))
+
+
+def _check_rungs(eta, min_epochs=MIN_RUNG_EPOCHS):
+    """Raise ValueError for rung settings that would never finish."""
+    if eta < 2:
+        raise ValueError(f"eta must be at least 2 (keep the top half or less at each rung), got {eta}")
+    if min_epochs < 1:
+        raise ValueError(f"The first rung must be at least 1 epoch, got {min_epochs}")
+
+
+def rung_epochs(max_epochs, eta=SWEEP_ETA, min_epochs=MIN_RUNG_EPOCHS):
+    """
+    Epochs at which trials are compared, e.g. [1, 2, 4] for max_epochs=5 and eta=2.
+
+    Raises ValueError if eta is below 2 or min_epochs below 1 (the rungs
+    would never get past max_epochs).
+    """
+    _check_rungs(eta, min_epochs)
+    rungs = []
+    epoch = min_epochs
+    while epoch < max_epochs:
+        rungs.append(epoch)
+        epoch *= eta
+    return rungs
+
+
+# ============================================================================
+# RUNNING A SWEEP
+# ============================================================================
+
+class Trial:
+    """One configuration in a sweep and what's happened to it so far."""
+
+    def __init__(self, number, config):
+        self.number = number
+        self.config = config
+        self.job = None           # jobs.Job - kept even after the scheduler forgets it
+        self.status = 'queued'
+        self.curve = {}           # epoch -> val accuracy, from the metrics table
+        self.promoted = set()     # rungs this trial has passed
+        self.stopped_at = None    # rung it was stopped at
+
+    @property
+    def best_accuracy(self):
+        return max(self.curve.values()) if self.curve else None
+
+    def row(self):
+        """Row for the sweep results table."""
+        status = f'stopped at epoch {self.stopped_at}' if self.stopped_at else self.status
+        best = self.best_accuracy
+        return {
+            'Trial': self.number,
+            'Architecture': self.config['architecture'],
+            'Batch Size': self.config['batch_size'],
+            'Epochs': self.config['epochs'],
+            'Epochs Run': len(self.curve),
+            'Best Val Acc (%)': round(best * 100, 2) if best is not None else None,
+            'Status': status,
+        }
+
+
+def _apply_rungs(trials, eta):
+    """Stop running trials that fall outside the top 1/eta at a rung they've reached."""
+    max_epochs = max(trial.config['epochs'] for trial in trials)
+    for rung in rung_epochs(max_epochs, eta):
+        reached = [trial for trial in trials if rung in trial.curve]
+        if len(reached) < eta:
+            # Not enough results at this rung to judge anyone yet
+            continue
+
+        keep = max(1, len(reached) // eta)
+        cutoff = sorted((trial.curve[rung] for trial in reached), reverse=True)[keep - 1]
+        for trial in reached:
+            if trial.status != RUNNING or rung in trial.promoted or trial.stopped_at:
+                continue
+            if trial.config['epochs'] <= rung:
+                continue   # finishing at this rung anyway
+            if trial.curve[rung] >= cutoff:
+                trial.promoted.add(rung)
+            elif scheduler.cancel(trial.job.id):
+                trial.stopped_at = rung
+
+
+def summarise(sweep_id, trials, eta):
+    """Status text for a sweep: progress, compute saved and the best trial so far."""
+    finished = sum(1 for trial in trials if trial.status in FINISHED_STATES)
+    stopped = sum(1 for trial in trials if trial.stopped_at)
+    epochs_run = sum(len(trial.curve) for trial in trials)
+    epochs_full = sum(trial.config['epochs'] for trial in trials)
+
+    lines = [
+        f"Sweep {sweep_id}: {len(trials)} trials, keeping the top 1/{eta} at epochs "
+        f"{', '.join(map(str, rung_epochs(max(t.config['epochs'] for t in trials), eta))) or '-'}",
+        f"Finished {finished}/{len(trials)} ({stopped} stopped early) - "
+        f"{epochs_run} of {epochs_full} epochs trained",
+    ]
+
+    completed = [trial for trial in trials if trial.status == DONE and trial.curve]
+    if completed:
+        best = max(completed, key=lambda trial: trial.curve[max(trial.curve)])
+        lines.append(
+            f"Best so far: trial {best.number} ({best.config['architecture']}, batch size "
+            f"{best.config['batch_size']}, {best.config['epochs']} epochs) - "
+            f"{best.curve[max(best.curve)] * 100:.2f}% val accuracy"
+        )
+    return "\n".join(lines)
+
+
+def run_sweep(configs, eta=SWEEP_ETA, input_pipeline="tf.data", poll_seconds=SWEEP_POLL_SECONDS):
+    """
+    Run a sweep over a list of configs (see grid_space / random_space).
+
+    A generator (like training.train_model) that yields (status text,
+    list of Trial) every time it checks on the trials, until all have
+    finished. Closing it early cancels the trials still queued or running.
+    """
+    if not configs:
+        raise ValueError("The search space is empty")
+    # Before any trials are submitted
+    _check_rungs(eta)
+
+    sweep_id = uuid.uuid4().hex[:8]
+    trials = [Trial(number, config) for number, config in enumerate(configs, start=1)]
+    for trial in trials:
+        job_id = scheduler.submit(
+            trial.config['architecture'], trial.config['epochs'], trial.config['batch_size'],
+            input_pipeline=input_pipeline, sweep_id=sweep_id, sweep_trial=trial.number
+        )
+        trial.job = scheduler.get(job_id)
+
+    try:
+        while True:
+            # Statuses first, so a finished trial's curve is always complete
+            for trial in trials:
+                trial.status = trial.job.status
+            curves = get_sweep_curves(sweep_id)
+            for trial in trials:
+                trial.curve = curves.get(trial.number, {})
+
+            _apply_rungs(trials, eta)
+            yield summarise(sweep_id, trials, eta), trials
+
+            if all(trial.status in FINISHED_STATES for trial in trials):
+                return
+            time.sleep(poll_seconds)
+    finally:
+        for trial in trials:
+            if trial.status not in FINISHED_STATES:
+                scheduler.cancel(trial.job.id)
@@ -0,0 +1,69 @@
+"""Tests for the inference engine's task running (no trained models needed)."""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import inference
+from inference import InferenceEngine
+
+
+class SlowSubmitPool(ThreadPoolExecutor):
+    """A pool that dawdles before each submit, to widen any race around it."""
+
+    def submit(self, fn, *args, **kwargs):
+        time.sleep(0.002)
+        return super().submit(fn, *args, **kwargs)
+
+
+def test_timeout_while_another_thread_submits(monkeypatch):
+    """A task timing out (and the pool being replaced) mustn't break another request's submit."""
+    monkeypatch.setattr(inference, 'ThreadPoolExecutor', SlowSubmitPool)
+    engine = InferenceEngine()
+    errors = []
+    stop = threading.Event()
+
+    def time_out_repeatedly():
+        i = 0
+        while not stop.is_set():
+            # A new key each time, so it isn't refused as still stuck
+            results = engine._run_tasks({('Slow',): (('slow', i), lambda: time.sleep(0.02) or [None])},
+                                        timeout=0.001)
+            if not isinstance(results['Slow'], TimeoutError):
+                errors.append(results['Slow'])
+            i += 1
+
+    thread = threading.Thread(target=time_out_repeatedly)
+    thread.start()
+    try:
+        for _ in range(200):
+            try:
+                results = engine._run_tasks({('Fast',): (('fast',), lambda: [1])}, timeout=5)
+            except Exception as e:
+                errors.append(e)
+                continue
+            if results['Fast'] != 1:
+                errors.append(results['Fast'])
+    finally:
+        stop.set()
+        thread.join()
+    assert not errors, errors[:3]
+
+
+def test_stuck_task_is_refused_until_it_finishes():
+    """While a timed-out task is still running, the same model fails straight away."""
+    engine = InferenceEngine()
+    release = threading.Event()
+    task = {('Hung',): (('hung',), lambda: release.wait() and [1])}
+
+    first = engine._run_tasks(task, timeout=0.01)
+    assert isinstance(first['Hung'], TimeoutError)
+
+    start = time.monotonic()
+    second = engine._run_tasks(task, timeout=5)
+    assert isinstance(second['Hung'], TimeoutError)
+    assert time.monotonic() - start < 1
+
+    release.set()
+    engine._stuck[('hung',)].result(timeout=5)
+    assert engine._run_tasks(task, timeout=5)['Hung'] == 1
@@ -0,0 +1,38 @@
+"""The NumPy engine against Keras on small random-weight models, one per supported layer type."""
+
+import numpy as np
+import pytest
+
+from numpy_inference import load_numpy_model, NUMPY_ATOL
+
+keras = pytest.importorskip('tensorflow').keras
+layers = keras.layers
+
+
+# Each stack exercises one layer type (plus whatever it needs around it)
+STACKS = {
+    'Reshape': lambda: [layers.Reshape((28, 28, 1))],
+    'Flatten': lambda: [layers.Flatten()],
+    'Dense': lambda: [layers.Flatten(), layers.Dense(16, activation='relu'), layers.Dense(10, activation='softmax')],
+    'Conv2D': lambda: [layers.Reshape((28, 28, 1)), layers.Conv2D(4, (3, 3), activation='relu'),
+                       layers.Conv2D(3, (5, 5))],
+    'MaxPooling2D': lambda: [layers.Reshape((28, 28, 1)), layers.Conv2D(4, (3, 3)), layers.MaxPooling2D((2, 2))],
+    'Dropout': lambda: [layers.Flatten(), layers.Dropout(0.5), layers.Dense(10, activation='softmax')],
+}
+
+
+@pytest.mark.parametrize('layer_type', STACKS)
+def test_matches_keras(layer_type, tmp_path):
+    model = keras.Sequential([keras.Input(shape=(28, 28))] + STACKS[layer_type]())
+    # Fixed random weights, biases included (Keras starts those at zero)
+    rng = np.random.default_rng(0)
+    model.set_weights([rng.normal(0, 0.3, w.shape).astype('float32') for w in model.get_weights()])
+    path = str(tmp_path / f'{layer_type}.keras')
+    model.save(path)
+
+    images = rng.random((5, 28, 28), dtype='float32')
+    expected = model(images, training=False).numpy()
+    actual = load_numpy_model(path)(images)
+
+    assert actual.shape == expected.shape
+    np.testing.assert_allclose(actual, expected, rtol=0, atol=NUMPY_ATOL)
@@ -0,0 +1,411 @@
+"""
+Training: the core training run, and the helpers that stream its progress.
+
+A whole training run is one model.fit() call on a background thread, so
+Keras builds its train/eval functions once per run rather than once per
+epoch. ProgressCallback reports back through a queue.Queue: one event at
+the end of each epoch, plus batch events (at most a couple a second)
+with live accuracy, samples/sec and ETA. The Train tab's generator
+drains the queue and yields each update to the UI.
+
+train_model() is the whole run - build, fit, save, record in the
+database. It runs inside a job worker process (see jobs.py), so nothing
+here imports app_ui.
+"""
+
+import queue
+import threading
+import time
+
+import numpy as np
+import tensorflow as tf
+
+import dataset
+from db import register_run, save_tflite_results, finish_run, delete_run, update_best_model, \
+    transaction, MetricsBuffer
+from instrumentation import observe, timed
+from lazy import lazy_value
+from profiles import DEFAULT_PROFILE, apply_threading, get_profile, uses_mixed_precision
+from models import create_mlp, create_small_cnn, create_deeper_cnn, save_model, tflite_accuracy_drift
+
+
+# Minimum seconds between batch progress events
+PROGRESS_INTERVAL = 0.5
+
+
+# ============================================================================
+# PROGRESS CALLBACK
+# ============================================================================
+
+class ProgressCallback(tf.keras.callbacks.Callback):
+    """
+    Puts progress events on a queue while fit() runs.
+
+    Events are dicts with a 'type' of 'batch' or 'epoch'. Setting
+    stop_event stops training after the current batch.
+    """
+
+    def __init__(self, events, batch_size, stop_event=None, interval=PROGRESS_INTERVAL):
+        super().__init__()
+        self.events = events
+        self.batch_size = batch_size
+        self.stop_event = stop_event
+        self.interval = interval
+        # Batch logs stay as tensors, and are only read when an event is sent,
+        # so Keras doesn't have to sync with the device after every batch
+        self._supports_tf_logs = True
+
+    def on_train_begin(self, logs=None):
+        self.epochs = self.params.get('epochs') or 1
+        self.steps = self.params.get('steps')
+        self.train_start = time.time()
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch = epoch
+        self.epoch_start = self.last_report = time.time()
+
+    def on_train_batch_end(self, batch, logs=None):
+        if self.stop_event is not None and self.stop_event.is_set():
+            self.model.stop_training = True
+
+        now = time.time()
+        if now - self.last_report < self.interval:
+            return
+        self.last_report = now
+
+        step = batch + 1
+        steps_per_sec = step / max(now - self.epoch_start, 1e-9)
+        eta = None
+        if self.steps:
+            remaining_steps = (self.epochs - self.epoch) * self.steps - step
+            eta = remaining_steps / steps_per_sec
+
+        logs = logs or {}
+        self.events.put({
+            'type': 'batch',
+            'epoch': self.epoch + 1,
+            'epochs': self.epochs,
+            'step': step,
+            'steps': self.steps,
+            'samples_per_sec': steps_per_sec * self.batch_size,
+            'eta': eta,
+            'accuracy': float(logs['accuracy']) if 'accuracy' in logs else None,
+        })
+
+    def on_epoch_end(self, epoch, logs=None):
+        now = time.time()
+        epoch_time = now - self.epoch_start
+        epochs_left = self.epochs - epoch - 1
+        self.events.put({
+            'type': 'epoch',
+            'epoch': epoch + 1,
+            'epochs': self.epochs,
+            'time': epoch_time,
+            'eta': epochs_left * (now - self.train_start) / (epoch + 1),
+            'logs': {name: float(value) for name, value in (logs or {}).items()},
+        })
+
+
+# ============================================================================
+# VALIDATION SCHEDULE
+# ============================================================================
+
+def validation_schedule(epochs, val_every=1, val_subset=None):
+    """
+    Which epochs get validated, and on what: {epoch: 'full' or 'subset'}.
+
+    Every val_every-th epoch is validated - on the stratified subset if
+    val_subset is set, otherwise the full test set. The last epoch always
+    gets a full evaluation, so the recorded result is never an estimate.
+    """
+    if int(val_every) < 1:
+        raise ValueError("val_every must be at least 1")
+    kind = 'subset' if val_subset else 'full'
+    schedule = {epoch: kind for epoch in range(int(val_every), epochs + 1, int(val_every))}
+    schedule[epochs] = 'full'
+    return schedule
+
+
+class ValidationCallback(tf.keras.callbacks.Callback):
+    """
+    Validates at the end of the epochs in a schedule, instead of fit()'s
+    full pass every epoch.
+
+    Results go into the epoch logs as val_loss/val_accuracy, just like
+    fit's own validation, so callbacks after this one see them. How long
+    each validation took is kept in `seconds` ({epoch: seconds}).
+    """
+
+    def __init__(self, schedule, full_data, subset_data=None, batch_size=None):
+        super().__init__()
+        self.schedule = schedule
+        self.data = {'full': full_data, 'subset': subset_data}
+        self.batch_size = batch_size
+        self.seconds = {}
+        # Share fit()'s logs dict with the other callbacks rather than a numpy copy
+        self._supports_tf_logs = True
+
+    def on_epoch_end(self, epoch, logs=None):
+        kind = self.schedule.get(epoch + 1)
+        if kind is None or logs is None or self.model.stop_training:
+            return
+        data = self.data[kind]
+        start = time.perf_counter()
+        if isinstance(data, tuple):
+            results = self.model.evaluate(*data, batch_size=self.batch_size, verbose=0, return_dict=True)
+        else:
+            results = self.model.evaluate(data, verbose=0, return_dict=True)
+        self.seconds[epoch + 1] = time.perf_counter() - start
+        observe(f'train.validation.{kind}', self.seconds[epoch + 1])
+        logs['val_loss'] = results['loss']
+        logs['val_accuracy'] = results['accuracy']
+
+
+# ============================================================================
+# RUNNING FIT IN THE BACKGROUND
+# ============================================================================
+
+def start_fit(model, events, fit_kwargs, batch_size, stop_event=None, callbacks=()):
+    """
+    Run model.fit(**fit_kwargs) on a background thread.
+
+    Progress events go on the events queue, followed by exactly one of
+    {'type': 'done', 'history': ...} or {'type': 'error', 'error': ...}.
+    batch_size is only used for samples/sec - it also needs to be in
+    fit_kwargs when training on arrays. Any extra callbacks run before
+    the progress callback.
+
+    Returns:
+        threading.Thread: the (already started) training thread
+    """
+    callback = ProgressCallback(events, batch_size, stop_event)
+
+    def _run():
+        try:
+            history = model.fit(callbacks=[*callbacks, callback], verbose=0, **fit_kwargs)
+            events.put({'type': 'done', 'history': history.history})
+        except Exception as e:
+            events.put({'type': 'error', 'error': e})
+
+    thread = threading.Thread(target=_run, name='training', daemon=True)
+    thread.start()
+    return thread
+
+
+def _format_seconds(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    return f"{minutes}m {seconds:02d}s" if minutes else f"{seconds}s"
+
+
+def format_progress(event):
+    """One status line for a batch event, e.g. for the Train tab."""
+    line = f"Epoch {event['epoch']}/{event['epochs']}"
+    if event['steps']:
+        line += f" - step {event['step']}/{event['steps']}"
+    if event['accuracy'] is not None:
+        line += f" - Train Acc {event['accuracy'] * 100:.2f}%"
+    line += f" - {event['samples_per_sec']:,.0f} samples/s"
+    if event['eta'] is not None:
+        line += f" - ETA {_format_seconds(event['eta'])}"
+    return line
+
+
+# ============================================================================
+# TRAINING RUN
+# ============================================================================
+
+ARCHITECTURES = {
+    "MLP": create_mlp,
+    "Small CNN": create_small_cnn,
+    "Deeper CNN": create_deeper_cnn,
+}
+
+
+class TrainingCancelled(Exception):
+    """Raised by train_model() when its stop_event was set part-way through."""
+
+
+# The arrays are memory-mapped from artifacts/mnist_cache/ (see dataset.py),
+# so every worker process shares one copy through the page cache
+@lazy_value('MNIST dataset')
+def load_mnist():
+    """Load normalised MNIST. Returns ((x_train, y_train), (x_test, y_test))."""
+    print("Loading MNIST dataset...")
+    (x_train, y_train), (x_test, y_test) = dataset.load_mnist()
+    print(f"Dataset loaded: {x_train.shape[0]} training images, {x_test.shape[0]} test images")
+    return (x_train, y_train), (x_test, y_test)
+
+
+def train_model(architecture, epochs, batch_size, tflite_export="None", input_pipeline="NumPy arrays",
+                val_every=1, val_subset=None, profile=DEFAULT_PROFILE, stop_event=None, sweep_id=None,
+                sweep_trial=None):
+    """
+    Train a model (MLP or CNN), save it and record the run in the database.
+
+    A generator that yields the status text after each update, for the
+    Train tab to show.
+
+    tflite_export can be "Float" or "Int8" to also write a .tflite copy of
+    the model; its accuracy drift on x_test is saved with the run.
+
+    input_pipeline is "NumPy arrays" (pass the arrays straight to fit) or
+    "tf.data" (see dataset.make_tf_dataset). Each epoch's time is shown so
+    the two can be compared.
+
+    val_every / val_subset: validate every k epochs, and/or on a fixed
+    stratified sample of val_subset test images (see validation_schedule).
+    Skipping or shrinking validation makes epochs faster; the last epoch
+    is always evaluated on the full test set.
+
+    profile is one of profiles.PERFORMANCE_PROFILES: it sets the thread
+    pools, XLA compilation and bfloat16 mixed precision, and is stored
+    with the run. The thread pools can only be set before TensorFlow has
+    run anything, which is always true in a job's worker process.
+
+    Setting stop_event (anything with is_set()) stops training after the
+    current batch and raises TrainingCancelled. The partial run is removed
+    from the database, unless it's a sweep trial (sweep_id/sweep_trial
+    set) - then its metrics are kept so the sweep can compare it.
+    """
+    epochs = int(epochs)
+    batch_size = int(batch_size)
+    if architecture not in ARCHITECTURES:
+        raise ValueError(f"Unknown architecture '{architecture}'")
+    if input_pipeline not in dataset.INPUT_PIPELINES:
+        raise ValueError(f"Unknown input pipeline '{input_pipeline}'")
+    get_profile(profile)   # raises ValueError for an unknown profile
+    apply_threading(profile)
+
+    val_subset = int(val_subset) if val_subset else None
+    schedule = validation_schedule(epochs, val_every, val_subset)
+
+    with timed('train.load_data'):
+        (x_train, y_train), (x_test, y_test) = load_mnist()
+    subset = dataset.stratified_subset(y_test, val_subset) if val_subset else None
+
+    if input_pipeline == "tf.data":
+        # Built once and reused every epoch (the uint8 data is cached after epoch 1)
+        (x_train_u8, _), (x_test_u8, _) = dataset.load_mnist_uint8()
+        train_data = dataset.make_tf_dataset(x_train_u8, y_train, batch_size, shuffle=True)
+        full_val = dataset.make_tf_dataset(x_test_u8, y_test, batch_size)
+        subset_val = dataset.make_tf_dataset(x_test_u8[subset], y_test[subset], batch_size) if val_subset else None
+        fit_args = dict(x=train_data, epochs=epochs)
+    else:
+        full_val = (x_test, y_test)
+        subset_val = (x_test[subset], y_test[subset]) if val_subset else None
+        fit_args = dict(x=x_train, y=y_train, epochs=epochs, batch_size=batch_size)
+    validation = ValidationCallback(schedule, full_val, subset_val, batch_size)
+
+    start_time = time.time()
+    new_model = ARCHITECTURES[architecture](profile=profile)
+
+    precision = " (bfloat16 mixed precision)" if uses_mixed_precision(profile) else ""
+    validating = "every epoch" if int(val_every) == 1 else f"every {int(val_every)} epochs"
+    if val_subset:
+        validating += f" on {len(subset)} test images (full test set on the last epoch)"
+    yield (f"Starting training ({architecture})...\nEpochs: {epochs}, Batch Size: {batch_size}, "
+           f"Input: {input_pipeline}\nProfile: {profile}{precision}\nValidating {validating}\n\n")
+
+    # One fit() call for the whole run, on a background thread. Progress
+    # comes back through a queue and is yielded from here
+    stop_event = stop_event if stop_event is not None else threading.Event()
+    events = queue.Queue()
+    start_fit(new_model, events, fit_args, batch_size, stop_event=stop_event, callbacks=[validation])
+
+    # run_id comes from the database once the first epoch is recorded.
+    # Epoch metrics are written together at the end, except in sweeps,
+    # which compare trials on them while they train
+    run_id = None
+    metrics = MetricsBuffer(flush_every=1 if sweep_id is not None else None)
+    all_results = []
+    epoch_times = []
+    last_val = None
+    try:
+        while True:
+            event = events.get()
+
+            if event['type'] == 'batch':
+                # Live progress line under the finished epochs
+                finished = "\n".join(all_results) + "\n\n" if all_results else ""
+                yield finished + format_progress(event)
+                continue
+            if event['type'] == 'error':
+                raise event['error']
+            if event['type'] == 'done':
+                break
+
+            # End of an epoch
+            epoch = event['epoch']
+            logs = event['logs']
+            epoch_times.append(event['time'])
+            # Epoch time without the validation at the end of it
+            observe('train.epoch', event['time'] - validation.seconds.get(epoch, 0.0))
+            print(f"Finished epoch {epoch}/{epochs}")
+
+            # The schedule says what should have run, but a stopped epoch skips
+            # its validation - only record a kind if there's an accuracy for it
+            val_acc = logs.get('val_accuracy') if schedule.get(epoch) else None
+            val_kind = schedule.get(epoch) if val_acc is not None else None
+            if val_acc is not None:
+                last_val = val_acc
+
+            # Save metrics to database (create the run on the first epoch)
+            with timed('train.db_write'):
+                if run_id is None:
+                    run_id, model_filename = register_run(architecture, epochs, batch_size, val_acc,
+                                                          time.time() - start_time, sweep_id, sweep_trial, profile)
+                metrics.add(run_id, epoch, logs['accuracy'], val_acc, val_kind)
+
+            if val_acc is None:
+                val_text = "not validated"
+            else:
+                val_text = f"{val_acc * 100:.2f}%" + (" (subset)" if val_kind == 'subset' else "")
+            all_results.append(
+                f"Epoch {epoch}/{epochs}: Train Acc = {logs['accuracy'] * 100:.2f}%, "
+                f"Val Acc = {val_text} ({event['time']:.1f}s)"
+            )
+            yield "\n".join(all_results) + "\n\n"
+    finally:
+        # Stops the background fit if whoever is reading gives up mid-run
+        stopped = stop_event.is_set()
+        stop_event.set()
+
+    if stopped:
+        if run_id is not None and sweep_id is not None:
+            with timed('train.db_write'), transaction():
+                metrics.flush()
+                finish_run(run_id, time.time() - start_time, last_val)
+            raise TrainingCancelled("\n".join(all_results) + "\n\nStopped early by the sweep.")
+        if run_id is not None:
+            delete_run(run_id)
+        raise TrainingCancelled("\n".join(all_results) + "\n\nTraining cancelled.")
+
+    # Save model file (plus TFLite export if asked for)
+    model_path = f'artifacts/{model_filename}'
+    tflite_mode = None if tflite_export in (None, "None") else tflite_export.lower()
+    tflite_path = save_model(new_model, model_path, tflite=tflite_mode, calibration_data=x_train)
+
+    tflite_summary = ""
+    if tflite_path:
+        yield "\n".join(all_results) + f"\n\nChecking {tflite_export} TFLite export against the Keras model..."
+        with timed('train.tflite_check'):
+            keras_acc, tflite_acc = tflite_accuracy_drift(new_model, tflite_path, x_test, y_test)
+        drift = keras_acc - tflite_acc
+        tflite_summary = (f"\nTFLite ({tflite_export}) saved to: {tflite_path}"
+                          f"\nTFLite accuracy: {tflite_acc * 100:.2f}% (drift {drift * 100:+.2f} points vs Keras)")
+
+    total_duration = time.time() - start_time
+    # Everything left for the run goes in one commit. The last epoch was a
+    # full evaluation - that's the run's result
+    with timed('train.db_write'), transaction():
+        metrics.flush()
+        if tflite_path:
+            save_tflite_results(run_id, tflite_mode, tflite_acc, drift)
+        finish_run(run_id, total_duration, last_val)
+        # The Predict tab switches over to it if it's the new best
+        update_best_model(run_id)
+    observe('train.run', total_duration)
+
+    yield ("\n".join(all_results) + f"\n\nTraining Complete!\nModel saved to: {model_path}{tflite_summary}"
+           f"\nSaved to database with Run ID {run_id}"
+           f"\nTotal time: {total_duration:.1f}s (mean epoch {np.mean(epoch_times):.1f}s with {input_pipeline})")
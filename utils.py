@@ -1,36 +1,140 @@
 """
 Image preprocessing function to avoid repeating code.
+
+preprocess() turns one image or a stack of N images into model input in
+a single pass: greyscale, empty check, resize to 28×28, inversion and
+normalisation. It works on the whole stack at once with NumPy and only
+copies the pixels when it has to, so the Predict tab (one image) and
+bulk scoring (thousands) share the same code.
 """
 
 from PIL import Image
 import numpy as np
 
+from instrumentation import timed
+
+
+# Images whose mean brightness (0-255, before inverting) is above this count as empty
+EMPTY_THRESHOLD = 250
+
+# ITU-R 601 luma weights in 16-bit fixed point - the same sums PIL's convert('L') does
+_LUMA_WEIGHTS = np.array([19595, 38470, 7471], dtype='uint32')
+
 
 # ============================================================================
 # IMAGE PREPROCESSING
 # ============================================================================
 
+def _greyscale(images):
+    """
+    uint8 array of shape (N, H, W) from a stack of greyscale/RGB/RGBA images.
+
+    Greyscale uint8 input comes back as-is (no copy). Alpha is ignored,
+    like PIL's convert('L').
+    """
+    if images.dtype != np.uint8:
+        images = images.astype('uint8')
+    if images.ndim == 3:
+        return images
+    if images.shape[-1] == 1:
+        return images[..., 0]
+    # Integer maths on the whole stack at once, rounded the way PIL does it
+    luma = images[..., :3] @ _LUMA_WEIGHTS
+    luma += 0x8000
+    luma >>= 16
+    return luma.astype('uint8')
+
+
+def _as_stack(images):
+    """
+    (uint8 stack of shape (N, H, W), whether a single image was passed).
+
+    A single image is a PIL image, an (H, W) array or an (H, W, 3/4) array;
+    anything else is a stack. A list of differently sized images is fine
+    too - they're resized one by one.
+    """
+    if isinstance(images, Image.Image):
+        if images.mode not in ('L', 'RGB', 'RGBA'):
+            images = images.convert('L')
+        return _greyscale(np.asarray(images)[np.newaxis]), True
+
+    if isinstance(images, (list, tuple)):
+        stacks = [_as_stack(image)[0] for image in images]
+        if len({stack.shape[1:] for stack in stacks}) == 1:
+            return np.concatenate(stacks), False
+        return [stack[0] for stack in stacks], False
+
+    images = np.asarray(images)
+    single = images.ndim == 2 or (images.ndim == 3 and images.shape[-1] in (3, 4))
+    if single:
+        images = images[np.newaxis]
+    return _greyscale(images), single
+
+
+def _resize(stack, size):
+    """Resize every image to size×size (PIL's default bicubic, as before)."""
+    if not isinstance(stack, list) and stack.shape[1:] == (size, size):
+        return stack
+    out = np.empty((len(stack), size, size), dtype='uint8')
+    for i, image in enumerate(stack):
+        if image.shape == (size, size):
+            out[i] = image
+        else:
+            out[i] = np.asarray(Image.fromarray(image).resize((size, size)))
+    return out
+
+
+@timed('image.preprocess')
+def preprocess(images, invert=False, dtype='float32', size=28):
+    """
+    Turn one image or a stack of images into model input in one pass.
+
+    Args:
+        images: a PIL image, an array of shape (H, W) / (H, W, C), a stack
+            of shape (N, H, W) / (N, H, W, C), or a list of images
+        invert (bool): flip black and white (the Sketchpad draws black on
+            white, MNIST digits are white on black)
+        dtype (str): 'float32' for 0-1 values, 'uint8' for 0-255
+        size (int): output width and height
+
+    Returns:
+        tuple: (pixels, empty). For a single image pixels has shape
+        (size, size) and empty is a bool; for a stack they have shapes
+        (N, size, size) and (N,). An image is empty if it's almost all
+        white (before inverting).
+    """
+    if dtype not in ('float32', 'uint8'):
+        raise ValueError(f"dtype must be 'float32' or 'uint8', not '{dtype}'")
+
+    stack, single = _as_stack(images)
+
+    # Empty check on the full-resolution pixels (integer sums, no float64 copy)
+    if isinstance(stack, list):
+        means = np.array([image.sum(dtype='uint64') / image.size for image in stack])
+    else:
+        means = stack.sum(axis=(1, 2), dtype='uint64') / (stack.shape[1] * stack.shape[2])
+    empty = means > EMPTY_THRESHOLD
+
+    # Resizing first means inverting/normalising only touch 28×28 pixels
+    pixels = _resize(stack, size)
+    if invert:
+        pixels = np.subtract(255, pixels, dtype='uint8')
+
+    if dtype == 'float32':
+        pixels = pixels.astype('float32')
+        pixels /= 255.0
+    elif not pixels.flags.owndata:
+        # Don't hand back a view of the caller's (or PIL's) pixels
+        pixels = pixels.copy()
+
+    if single:
+        return pixels[0], bool(empty[0])
+    return pixels, empty
+
+
 def preprocess_image(image):
     """
     Convert uploaded image so the model can use it.
     Makes it greyscale, resizes to 28x28, and normalises to 0-1.
     """
-    # Convert to PIL if needed
-    if isinstance(image, np.ndarray):
-        if len(image.shape) == 3:
-            img = Image.fromarray(image.astype('uint8'))
-        else:
-            img = Image.fromarray(image.astype('uint8'))
-    else:
-        img = image
-    
-    # Greyscale
-    img = img.convert('L')
-    
-    # Resize to 28×28
-    img = img.resize((28, 28))
-    
-    # Normalise to 0-1
-    img_array = np.array(img).astype('float32') / 255.0
-    
-    return img_array
+    return preprocess(image)[0]